@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import threading
+
+import openai
+from dotenv import load_dotenv
+from django.core.cache import InvalidCacheBackendError, caches
+
+from FindBestStation import http_client, metrics
+from FindBestStation.cache import LRUCache
+from FindBestStation.singleflight import SingleFlight
+
+_MISSING = object()
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+# 스레드마다 세션을 새로 만들지 않고 공용 커넥션 풀을 쓴다
+openai.requestssession = http_client.get_session(openai.api_base)
+OPENAI_REQUEST_TIMEOUT = float(os.getenv('OPENAI_REQUEST_TIMEOUT', 30))
+
+# 역 설명 캐시: in-process LRU -> Django 캐시 백엔드(pregenerate_explanations로 미리 채울 수 있다)
+EXPLANATION_CACHE_TTL = int(os.getenv('EXPLANATION_CACHE_TTL', 30 * 24 * 3600))
+EXPLANATION_CACHE_SIZE = int(os.getenv('EXPLANATION_CACHE_SIZE', 4096))
+EXPLANATION_CACHE_ALIAS = os.getenv('EXPLANATION_CACHE_ALIAS', 'explanations')
+# 여러 역/view_type 설명을 JSON 응답 하나로 한 번에 만든다 (0이면 항목마다 따로 호출)
+EXPLANATION_BATCH = os.getenv('EXPLANATION_BATCH', '1') != '0'
+VIEW_TYPES = ('pc', 'mobile')
+
+# Factor 키워드 매핑
+factor_keywords = {
+    '2': 'MZ세대에게 인기 있는 곳',
+    '3': '맛있는 밥집이 많은 곳',
+    '4': '아름다운 카페들이 있는 곳',
+    '5': '멋진 술집이 많은 곳',
+    '6': '재미있는 액티비티를 즐길 수 있는 곳',
+    '7': '쇼핑하기 좋은 곳',
+}
+
+
+# chatgpt에 넣기
+def get_completion(prompt, json_mode=False):
+    options = {'response_format': {'type': 'json_object'}} if json_mode else {}
+    metrics.count('upstream_calls', provider='openai')
+    query = openai.ChatCompletion.create(
+        model="gpt-3.5-turbo",
+        messages=[
+            {'role': 'user', 'content': prompt}
+        ],
+        max_tokens=2048 if json_mode else 1024,
+        n=1,
+        stop=None,
+        temperature=0.5,
+        request_timeout=(http_client.HTTP_CONNECT_TIMEOUT, OPENAI_REQUEST_TIMEOUT),
+        **options,
+    )
+    response = query.choices[0].message["content"]
+    return response
+
+
+def normalize_factors(factors):
+    # 순서/중복/타입(int, str)이 달라도 같은 팩터 조합이면 같은 값. 모르는 팩터면 KeyError
+    factors = sorted({str(factor) for factor in factors or []})
+    for factor in factors:
+        if factor not in factor_keywords:
+            raise KeyError(factor)
+    return tuple(factors)
+
+
+def build_prompt(station_name, factors, view_type):
+    factors_string = ', '.join(factor_keywords[factor] for factor in normalize_factors(factors))
+    if factors_string:
+        if view_type == 'pc':
+            return f"너는 만남 장소를 추천해주는 친절한 상담원이에요. 만나는 장소로 '{station_name}'이 적합한 이유를 '{factors_string}' 관점에서 2~3문장으로 설명해주세요. 만나는 장소를 추천하는 느낌으로 자연스럽지만 존댓말로 말해주고 그 역의 특성이나 역 주변 유명한 들도 함께 언급해주면 좋겠어요."
+        # 모바일 버전
+        return f"너는 만남 장소를 추천해주는 친절한 상담원이에요. 만나는 장소로 '{station_name}'이 적합한 이유를 '{factors_string}' 관점에서 한 문장으로 요약해세요. 만나는 장소를 추천하는 느낌으로 자연스럽지만 존댓말로 말해주고 그 역의 특성이나 역 주변 유명한 것들도 함께 언급해주면 좋겠어요. "
+    if view_type == 'pc':
+        return f"너는 만남 장소를 추천해주는 친절한 상담원이에요. 만나는 장소로 '{station_name}'이 적합한 이유를 2~3문장으로 설명해주세요. 만나는 장소를 추천하는 느낌으로 자연스럽지만 존댓말로 말해주고 그 역의 특성이나 역 주변 유명한 들도 함께 언급해주면 좋겠어요."
+    # 모바일 버전
+    return f"너는 만남 장소를 추천해주는 친절한 상담원이에요. 만나는 장소로 '{station_name}'이 적합한 이유를 한 문장으로 요약해주세요. 만나는 장소를 추천하는 느낌으로 자연스럽지만 존댓말로 말해주고 그 역의 특성이나 역 주변 유명한 것들도 함께 언급해주면 좋겠어요."
+
+
+def build_batch_prompt(station_names, factors, view_types=VIEW_TYPES):
+    # 여러 역의 pc/mobile 설명을 한 번에 JSON으로 받는 프롬프트
+    factors_string = ', '.join(factor_keywords[factor] for factor in normalize_factors(factors))
+    viewpoint = f" '{factors_string}' 관점에서" if factors_string else ''
+    rules = {
+        'pc': '"pc"에는 2~3문장으로 설명',
+        'mobile': '"mobile"에는 한 문장으로 요약',
+    }
+    example = {name: {view_type: '...' for view_type in view_types} for name in station_names}
+    return (
+        "너는 만남 장소를 추천해주는 친절한 상담원이에요. "
+        f"다음 역들이 만나는 장소로 적합한 이유를{viewpoint} 역마다 설명해주세요: "
+        f"{', '.join(station_names)}. "
+        f"{', '.join(rules[view_type] for view_type in view_types)}해주세요. "
+        "만나는 장소를 추천하는 느낌으로 자연스럽지만 존댓말로 말해주고 그 역의 특성이나 역 주변 유명한 것들도 함께 언급해주면 좋겠어요. "
+        "다른 말 없이 아래와 같은 모양의 JSON 객체 하나로만 답해주세요: "
+        f"{json.dumps(example, ensure_ascii=False)}"
+    )
+
+
+def parse_batch_response(text, station_names, view_types=VIEW_TYPES):
+    """build_batch_prompt 응답 -> {(역 이름, view_type): 설명}. 알아볼 수 없는 항목은 빠진다."""
+    text = (text or '').strip()
+    if text.startswith('```'):
+        # ```json ... ``` 으로 감싸서 답하는 경우
+        text = text[text.find('{'):text.rfind('}') + 1]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    parsed = {}
+    for station_name in station_names:
+        item = data.get(station_name)
+        if not isinstance(item, dict):
+            continue
+        for view_type in view_types:
+            value = item.get(view_type)
+            if isinstance(value, str) and value.strip():
+                parsed[(station_name, view_type)] = value.strip()
+    return parsed
+
+
+class ExplanationService:
+    """(역 이름, 팩터 조합, view_type)별 GPT 설명을 만들고 캐시한다. 프롬프트가 이 세 값으로만 정해진다."""
+
+    def __init__(self, complete=None, shared=_MISSING, ttl=EXPLANATION_CACHE_TTL, maxsize=EXPLANATION_CACHE_SIZE):
+        self.complete = complete
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._shared = shared
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.completions = 0
+        # 같은 프롬프트를 동시에 만드는 호출은 하나로 합친다
+        self.flight = SingleFlight('explanation')
+
+    @property
+    def shared(self):
+        if self._shared is _MISSING:
+            try:
+                self._shared = caches[EXPLANATION_CACHE_ALIAS]
+            except InvalidCacheBackendError:
+                self._shared = None
+        return self._shared
+
+    def key(self, station_name, factors, view_type):
+        return 'explanation:{}:{}:{}'.format(station_name, ','.join(normalize_factors(factors)), view_type)
+
+    def get_cached(self, station_name, factors, view_type):
+        key = self.key(station_name, factors, view_type)
+        text = self.local.get(key)
+        if text is None and self.shared is not None:
+            text = self.shared.get(key)
+            if text is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self.local.set(key, text)
+        metrics.count('cache_hits' if text is not None else 'cache_misses', cache='explanation')
+        return text
+
+    def set(self, station_name, factors, view_type, text):
+        key = self.key(station_name, factors, view_type)
+        self.local.set(key, text)
+        if self.shared is not None:
+            self.shared.set(key, text, timeout=self.ttl)
+
+    def get(self, station_name, factors, view_type):
+        """캐시에 있으면 그대로, 없으면 모델을 불러서 만든 설명 문자열."""
+        text = self.get_cached(station_name, factors, view_type)
+        if text is not None:
+            return text
+        return self.generate(station_name, factors, view_type)
+
+    def generate(self, station_name, factors, view_type):
+        # 캐시를 보지 않고 모델을 불러서 새로 만든 뒤 저장한다
+        return self.flight.do(self.key(station_name, factors, view_type),
+                              self._generate, station_name, factors, view_type)
+
+    def _generate(self, station_name, factors, view_type):
+        complete = self.complete or get_completion
+        text = complete(build_prompt(station_name, factors, view_type))
+        with self._lock:
+            self.completions += 1
+        self.set(station_name, factors, view_type, text)
+        return text
+
+    def explain(self, station_name, factors, view_type):
+        # find_optimal_station 응답에 넣는 형태 (기존 CGPT/query 응답과 같음)
+        try:
+            return {'response': self.get(station_name, factors, view_type)}
+        except Exception as e:
+            return {'error': str(e)}
+
+    def explain_many(self, station_names, factors, view_types=VIEW_TYPES):
+        """{(역 이름, view_type): explain() 결과}. 캐시에 없는 항목은 한 번의 JSON 응답으로 만들고,
+        응답에서 읽지 못한 항목만 따로 호출한다."""
+        results = {}
+        missing = []
+        for station_name in dict.fromkeys(station_names):
+            for view_type in view_types:
+                text = self.get_cached(station_name, factors, view_type)
+                if text is not None:
+                    results[(station_name, view_type)] = {'response': text}
+                else:
+                    missing.append((station_name, view_type))
+
+        if EXPLANATION_BATCH and len(missing) > 1:
+            for (station_name, view_type), text in self.generate_batch(missing, factors).items():
+                results[(station_name, view_type)] = {'response': text}
+
+        for station_name, view_type in missing:
+            if (station_name, view_type) not in results:
+                results[(station_name, view_type)] = self.explain(station_name, factors, view_type)
+        return results
+
+    def generate_batch(self, pairs, factors):
+        # pairs: [(역 이름, view_type)]. 읽어낸 항목만 캐시에 넣고 돌려준다
+        station_names = list(dict.fromkeys(station_name for station_name, _ in pairs))
+        view_types = [view_type for view_type in VIEW_TYPES if view_type in {v for _, v in pairs}]
+        complete = self.complete or get_completion
+        prompt = build_batch_prompt(station_names, factors, view_types)
+        try:
+            text = self.flight.do(('batch', prompt), complete, prompt, json_mode=True)
+        except Exception as e:
+            logger.warning("Batched explanation failed: %s", e)
+            return {}
+        with self._lock:
+            self.completions += 1
+        parsed = parse_batch_response(text, station_names, view_types)
+        generated = {}
+        for pair in pairs:
+            if pair in parsed:
+                self.set(pair[0], factors, pair[1], parsed[pair])
+                generated[pair] = parsed[pair]
+        if len(generated) < len(pairs):
+            logger.warning("Batched explanation returned %d/%d items. Falling back per item.", len(generated), len(pairs))
+        return generated
+
+    def pregenerate(self, station_names, factor_sets, view_types=VIEW_TYPES, overwrite=False):
+        # 역 x 팩터 조합 x view_type 설명을 미리 만들어 둔다. 새로 만든 개수를 돌려준다
+        generated = 0
+        for station_name in station_names:
+            for factors in factor_sets:
+                for view_type in view_types:
+                    if not overwrite and self.get_cached(station_name, factors, view_type) is not None:
+                        continue
+                    self.generate(station_name, factors, view_type)
+                    generated += 1
+        return generated
+
+    def stats(self):
+        return {
+            'local_hits': self.local.hits,
+            'shared_hits': self.shared_hits,
+            'completions': self.completions,
+            'local_size': len(self.local),
+        }
+
+
+explanation_service = ExplanationService()
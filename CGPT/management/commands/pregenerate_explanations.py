@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from CGPT.explanations import VIEW_TYPES, explanation_service
+from FindBestStation.models import Station
+
+
+class Command(BaseCommand):
+    help = "역 x 팩터 조합 x view_type 설명을 미리 만들어 설명 캐시에 넣는다 (이미 있는 것은 건너뜀)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factor-set', action='append', dest='factor_sets',
+                            help="쉼표로 구분한 팩터 조합 (예: 3,4). 여러 번 줄 수 있다. "
+                                 "기본값은 팩터 없음 + 팩터 하나씩")
+        parser.add_argument('--station', action='append', dest='stations', help='역 이름 (기본값: 전체 역)')
+        parser.add_argument('--view-type', action='append', dest='view_types', choices=VIEW_TYPES)
+        parser.add_argument('--overwrite', action='store_true', help='캐시에 있어도 다시 만든다')
+
+    def handle(self, *args, **options):
+        if options['factor_sets']:
+            factor_sets = [[factor for factor in value.split(',') if factor] for value in options['factor_sets']]
+        else:
+            factor_sets = [[]] + [[str(factor)] for factor in range(2, 8)]
+        station_names = options['stations'] or list(dict.fromkeys(
+            Station.objects.order_by('id').values_list('station_name', flat=True)))
+        view_types = options['view_types'] or VIEW_TYPES
+
+        total = len(station_names) * len(factor_sets) * len(view_types)
+        self.stdout.write(f"{len(station_names)} stations x {len(factor_sets)} factor sets x "
+                          f"{len(view_types)} view types = {total} explanations")
+        generated = explanation_service.pregenerate(
+            station_names, factor_sets, view_types=view_types, overwrite=options['overwrite'])
+        self.stdout.write(self.style.SUCCESS(f"Generated {generated} explanations ({total - generated} cached)."))
@@ -1,3 +1,100 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from . import views
+from .explanations import ExplanationService, build_prompt, parse_batch_response
+
+
+class ExplanationServiceTestCase(SimpleTestCase):
+    def setUp(self):
+        self.prompts = []
+        self.shared = LocMemCache('explanations-test', {})
+        self.shared.clear()
+
+    def complete(self, prompt, json_mode=False):
+        self.prompts.append(prompt)
+        return f'answer {len(self.prompts)}'
+
+    def test_prompt_uses_factors_and_view_type(self):
+        self.assertIn('맛있는 밥집', build_prompt('강남역', [3], 'pc'))
+        self.assertIn('2~3문장', build_prompt('강남역', [3], 'pc'))
+        self.assertIn('한 문장', build_prompt('강남역', [3], 'mobile'))
+        self.assertNotIn('관점에서', build_prompt('강남역', [], 'pc'))
+
+    def test_repeat_explanations_are_cached(self):
+        service = ExplanationService(complete=self.complete, shared=self.shared)
+        first = service.get('강남역', [4, 3], 'pc')
+        # 순서와 타입이 달라도 같은 팩터 조합
+        self.assertEqual(service.get('강남역', ['3', '4'], 'pc'), first)
+        self.assertEqual(len(self.prompts), 1)
+        service.get('강남역', [3, 4], 'mobile')
+        self.assertEqual(len(self.prompts), 2)
+
+        # 다른 워커(프로세스)는 공유 캐시에서 읽는다
+        other = ExplanationService(complete=self.complete, shared=self.shared)
+        self.assertEqual(other.get('강남역', [3, 4], 'pc'), first)
+        self.assertEqual(other.stats()['shared_hits'], 1)
+        self.assertEqual(len(self.prompts), 2)
+
+    def test_pregenerate_skips_cached(self):
+        service = ExplanationService(complete=self.complete, shared=self.shared)
+        service.get('강남역', [], 'pc')
+        generated = service.pregenerate(['강남역', '역삼역'], [[], ['3']])
+        self.assertEqual(generated, 7)
+        self.assertEqual(service.pregenerate(['강남역', '역삼역'], [[], ['3']]), 0)
+
+    def test_errors_are_not_cached(self):
+        def failing(prompt):
+            raise RuntimeError('timeout')
+
+        service = ExplanationService(complete=failing, shared=self.shared)
+        self.assertEqual(service.explain('강남역', [3], 'pc'), {'error': 'timeout'})
+        self.assertIsNone(service.get_cached('강남역', [3], 'pc'))
+
+    def batch_complete(self, prompt, json_mode=False):
+        self.prompts.append(prompt)
+        if not json_mode:
+            return 'single'
+        # 역삼역 mobile은 빠진 응답
+        return '```json\n' + json.dumps({
+            '강남역': {'pc': '강남 pc', 'mobile': '강남 mobile'},
+            '역삼역': {'pc': '역삼 pc'},
+        }, ensure_ascii=False) + '\n```'
+
+    def test_explain_many_uses_one_batched_completion(self):
+        service = ExplanationService(complete=self.batch_complete, shared=self.shared)
+        results = service.explain_many(['강남역', '역삼역'], [3])
+        self.assertEqual(results[('강남역', 'pc')], {'response': '강남 pc'})
+        self.assertEqual(results[('역삼역', 'pc')], {'response': '역삼 pc'})
+        # 읽지 못한 항목만 따로 호출
+        self.assertEqual(results[('역삼역', 'mobile')], {'response': 'single'})
+        self.assertEqual(len(self.prompts), 2)
+
+        # 모두 캐시에 들어갔다
+        self.assertEqual(len(service.explain_many(['강남역', '역삼역'], [3])), 4)
+        self.assertEqual(len(self.prompts), 2)
+
+    def test_unparseable_batch_falls_back_per_item(self):
+        self.assertEqual(parse_batch_response('not json', ['강남역']), {})
+        service = ExplanationService(complete=lambda prompt, json_mode=False: 'not json', shared=self.shared)
+        results = service.explain_many(['강남역'], [])
+        self.assertEqual(results, {('강남역', 'pc'): {'response': 'not json'},
+                                   ('강남역', 'mobile'): {'response': 'not json'}})
+        self.assertEqual(service.stats()['completions'], 3)
+
+
+class QueryViewTestCase(SimpleTestCase):
+    def test_query_view(self):
+        service = ExplanationService(complete=lambda prompt: prompt, shared=None)
+        with mock.patch.object(views, 'explanation_service', service):
+            response = self.client.get(reverse('query_view'),
+                                       {'station_name': '강남역', 'factor': ['3'], 'view_type': 'pc'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'response': build_prompt('강남역', ['3'], 'pc')})
+
+            response = self.client.get(reverse('query_view'), {'station_name': '강남역', 'factor': ['9']})
+            self.assertEqual(response.status_code, 400)
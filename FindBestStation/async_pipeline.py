@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import os
+import weakref
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+
+from . import http_client, metrics, utils
+from .cache import transit_cache
+from .deadlines import DeadlineExceeded, expired, odsay_latency, remaining
+from .odsay_keys import get_key_scheduler
+from .ranking import SKIPPED, StreamingRanker
+from .regions import get_region_lookup
+from .singleflight import AsyncSingleFlight
+from .spatial import get_station_index
+from .subway_graph import get_subway_graph
+from .isochrones import get_isochrone_estimator
+from .transit_matrix import get_matrix_estimator
+
+# find_optimal_station의 asyncio 버전.
+# 스레드 풀 대신 이벤트 루프 하나에서 httpx.AsyncClient로 외부 API를 동시에 호출한다.
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', 100))
+# 한 워커(이벤트 루프)에서 동시에 진행할 ODsay 호출 수
+ASYNC_TRANSIT_CONCURRENCY = int(os.getenv('ASYNC_TRANSIT_CONCURRENCY', 64))
+
+# httpx 클라이언트와 세마포어는 이벤트 루프에 묶이므로 루프마다 따로 만든다
+_clients = weakref.WeakKeyDictionary()
+_semaphores = weakref.WeakKeyDictionary()
+
+logger = logging.getLogger(__name__)
+
+region_flight = AsyncSingleFlight('region')
+transit_flight = AsyncSingleFlight('transit')
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(http_client.HTTP_READ_TIMEOUT, connect=http_client.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=ASYNC_MAX_CONNECTIONS),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _transit_semaphore():
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(ASYNC_TRANSIT_CONCURRENCY)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+async def get_region_async(lon, lat):
+    lookup = get_region_lookup()
+    if lookup is not None:
+        region = lookup.lookup(lon, lat)
+        if region is not None:
+            return region
+    return await region_flight.do((lon, lat), request_region_async, lon, lat)
+
+
+async def request_region_async(lon, lat):
+    headers = {"Authorization": f"KakaoAK {utils.KAKAO_API_KEY}"}
+    metrics.count('upstream_calls', provider='kakao')
+    response = await get_async_client().get(
+        utils.KAKAO_REGION_URL, headers=headers, params={"x": lon, "y": lat})
+    if response.status_code == 200:
+        return utils.parse_region_documents(response.json())
+
+
+async def adjust_location_async(loc):
+    return utils.location_for_region(loc, await get_region_async(loc['lon'], loc['lat']))
+
+
+async def calculate_midpoint_async(locations):
+    with metrics.span('region'):
+        adjusted_locations = await asyncio.gather(*(adjust_location_async(loc) for loc in locations))
+    if any(loc is None for loc in adjusted_locations):
+        logger.warning("Failed to adjust locations: %s", locations)
+        return 0, 0
+    with metrics.span('midpoint'):
+        return utils.midpoint_of(adjusted_locations)
+
+
+async def find_nearest_stations_async(midpoint):
+    with metrics.span('candidates'):
+        if utils.STATION_SEARCH_MODE != 'kakao':
+            # 인덱스를 처음 만들 때만 DB를 읽는다
+            index = await sync_to_async(get_station_index)()
+            if len(index):
+                return utils.find_nearest_stations_local(midpoint)
+
+        headers = {"Authorization": f"KakaoAK {utils.KAKAO_API_KEY}"}
+        metrics.count('upstream_calls', provider='kakao')
+        response = await get_async_client().get(
+            utils.place_search_url, headers=headers, params=utils.kakao_station_search_params(midpoint))
+        if response.status_code == 200:
+            return utils.parse_station_documents(response.json())
+        logger.warning("Error in processing request: %s", response.status_code)
+        return []
+
+
+async def request_odsay_transit_time_async(start_x, start_y, end_x, end_y, api_key, timeout=None):
+    # ODsay 한 번 호출 -> (최소 소요시간(분) 또는 None, error payload 또는 None)
+    params = {"SX": start_x, "SY": start_y, "EX": end_x, "EY": end_y, "apiKey": api_key}
+    metrics.count('upstream_calls', provider='odsay')
+    kwargs = {} if timeout is None else {'timeout': httpx.Timeout(timeout[1], connect=timeout[0])}
+    started_at = asyncio.get_running_loop().time()
+    response = await get_async_client().get(utils.ODSAY_TRANSIT_URL, params=params, **kwargs)
+    response.raise_for_status()
+    odsay_latency.observe(asyncio.get_running_loop().time() - started_at)
+    return utils.parse_odsay_response(response.json())
+
+
+async def request_odsay_hedged_async(scheduler, api_key, start_x, start_y, end_x, end_y, deadline=None):
+    # utils.request_odsay_hedged의 asyncio 버전. 진 쪽 호출은 기다리지 않고 취소한다
+    delay = odsay_latency.hedge_delay()
+    timeout = utils.odsay_http_timeout(deadline)
+    calls = {asyncio.ensure_future(request_odsay_transit_time_async(
+        start_x, start_y, end_x, end_y, api_key, timeout=timeout)): api_key}
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(set(calls), timeout=remaining(deadline, delay))
+            if not done and not expired(deadline):
+                hedge_key, _ = scheduler.try_acquire(exclude={api_key})
+                if hedge_key is not None:
+                    metrics.count('odsay_hedges')
+                    calls[asyncio.ensure_future(request_odsay_transit_time_async(
+                        start_x, start_y, end_x, end_y, hedge_key, timeout=timeout))] = hedge_key
+
+        pending = set(calls)
+        first_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=remaining(deadline), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded()
+            for task in done:
+                try:
+                    minutes, error = task.result()
+                except (httpx.HTTPError, ValueError, requests.exceptions.RequestException) as e:
+                    first_error = first_error or e
+                    continue
+                return calls[task], minutes, error
+        raise first_error
+    finally:
+        for task in calls:
+            task.cancel()
+
+
+async def fetch_odsay_transit_time_async(start_x, start_y, end_x, end_y, deadline=None):
+    # 실패하면 None, 마감이 지나면 DeadlineExceeded
+    scheduler = get_key_scheduler()
+    for attempt in range(utils.ODSAY_MAX_ATTEMPTS):
+        if expired(deadline):
+            raise DeadlineExceeded()
+        api_key = await acquire_key_async(scheduler, remaining(deadline, utils.ODSAY_KEY_WAIT))
+        if api_key is None:
+            if expired(deadline):
+                raise DeadlineExceeded()
+            logger.warning("No ODsay API key has headroom.")
+            return None
+        if attempt:
+            metrics.count('odsay_retries')
+        try:
+            api_key, minutes, error = await request_odsay_hedged_async(
+                scheduler, api_key, start_x, start_y, end_x, end_y, deadline)
+        except (httpx.HTTPError, ValueError, requests.exceptions.RequestException) as e:
+            logger.warning("ODsay request failed: %s", e)
+            return None
+
+        if utils.handle_odsay_result(scheduler, api_key, error):
+            return minutes
+        if utils.odsay_error_code(error)[0] in utils.ODSAY_ROUTE_ERROR_CODES:
+            return None
+        # 다른 키로 다시 시도
+    return None
+
+
+async def acquire_key_async(scheduler, timeout):
+    # 이벤트 루프를 막지 않도록 time.sleep 대신 asyncio.sleep으로 기다린다
+    until = asyncio.get_running_loop().time() + timeout
+    while True:
+        key, wait = scheduler.try_acquire()
+        if key is not None or wait is None:
+            return key
+        left = until - asyncio.get_running_loop().time()
+        if left <= 0:
+            return None
+        await asyncio.sleep(min(wait, left))
+
+
+async def get_transit_time_async(start_x, start_y, end_x, end_y, deadline=None):
+    if utils.TRANSIT_TIME_PROVIDER == 'matrix':
+        estimator = await sync_to_async(get_matrix_estimator)()
+        if estimator is not None:
+            minutes = estimator.transit_time(start_x, start_y, end_x, end_y)
+            if minutes is not None:
+                return minutes
+    elif utils.TRANSIT_TIME_PROVIDER == 'graph':
+        graph = await sync_to_async(get_subway_graph)()
+        if graph is not None:
+            minutes = graph.transit_time(start_x, start_y, end_x, end_y)
+            if minutes is not None:
+                return minutes
+    elif utils.TRANSIT_TIME_PROVIDER == 'grid':
+        estimator = await sync_to_async(get_isochrone_estimator)()
+        if estimator is not None:
+            minutes = estimator.transit_time(start_x, start_y, end_x, end_y)
+            if minutes is not None:
+                return minutes
+
+    minutes = transit_cache.get_local(start_x, start_y, end_x, end_y)
+    if minutes is None:
+        # 공유 캐시(DB)는 이벤트 루프를 막지 않도록 스레드에서 읽는다
+        minutes = await sync_to_async(transit_cache.get_shared, thread_sensitive=False)(start_x, start_y, end_x, end_y)
+    if minutes is not None:
+        return minutes
+    if transit_cache.is_recent_failure(start_x, start_y, end_x, end_y):
+        return await sync_to_async(utils.fallback_transit_time)(start_x, start_y, end_x, end_y)
+    return await transit_flight.do(transit_cache.key(start_x, start_y, end_x, end_y),
+                                   fetch_and_cache_transit_time_async, start_x, start_y, end_x, end_y,
+                                   timeout=remaining(deadline), deadline=deadline)
+
+
+async def fetch_and_cache_transit_time_async(start_x, start_y, end_x, end_y, deadline=None):
+    # 마감이 지나면 DeadlineExceeded (실패로 기억하지 않는다)
+    async with _transit_semaphore():
+        minutes = await fetch_odsay_transit_time_async(start_x, start_y, end_x, end_y, deadline=deadline)
+    if minutes is None:
+        transit_cache.set_failure(start_x, start_y, end_x, end_y)
+        return await sync_to_async(utils.fallback_transit_time)(start_x, start_y, end_x, end_y)
+    await sync_to_async(transit_cache.set, thread_sensitive=False)(start_x, start_y, end_x, end_y, minutes)
+    return minutes
+
+
+async def find_best_station_async(stations, user_locations, factors, deadline=None):
+    # deadline이 지나면 그때까지 받은 소요시간으로 순위를 매긴다 (받지 못한 칸은 추정값)
+    with metrics.span('scoring'):
+        # 역 테이블을 처음 만들 때만 DB를 읽는다
+        stations, factor_scores = await sync_to_async(utils.select_candidates)(stations, factors, user_locations)
+    ranker = StreamingRanker(stations, factor_scores, len(user_locations),
+                             lower_bounds=utils.transit_lower_bounds(stations, user_locations))
+    # 요청 하나에서 동시에 진행할 조회 수. 앞 순위 역부터 차례로 자리를 얻는다
+    limit = asyncio.Semaphore(utils.TRANSIT_FETCH_CONCURRENCY or max(len(stations) * len(user_locations), 1))
+
+    async def fetch(i, user):
+        async with limit:
+            # 기다리는 사이 걸러진 역이면 호출하지 않는다
+            if ranker.is_pruned(i):
+                return SKIPPED
+            station = stations[i]
+            return await get_transit_time_async(user['lon'], user['lat'], station['x'], station['y'], deadline=deadline)
+
+    # 태스크는 만들 때의 contextvar를 복사하므로 transit 단계 안에서 만든다
+    with metrics.span('transit'):
+        # 격자 표/노선 그래프로 구한 칸은 바로 넣고 나머지만 조회한다
+        known = await sync_to_async(utils.precomputed_transit_times)(stations, user_locations)
+        for (i, u), transit_time in known.items():
+            ranker.add(i, transit_time, u)
+        received = set(known)
+        tasks = {
+            asyncio.ensure_future(fetch(i, user)): (i, u)
+            for i in range(len(stations))
+            for u, user in enumerate(user_locations)
+            if (i, u) not in known and not ranker.is_settled(i)
+        }
+        pending = set(tasks)
+        # 걸러진 역이라 취소한 태스크 (취소는 다음 차례에 반영되므로 따로 기억한다)
+        cancelled = set()
+        try:
+            while pending:
+                finished, pending = await asyncio.wait(pending, timeout=remaining(deadline),
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                if not finished:
+                    break
+                for task in finished:
+                    if task.cancelled():
+                        continue
+                    i, u = tasks[task]
+                    try:
+                        transit_time = task.result()
+                    except DeadlineExceeded:
+                        continue
+                    except Exception as e:
+                        logger.warning("Exception occurred: %s", e)
+                        metrics.count('transit_fallbacks')
+                        transit_time = utils.TRANSIT_FALLBACK_MINUTES
+                    if transit_time is SKIPPED:
+                        continue
+                    received.add((i, u))
+                    for pruned in ranker.add(i, transit_time, u):
+                        logger.debug("Pruned station %s", stations[pruned]['station_name'])
+                        for other in pending:
+                            if tasks[other][0] == pruned:
+                                other.cancel()
+                                cancelled.add(other)
+                if ranker.done():
+                    # 걸러낸 역의 소요시간이 모자라 순위가 달라질 수 있으면 그 역들의 나머지 칸을 마저 조회한다
+                    reopened = set(ranker.reopen_if_unstable())
+                    carried = {task for task in pending if tasks[task][0] in reopened and task not in cancelled}
+                    # 이어서 기다리지 않는 조회는 응답 뒤에도 ODsay를 부르지 않도록 취소한다
+                    for task in pending - carried:
+                        task.cancel()
+                    pending = carried
+                    waiting = {tasks[task] for task in pending}
+                    for i in sorted(reopened):
+                        for u, user in enumerate(user_locations):
+                            if (i, u) not in received and (i, u) not in waiting:
+                                task = asyncio.ensure_future(fetch(i, user))
+                                tasks[task] = (i, u)
+                                pending.add(task)
+        finally:
+            for task in pending:
+                task.cancel()
+        estimated = await sync_to_async(utils.fill_estimated_times)(ranker, stations, user_locations, received)
+    with metrics.span('scoring'):
+        return utils.with_estimated_locations(utils.rank_stations(ranker.station_scores()), stations, estimated)
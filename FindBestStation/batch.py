@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+
+from asgiref.sync import sync_to_async
+
+from CGPT.explanations import explanation_service, normalize_factors
+
+from . import async_pipeline, metrics, utils
+from .cache import transit_cache
+from .ranking import StreamingRanker
+
+# 여러 모임(그룹)의 약속 장소를 한 번에 찾는다.
+# 그룹마다 find_best_station_async를 따로 부르면 같은 출발지의 지역 판별, 같은 중간 지점의 후보역 검색,
+# 같은 (출발지, 역) 소요시간 조회가 그룹 수만큼 반복되므로, 전체에서 겹치지 않는 것만 한 번씩 처리한다.
+BATCH_MAX_GROUPS = int(os.getenv('BATCH_MAX_GROUPS', 500))
+# 배치 하나에서 동시에 진행할 소요시간 조회 수 (그룹 전체가 나눠 쓴다)
+BATCH_TRANSIT_CONCURRENCY = int(os.getenv('BATCH_TRANSIT_CONCURRENCY', 32))
+
+logger = logging.getLogger(__name__)
+
+
+def location_key(loc):
+    return loc['lon'], loc['lat']
+
+
+def transit_pair_key(user, station):
+    # 소요시간 캐시와 같은 격자 키. 캐시에서 같은 값이 나올 구간은 한 번만 조회한다
+    return transit_cache.key(user['lon'], user['lat'], station['x'], station['y'])
+
+
+class BatchGroup:
+    def __init__(self, locations, factors):
+        self.locations = locations
+        self.factors = factors
+        self.midpoint = None
+        self.stations = []
+        self.factor_scores = []
+        self.best_stations = None
+        self.error = None
+        self.status = None
+
+    def fail(self, error, status):
+        self.error = error
+        self.status = status
+
+
+async def adjust_origins(groups):
+    # 겹치지 않는 출발지만 지역을 판별한다 -> {(lon, lat): 조정한 좌표 또는 None}
+    origins = {location_key(loc): loc for group in groups for loc in group.locations}
+    with metrics.span('region'):
+        adjusted = await asyncio.gather(*(async_pipeline.adjust_location_async(loc) for loc in origins.values()))
+    return dict(zip(origins, adjusted))
+
+
+async def search_candidates(groups):
+    # 같은 중간 지점은 후보역을 한 번만 찾는다
+    midpoints = list(dict.fromkeys(group.midpoint for group in groups))
+    with metrics.span('candidates'):
+        found = await asyncio.gather(*(async_pipeline.find_nearest_stations_async(midpoint) for midpoint in midpoints))
+    return dict(zip(midpoints, found))
+
+
+async def fetch_transit_times(pairs, concurrency=None):
+    # pairs: {pair key: (user, station)} -> {pair key: 소요시간(분)}. 실패하면 TRANSIT_FALLBACK_MINUTES
+    limit = asyncio.Semaphore(concurrency or BATCH_TRANSIT_CONCURRENCY or max(len(pairs), 1))
+
+    async def fetch(user, station):
+        async with limit:
+            try:
+                return await async_pipeline.get_transit_time_async(user['lon'], user['lat'], station['x'], station['y'])
+            except Exception as e:
+                logger.warning("Exception occurred: %s", e)
+                metrics.count('transit_fallbacks')
+                return utils.TRANSIT_FALLBACK_MINUTES
+
+    with metrics.span('transit'):
+        times = await asyncio.gather(*(fetch(user, station) for user, station in pairs.values()))
+    return dict(zip(pairs, times))
+
+
+def rank_group(group, transit_times):
+    ranker = StreamingRanker(group.stations, group.factor_scores, len(group.locations))
+    for i, station in enumerate(group.stations):
+        for u, user in enumerate(group.locations):
+            ranker.add(i, transit_times[transit_pair_key(user, station)], u)
+    return utils.rank_stations(ranker.station_scores())
+
+
+async def find_best_stations_batch(groups):
+    """groups: [BatchGroup]. 그룹마다 best_stations 또는 error/status를 채우고 중복을 뺀 작업 수를 돌려준다."""
+    adjusted = await adjust_origins(groups)
+    with metrics.span('midpoint'):
+        for group in groups:
+            adjusted_locations = [adjusted[location_key(loc)] for loc in group.locations]
+            if any(loc is None for loc in adjusted_locations):
+                group.fail('Midpoint is not within 20km of Seoul and cannot be adjusted to a Seoul location.', 400)
+            else:
+                group.midpoint = utils.midpoint_of(adjusted_locations)
+    active = [group for group in groups if group.error is None]
+
+    candidates = await search_candidates(active)
+    with metrics.span('scoring'):
+        for group in active:
+            stations = candidates[group.midpoint]
+            if not stations:
+                group.fail('No nearby stations found.', 404)
+                continue
+            factor_scores = await sync_to_async(utils.station_factor_scores)(stations, group.factors)
+            group.stations, group.factor_scores = utils.prune_candidates(stations, factor_scores, group.locations)
+    active = [group for group in active if group.error is None]
+
+    # 모든 그룹의 (출발지, 후보역) 구간을 모아서 겹치지 않는 것만 조회한다
+    pairs = {}
+    for group in active:
+        for station in group.stations:
+            for user in group.locations:
+                pairs.setdefault(transit_pair_key(user, station), (user, station))
+    transit_times = await fetch_transit_times(pairs)
+
+    with metrics.span('scoring'):
+        for group in active:
+            group.best_stations = rank_group(group, transit_times)
+            if not group.best_stations:
+                group.fail('No optimal station found', 404)
+
+    return {
+        'groups': len(groups),
+        'unique_origins': len(adjusted),
+        'unique_midpoints': len(candidates),
+        'unique_transit_pairs': len(pairs),
+    }
+
+
+async def explain_batch(groups):
+    # 팩터 조합이 같은 그룹끼리 모아서 설명을 한 번에 만든다 -> {팩터 조합: {(역 이름, view_type): 결과}}
+    names_by_factors = {}
+    for group in groups:
+        if group.best_stations:
+            names = names_by_factors.setdefault(normalize_factors(group.factors), {})
+            names.update(dict.fromkeys(station['station_name'] for station in group.best_stations))
+    explain_many = sync_to_async(explanation_service.explain_many, thread_sensitive=False)
+    with metrics.span('explanation'):
+        explained = await asyncio.gather(*(explain_many(list(names), factors)
+                                           for factors, names in names_by_factors.items()))
+    return dict(zip(names_by_factors, explained))
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import InvalidCacheBackendError, caches
+
+from . import metrics
+
+_MISSING = object()
+
+
+class LRUCache:
+    """스레드 안전한 in-process LRU 캐시 (항목별 TTL, 최대 크기, hit/miss 카운터)."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+# 좌표를 격자 단위(도)로 잘라서 키를 만든다. 0.001도 = 약 100m
+TRANSIT_CACHE_GRID = float(os.getenv('TRANSIT_CACHE_GRID', 0.001))
+TRANSIT_CACHE_TTL = int(os.getenv('TRANSIT_CACHE_TTL', 7 * 24 * 3600))
+TRANSIT_CACHE_SIZE = int(os.getenv('TRANSIT_CACHE_SIZE', 10000))
+# 실패(120분 대체값)는 실제 결과와 따로, 짧게만 기억한다. 0이면 기억하지 않는다
+TRANSIT_CACHE_FAILURE_TTL = int(os.getenv('TRANSIT_CACHE_FAILURE_TTL', 60))
+TRANSIT_CACHE_ALIAS = os.getenv('TRANSIT_CACHE_ALIAS', 'transit')
+
+
+def quantize(value, grid=TRANSIT_CACHE_GRID):
+    return int(round(float(value) / grid))
+
+
+class TransitTimeCache:
+    """소요시간 2단 캐시: in-process LRU -> Django 캐시 백엔드(재시작 후에도 유지)."""
+
+    def __init__(self, shared=_MISSING, grid=TRANSIT_CACHE_GRID, ttl=TRANSIT_CACHE_TTL,
+                 maxsize=TRANSIT_CACHE_SIZE, failure_ttl=TRANSIT_CACHE_FAILURE_TTL):
+        self.grid = grid
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.failures = LRUCache(maxsize=maxsize, ttl=failure_ttl)
+        self._shared = shared
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.failure_hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        if self._shared is _MISSING:
+            try:
+                self._shared = caches[TRANSIT_CACHE_ALIAS]
+            except InvalidCacheBackendError:
+                self._shared = None
+        return self._shared
+
+    def key(self, start_x, start_y, end_x, end_y):
+        return 'transit:{}:{}:{}:{}'.format(
+            *(quantize(v, self.grid) for v in (start_x, start_y, end_x, end_y)))
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, start_x, start_y, end_x, end_y):
+        minutes = self.get_local(start_x, start_y, end_x, end_y)
+        if minutes is not None:
+            return minutes
+        return self.get_shared(start_x, start_y, end_x, end_y)
+
+    def get_local(self, start_x, start_y, end_x, end_y):
+        # in-process 단계만 본다. 공유 단계는 I/O이므로 async 경로는 get_shared를 스레드에서 부른다
+        minutes = self.local.get(self.key(start_x, start_y, end_x, end_y))
+        if minutes is not None:
+            metrics.count('cache_hits', cache='transit')
+        return minutes
+
+    def get_shared(self, start_x, start_y, end_x, end_y):
+        key = self.key(start_x, start_y, end_x, end_y)
+        if self.shared is not None:
+            minutes = self.shared.get(key)
+            if minutes is not None:
+                self._count('shared_hits')
+                self.local.set(key, minutes)
+                metrics.count('cache_hits', cache='transit')
+                return minutes
+        self._count('misses')
+        metrics.count('cache_misses', cache='transit')
+        return None
+
+    def set(self, start_x, start_y, end_x, end_y, minutes):
+        key = self.key(start_x, start_y, end_x, end_y)
+        self.local.set(key, minutes)
+        self.failures.delete(key)
+        if self.shared is not None:
+            self.shared.set(key, minutes, timeout=self.ttl)
+
+    def is_recent_failure(self, start_x, start_y, end_x, end_y):
+        if not self.failure_ttl:
+            return False
+        if self.failures.get(self.key(start_x, start_y, end_x, end_y)):
+            self._count('failure_hits')
+            return True
+        return False
+
+    def set_failure(self, start_x, start_y, end_x, end_y):
+        if self.failure_ttl:
+            self.failures.set(self.key(start_x, start_y, end_x, end_y), True)
+
+    def stats(self):
+        return {
+            'local_hits': self.local.hits,
+            'shared_hits': self.shared_hits,
+            'failure_hits': self.failure_hits,
+            'misses': self.misses,
+            'local_size': len(self.local),
+        }
+
+
+transit_cache = TransitTimeCache()
+
+
+# find_optimal_station 응답 캐시. 같은 그룹이 다시 찾거나 새로고침으로 같은 요청이 다시 올 때 쓴다
+RESULT_CACHE_GRID = float(os.getenv('RESULT_CACHE_GRID', TRANSIT_CACHE_GRID))
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 3600))  # 0이면 캐시하지 않는다
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 2048))
+RESULT_CACHE_ALIAS = os.getenv('RESULT_CACHE_ALIAS', 'results')
+# GET 응답의 Cache-Control max-age (CDN/브라우저가 다시 묻지 않고 쓰는 시간)
+RESULT_CACHE_MAX_AGE = int(os.getenv('RESULT_CACHE_MAX_AGE', 300))
+
+
+class ResultCache:
+    """요청 결과 2단 캐시: in-process LRU -> Django 캐시 백엔드.
+
+    키는 정렬한 격자 좌표 + 정렬한 팩터 + 역 테이블 버전(역 데이터, 팩터 가중치)이라
+    출발지 순서나 팩터 순서가 달라도 같은 키가 되고, 역 데이터가 바뀌면 예전 결과는 더 이상 쓰이지 않는다.
+    """
+
+    def __init__(self, shared=_MISSING, grid=RESULT_CACHE_GRID, ttl=RESULT_CACHE_TTL, maxsize=RESULT_CACHE_SIZE):
+        self.grid = grid
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._shared = shared
+
+    @property
+    def shared(self):
+        if self._shared is _MISSING:
+            try:
+                self._shared = caches[RESULT_CACHE_ALIAS]
+            except InvalidCacheBackendError:
+                self._shared = None
+        return self._shared
+
+    def key(self, locations, factors, version):
+        points = sorted((quantize(loc['lon'], self.grid), quantize(loc['lat'], self.grid)) for loc in locations)
+        return 'result:{}:{}:{}'.format(
+            version, ';'.join(f'{x},{y}' for x, y in points), ','.join(str(f) for f in sorted(set(factors))))
+
+    def get(self, key):
+        # -> (결과, ETag) 또는 None
+        if not self.ttl:
+            return None
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        metrics.count('cache_hits' if entry is not None else 'cache_misses', cache='result')
+        return entry
+
+    def set(self, key, results):
+        # 결과를 저장하고 ETag를 돌려준다
+        entry = (results, make_etag(results))
+        if self.ttl:
+            self.local.set(key, entry)
+            if self.shared is not None:
+                self.shared.set(key, entry, timeout=self.ttl)
+        return entry[1]
+
+    def clear(self):
+        self.local.clear()
+
+
+def make_etag(results):
+    body = json.dumps(results, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return '"{}"'.format(hashlib.sha1(body.encode('utf-8')).hexdigest()[:20])
+
+
+result_cache = ResultCache()
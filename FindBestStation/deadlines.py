@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# 요청 단위 지연 예산.
+# 뷰가 요청을 받을 때 Deadline을 만들어 find_best_station까지 넘기고, 마감이 되면 그때까지 받은 소요시간으로
+# 순위를 매긴다(받지 못한 칸은 추정값, 응답의 estimated_locations로 알려준다).
+# 느린 ODsay 호출은 최근 응답 시간의 분위수만큼 기다린 뒤 다른 키로 같은 호출을 한 번 더 보낸다(헤징).
+REQUEST_BUDGET_SECONDS = float(os.getenv('REQUEST_BUDGET_SECONDS', 8))  # 0이면 마감 없음
+ODSAY_HEDGE_PERCENTILE = float(os.getenv('ODSAY_HEDGE_PERCENTILE', 95))  # 0이면 헤징하지 않음
+# 응답 시간 표본이 ODSAY_HEDGE_MIN_SAMPLES개 모이기 전에 쓰는 헤징 지연(초)
+ODSAY_HEDGE_DEFAULT_DELAY = float(os.getenv('ODSAY_HEDGE_DEFAULT_DELAY', 1.0))
+ODSAY_HEDGE_MIN_DELAY = float(os.getenv('ODSAY_HEDGE_MIN_DELAY', 0.05))
+ODSAY_HEDGE_MIN_SAMPLES = int(os.getenv('ODSAY_HEDGE_MIN_SAMPLES', 20))
+ODSAY_LATENCY_WINDOW = int(os.getenv('ODSAY_LATENCY_WINDOW', 256))
+
+
+class DeadlineExceeded(Exception):
+    """마감까지 소요시간을 받지 못했다. 실패가 아니므로 실패로 캐시하지 않고, 순위에는 추정값을 쓴다."""
+
+
+class Deadline:
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.at = clock() + seconds
+
+    @classmethod
+    def after(cls, seconds=None):
+        # 기본은 REQUEST_BUDGET_SECONDS. 0이면 None (마감 없음)
+        seconds = REQUEST_BUDGET_SECONDS if seconds is None else seconds
+        return cls(seconds) if seconds else None
+
+    def remaining(self):
+        return max(self.at - self.clock(), 0.0)
+
+    def expired(self):
+        return self.clock() >= self.at
+
+
+def remaining(deadline, limit=None):
+    # 마감까지 남은 초와 limit 중 작은 값. 마감이 없으면 limit (둘 다 없으면 None = 무한정)
+    if deadline is None:
+        return limit
+    left = deadline.remaining()
+    return left if limit is None else min(left, limit)
+
+
+def expired(deadline):
+    return deadline is not None and deadline.expired()
+
+
+class LatencyTracker:
+    """최근 window개 응답 시간으로 헤징 지연(percentile 분위수)을 정한다."""
+
+    def __init__(self, window=ODSAY_LATENCY_WINDOW, percentile=ODSAY_HEDGE_PERCENTILE,
+                 min_samples=ODSAY_HEDGE_MIN_SAMPLES, default=ODSAY_HEDGE_DEFAULT_DELAY,
+                 min_delay=ODSAY_HEDGE_MIN_DELAY):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default = default
+        self.min_delay = min_delay
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def hedge_delay(self):
+        # 헤징하지 않으면 None
+        if not self.percentile:
+            return None
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < self.min_samples:
+            return self.default
+        return max(float(np.percentile(samples, self.percentile)), self.min_delay)
+
+
+odsay_latency = LatencyTracker()
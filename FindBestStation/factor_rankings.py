@@ -0,0 +1,62 @@
+import threading
+
+import numpy as np
+
+from .station_table import FACTOR_IDS, FACTOR_WEIGHTS, factor_columns, get_station_table
+
+# 팩터는 6개뿐이고 가중치는 환경변수로 고정이므로, 팩터 조합(비트마스크 0~63)마다 모든 역의
+# 가중 팩터 점수와 그 내림차순 순서를 미리 만들어 둘 수 있다.
+# find_best_station(CANDIDATE_STRATEGY=threshold)은 이 순서대로 후보역을 조회하고(정렬 접근),
+# StreamingRanker가 이미 다 모인 역들로 문턱값을 세워 뒤쪽 역을 조회 전에 걸러낸다 (Fagin의 threshold algorithm).
+N_SUBSETS = 1 << len(FACTOR_IDS)
+
+
+def subset_mask(factors):
+    # factors가 None이면 전체 팩터. 2~7 밖의 값이면 ValueError
+    mask = 0
+    for column in factor_columns(factors):
+        mask |= 1 << int(column)
+    return mask
+
+
+class FactorRankings:
+    """(팩터 조합, 역) 가중 팩터 점수와 조합별 점수 내림차순 순위. 행은 subset_mask, 열은 StationTable 인덱스."""
+
+    def __init__(self, table, weights=None):
+        self.table = table
+        weights = FACTOR_WEIGHTS if weights is None else np.asarray(weights, dtype=np.float64)
+        n = len(table)
+        self.scores = np.ones((N_SUBSETS, n))
+        # order[mask]: 점수 내림차순 역 인덱스, position[mask][i]: 역 i의 순위
+        self.order = np.empty((N_SUBSETS, n), dtype=np.int32)
+        self.position = np.empty((N_SUBSETS, n), dtype=np.int32)
+        for mask in range(N_SUBSETS):
+            columns = [j for j in range(len(FACTOR_IDS)) if mask >> j & 1]
+            if columns:
+                self.scores[mask] = 1.0 + table.factors[:, columns] @ weights[columns]
+            order = np.argsort(-self.scores[mask], kind='stable')
+            self.order[mask] = order
+            self.position[mask, order] = np.arange(n, dtype=np.int32)
+
+    def scores_of(self, indices, factors):
+        return self.scores[subset_mask(factors), np.asarray(indices, dtype=np.int64)]
+
+    def argsort(self, indices, factors):
+        # 테이블 인덱스 배열을 factors 조합의 점수 내림차순으로 늘어놓는 순서 (점수가 같으면 테이블 순서).
+        # 미리 매겨 둔 순위로 정렬하므로 점수를 다시 계산하지 않는다
+        return np.argsort(self.position[subset_mask(factors), np.asarray(indices, dtype=np.int64)], kind='stable')
+
+
+_rankings = None
+_rankings_lock = threading.Lock()
+
+
+def get_factor_rankings():
+    # 역 테이블이 다시 만들어지면(Station 변경) 다시 만든다
+    global _rankings
+    table = get_station_table()
+    if _rankings is None or _rankings.table is not table:
+        with _rankings_lock:
+            if _rankings is None or _rankings.table is not table:
+                _rankings = FactorRankings(table)
+    return _rankings
@@ -0,0 +1,64 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 외부 API 호출용 공용 HTTP 클라이언트.
+# 호스트마다 keep-alive 커넥션 풀을 하나씩 두고 재사용해서 매 호출마다 TCP/TLS 연결을 새로 맺지 않는다.
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 16))
+
+# 한 요청에서 (후보역 수 x 사용자 수)만큼 동시에 호출하는 ODsay는 풀을 크게 잡는다
+HOST_POOL_MAXSIZE = {
+    urlsplit(os.getenv('ODSAY_API_BASE', 'https://api.odsay.com')).hostname:
+        int(os.getenv('HTTP_POOL_MAXSIZE_ODSAY', 64)),
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _make_session(host):
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=HOST_POOL_MAXSIZE.get(host, HTTP_POOL_MAXSIZE),
+        max_retries=0,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def pool_maxsize(url):
+    # 이 URL 호스트의 keep-alive 커넥션 수. 동시에 이보다 많이 부르면 남는 연결은 쓰고 버린다 ("Connection pool is full")
+    return HOST_POOL_MAXSIZE.get(urlsplit(url).hostname, HTTP_POOL_MAXSIZE)
+
+
+def get_session(url):
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _make_session(parts.hostname)
+                _sessions[key] = session
+    return session
+
+
+def get(url, **kwargs):
+    # timeout을 따로 주지 않으면 (connect, read) 기본값을 쓴다
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(url).get(url, **kwargs)
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
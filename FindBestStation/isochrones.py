@@ -0,0 +1,197 @@
+import json
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .spatial import METERS_PER_DEG_LAT, METERS_PER_DEG_LON_AT_EQUATOR, get_station_index
+from .transit_matrix import MAX_MINUTES as MATRIX_MAX_MINUTES
+from .transit_matrix import _meta_path, walking_minutes
+
+# 격자 칸 x 역 최소 대중교통 소요시간(분) 표. build_isochrone_grid 명령으로 만든다.
+# 사용자는 역이 아니라 집/회사에서 출발하므로 출발지 칸에서 바로 모든 역까지의 시간을 읽는다.
+ISOCHRONE_GRID_FILE = os.getenv(
+    'ISOCHRONE_GRID_FILE',
+    os.path.join(settings.BASE_DIR, 'data', 'isochrone_grid.npy'),
+)
+ISOCHRONE_CELL_SIZE_M = float(os.getenv('ISOCHRONE_CELL_SIZE_M', 250))
+# 도착 좌표를 표의 역(열)에 붙일 때 허용하는 거리(m)
+ISOCHRONE_STATION_RADIUS = float(os.getenv('ISOCHRONE_STATION_RADIUS', 100))
+
+UNKNOWN = 0xFF   # 채우지 않은 칸
+NO_ROUTE = 0xFE  # 주변에 역이 없거나 경로가 없는 칸
+MAX_MINUTES = 0xFD
+
+logger = logging.getLogger(__name__)
+
+
+class IsochroneGrid:
+    """(격자 칸, 역) uint8 표. 행은 칸 번호(cy * nx + cx), 열은 station_codes 순서.
+
+    칸 중심에서 출발한다고 보고 미리 채운다. load()는 np.load(mmap_mode='r')로 열기 때문에
+    gunicorn 워커마다 복사본을 들지 않고 같은 파일을 OS 페이지 캐시로 나눠 쓴다.
+    """
+
+    def __init__(self, station_codes, bounds, cell_size_m, data=None):
+        self.station_codes = list(station_codes)
+        self.code_to_idx = {code: i for i, code in enumerate(self.station_codes)}
+        # (min_lon, min_lat, max_lon, max_lat)
+        self.bounds = tuple(float(v) for v in bounds)
+        self.cell_size = float(cell_size_m)
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        self.m_per_deg_lon = METERS_PER_DEG_LON_AT_EQUATOR * math.cos(math.radians((min_lat + max_lat) / 2))
+        self.nx = max(int(math.ceil((max_lon - min_lon) * self.m_per_deg_lon / self.cell_size)), 1)
+        self.ny = max(int(math.ceil((max_lat - min_lat) * METERS_PER_DEG_LAT / self.cell_size)), 1)
+        self.data = data
+
+    def __len__(self):
+        return self.nx * self.ny
+
+    @classmethod
+    def empty(cls, station_codes, bounds, cell_size_m=ISOCHRONE_CELL_SIZE_M):
+        grid = cls(station_codes, bounds, cell_size_m)
+        grid.data = np.full((len(grid), len(grid.station_codes)), UNKNOWN, dtype=np.uint8)
+        return grid
+
+    @classmethod
+    def load(cls, path=ISOCHRONE_GRID_FILE, mmap_mode='r'):
+        with open(_meta_path(path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        data = np.load(path, mmap_mode=mmap_mode)
+        grid = cls(meta['station_codes'], meta['bounds'], meta['cell_size_m'], data)
+        if data.dtype != np.uint8 or data.shape != (len(grid), len(grid.station_codes)):
+            raise ValueError(f"Isochrone grid {path} does not match its metadata.")
+        return grid
+
+    def save(self, path=ISOCHRONE_GRID_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 쓰는 도중에 죽어도 기존 파일이 깨지지 않도록 임시 파일에 쓰고 교체
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.data, dtype=np.uint8))
+        os.replace(tmp_path, path)
+
+        meta_path = _meta_path(path)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'station_codes': self.station_codes, 'bounds': self.bounds, 'cell_size_m': self.cell_size},
+                      f, ensure_ascii=False)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def cells_of(self, lons, lats):
+        # 좌표 -> 칸 번호 배열 (격자 밖이면 -1)
+        min_lon, min_lat = self.bounds[:2]
+        cx = np.floor((np.asarray(lons, dtype=np.float64) - min_lon) * self.m_per_deg_lon / self.cell_size)
+        cy = np.floor((np.asarray(lats, dtype=np.float64) - min_lat) * METERS_PER_DEG_LAT / self.cell_size)
+        inside = (cx >= 0) & (cx < self.nx) & (cy >= 0) & (cy < self.ny)
+        return np.where(inside, cy * self.nx + cx, -1).astype(np.int64)
+
+    def cell_centers(self):
+        # 모든 칸 중심의 (lon, lat) 배열
+        cy, cx = np.divmod(np.arange(len(self)), self.nx)
+        lon = self.bounds[0] + (cx + 0.5) * self.cell_size / self.m_per_deg_lon
+        lat = self.bounds[1] + (cy + 0.5) * self.cell_size / METERS_PER_DEG_LAT
+        return lon, lat
+
+    def minutes(self, cells, columns):
+        """칸 x 역 소요시간(분) 블록을 한 번의 gather로 읽는다. 격자/표 밖이거나 값이 없으면 inf."""
+        cells = np.asarray(cells, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        block = self.data[np.maximum(cells, 0)[:, None], np.maximum(columns, 0)[None, :]].astype(np.float64)
+        block[block > MAX_MINUTES] = np.inf
+        block[cells < 0, :] = np.inf
+        block[:, columns < 0] = np.inf
+        return block
+
+    def set_row(self, cell, minutes):
+        # minutes: 역마다 분 (inf면 경로 없음). 0은 경로 없음과 헷갈리므로 최소 1분
+        minutes = np.asarray(minutes, dtype=np.float64)
+        finite = np.isfinite(minutes)
+        row = np.full(len(minutes), NO_ROUTE, dtype=np.uint8)
+        row[finite] = np.clip(np.rint(minutes[finite]), 1, MAX_MINUTES)
+        self.data[cell] = row
+
+
+def station_minutes_from_matrix(matrix, station_codes):
+    # TransitMatrix -> station_codes 순서의 역 x 역 소요시간(분, 없으면 inf)
+    idx = np.array([matrix.code_to_idx.get(code, -1) for code in station_codes], dtype=np.int64)
+    minutes = np.full((len(station_codes), len(station_codes)), np.inf)
+    keep = np.flatnonzero(idx >= 0)
+    block = matrix.data[np.ix_(idx[keep], idx[keep])].astype(np.float64)
+    block[block > MATRIX_MAX_MINUTES] = np.inf
+    minutes[np.ix_(keep, keep)] = block
+    np.fill_diagonal(minutes, 0)
+    return minutes
+
+
+def station_minutes_from_graph(graph, stations):
+    # SubwayGraph -> stations 순서의 역 x 역 소요시간(분, 없으면 inf). 역마다 Dijkstra 한 번
+    nodes = [station['station_name'] if station['station_name'] in graph.graph else None for station in stations]
+    targets = {node for node in nodes if node is not None}
+    minutes = np.full((len(stations), len(stations)), np.inf)
+    for i, node in enumerate(nodes):
+        if node is None:
+            continue
+        reached = graph.shortest_minutes({node: 0.0}, targets)
+        minutes[i] = [reached.get(other, np.inf) if other is not None else np.inf for other in nodes]
+    np.fill_diagonal(minutes, 0)
+    return minutes
+
+
+def fill_grid(grid, index, station_minutes, snap_k, snap_radius):
+    """칸마다 (칸 중심 -> 가까운 역 도보 시간 + 역간 소요시간)의 최솟값을 채운다.
+    index.stations와 station_minutes는 grid.station_codes 순서여야 한다."""
+    lons, lats = grid.cell_centers()
+    for cell, (lon, lat) in enumerate(zip(lons, lats)):
+        idx, dist = index.nearest_indices(lon, lat, k=snap_k, radius_m=snap_radius)
+        if len(idx) == 0:
+            grid.set_row(cell, np.full(len(grid.station_codes), np.inf))
+            continue
+        grid.set_row(cell, (station_minutes[idx] + walking_minutes(dist)[:, None]).min(axis=0))
+
+
+class IsochroneEstimator:
+    """출발지 칸에서 후보역까지의 소요시간을 표에서 읽는다."""
+
+    def __init__(self, grid, index):
+        self.grid = grid
+        self.index = index
+        # 공간 인덱스의 역 순서 -> 표의 열 (표에 없는 역은 -1)
+        self.columns = self.columns_of(index.stations)
+
+    def columns_of(self, stations):
+        return np.array([self.grid.code_to_idx.get(station.get('station_code'), -1) for station in stations],
+                        dtype=np.int64)
+
+    def minutes_matrix(self, user_locations, stations):
+        # 사용자 x 후보역 소요시간(분, 없으면 inf)
+        cells = self.grid.cells_of([user['lon'] for user in user_locations], [user['lat'] for user in user_locations])
+        return self.grid.minutes(cells, self.columns_of(stations))
+
+    def transit_time(self, start_x, start_y, end_x, end_y):
+        idx, _ = self.index.nearest_indices(end_x, end_y, k=1, radius_m=ISOCHRONE_STATION_RADIUS)
+        if len(idx) == 0:
+            return None
+        minutes = float(self.grid.minutes(self.grid.cells_of([start_x], [start_y]), self.columns[idx])[0, 0])
+        return None if minutes == np.inf else int(minutes)
+
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+
+def get_isochrone_estimator():
+    # 표 파일이 없으면 None (이때는 역 테이블도 읽지 않는다). 역 데이터가 바뀌면 다시 만든다
+    global _estimator
+    if not os.path.exists(ISOCHRONE_GRID_FILE):
+        return None
+    index = get_station_index()
+    if _estimator is None or _estimator.index is not index:
+        with _estimator_lock:
+            if _estimator is None or _estimator.index is not index:
+                _estimator = IsochroneEstimator(IsochroneGrid.load(ISOCHRONE_GRID_FILE), index)
+                logger.info("Loaded isochrone grid: %d cells x %d stations", len(_estimator.grid),
+                            len(_estimator.grid.station_codes))
+    return _estimator
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Station, StationDataSource
+from .spatial import reset_station_index
+from .station_table import reset_station_table
+
+STATION_JSON_FILE = os.path.join(settings.BASE_DIR, 'factor.json')
+STATION_FIELDS = ['station_name', 'x', 'y', 'factor_2', 'factor_3', 'factor_4', 'factor_5', 'factor_6', 'factor_7']
+
+
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def load_stations_from_json(json_file=STATION_JSON_FILE, force=False):
+    """factor.json(Django fixture 형식)을 Station 테이블에 한 번에 넣는다.
+
+    파일 체크섬이 마지막으로 불러온 것과 같으면 아무것도 하지 않고 None을 돌려준다.
+    이미 있는 역(station_code 기준)은 파일 값으로 갱신한다.
+    """
+    checksum = file_checksum(json_file)
+    source_name = os.path.basename(json_file)
+    if not force and StationDataSource.objects.filter(name=source_name, checksum=checksum).exists():
+        return None
+
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    stations = [
+        Station(station_code=entry['fields']['station_code'],
+                **{field: entry['fields'][field] for field in STATION_FIELDS})
+        for entry in data
+    ]
+
+    with transaction.atomic():
+        if connection.features.supports_update_conflicts:
+            # MySQL은 충돌 대상 컬럼을 지정할 수 없다
+            unique_fields = ['station_code'] if connection.features.supports_update_conflicts_with_target else None
+            Station.objects.bulk_create(stations, update_conflicts=True,
+                                        unique_fields=unique_fields, update_fields=STATION_FIELDS)
+        else:
+            Station.objects.bulk_create(stations, ignore_conflicts=True)
+        StationDataSource.objects.update_or_create(name=source_name, defaults={'checksum': checksum})
+    # bulk_create는 post_save 시그널을 보내지 않으므로 직접 비운다
+    reset_station_table(stale_catalog=True)
+    reset_station_index()
+    return len(stations)
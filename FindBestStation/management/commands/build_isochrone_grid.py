@@ -0,0 +1,61 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from FindBestStation.isochrones import (
+    ISOCHRONE_CELL_SIZE_M, ISOCHRONE_GRID_FILE, NO_ROUTE, IsochroneGrid, fill_grid,
+    station_minutes_from_graph, station_minutes_from_matrix,
+)
+from FindBestStation.spatial import METERS_PER_DEG_LAT, StationIndex
+from FindBestStation.station_table import get_station_table
+from FindBestStation.subway_graph import get_subway_graph
+from FindBestStation.transit_matrix import (
+    TRANSIT_MATRIX_FILE, TRANSIT_MATRIX_SNAP_K, TRANSIT_MATRIX_SNAP_RADIUS, TransitMatrix,
+)
+
+
+class Command(BaseCommand):
+    help = ("격자 칸 x 역 최소 소요시간 표(isochrone grid)를 만든다. "
+            "칸 중심에서 가까운 역까지의 도보 시간 + 역간 소요시간(build_transit_matrix 행렬 또는 지하철 노선 그래프)으로 "
+            "채우므로 ODsay는 부르지 않는다.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=ISOCHRONE_GRID_FILE)
+        parser.add_argument('--cell-size', type=float, default=ISOCHRONE_CELL_SIZE_M, help='칸 크기(m)')
+        parser.add_argument('--source', choices=['matrix', 'graph'],
+                            help='역간 소요시간: matrix (TRANSIT_MATRIX_FILE) 또는 graph (SUBWAY_NETWORK_FILE). '
+                                 '기본은 행렬 파일이 있으면 matrix')
+        parser.add_argument('--padding', type=float, default=TRANSIT_MATRIX_SNAP_RADIUS,
+                            help='역 좌표 범위 바깥으로 넓힐 거리(m)')
+
+    def handle(self, *args, **options):
+        table = get_station_table()
+        if not len(table):
+            raise CommandError("Station table is empty. Run load_stations first.")
+
+        source = options['source'] or ('matrix' if os.path.exists(TRANSIT_MATRIX_FILE) else 'graph')
+        if source == 'matrix':
+            if not os.path.exists(TRANSIT_MATRIX_FILE):
+                raise CommandError(f"Transit matrix not found: {TRANSIT_MATRIX_FILE}. Run build_transit_matrix first.")
+            station_minutes = station_minutes_from_matrix(TransitMatrix.load(TRANSIT_MATRIX_FILE), table.codes)
+        else:
+            graph = get_subway_graph()
+            if graph is None:
+                raise CommandError("Subway network not found. Set SUBWAY_NETWORK_FILE.")
+            station_minutes = station_minutes_from_graph(graph, table.stations)
+
+        # 역 좌표 범위 + 여유. adjust_location이 인천/경기 출발지를 옮기는 대표 좌표도 모두 역 좌표라 이 안에 들어온다
+        index = StationIndex(table.stations)
+        pad_lon = options['padding'] / index.m_per_deg_lon
+        pad_lat = options['padding'] / METERS_PER_DEG_LAT
+        bounds = (float(table.lon.min()) - pad_lon, float(table.lat.min()) - pad_lat,
+                  float(table.lon.max()) + pad_lon, float(table.lat.max()) + pad_lat)
+
+        grid = IsochroneGrid.empty(table.codes, bounds, options['cell_size'])
+        self.stdout.write(f"Filling {grid.nx} x {grid.ny} cells x {len(table)} stations from {source}.")
+        fill_grid(grid, index, station_minutes, TRANSIT_MATRIX_SNAP_K, TRANSIT_MATRIX_SNAP_RADIUS)
+        grid.save(options['output'])
+
+        reachable = float((grid.data != NO_ROUTE).mean())
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {options['output']} ({grid.data.nbytes / 2 ** 20:.1f} MiB, {reachable:.0%} of cells reachable)."))
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from shapely.geometry import mapping, shape
+
+from FindBestStation.regions import REGION_BOUNDARY_FILE
+
+# adjust_location에서 구분하는 광역시/도
+DEFAULT_SIDO_NAMES = ['서울특별시', '인천광역시', '경기도']
+
+
+class Command(BaseCommand):
+    help = "시/군/구 경계 GeoJSON(WGS84)을 지역 판별용 경계 파일로 변환한다."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='원본 시/군/구 경계 GeoJSON 파일 (WGS84 좌표)')
+        parser.add_argument('--output', default=REGION_BOUNDARY_FILE)
+        parser.add_argument('--sido-field', default='region_1depth_name',
+                            help='광역시/도 이름이 들어있는 속성 이름')
+        parser.add_argument('--sigungu-field', default='region_2depth_name',
+                            help='시/군/구 이름이 들어있는 속성 이름')
+        parser.add_argument('--sido', nargs='*', default=DEFAULT_SIDO_NAMES,
+                            help='남길 광역시/도 이름 (빈 값이면 전부)')
+        parser.add_argument('--tolerance', type=float, default=0.0005,
+                            help='폴리곤 단순화 허용 오차 (도 단위, 0이면 단순화하지 않음)')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['source'], 'r', encoding='utf-8') as f:
+                source = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {options['source']}: {e}")
+
+        sido_names = set(options['sido'] or [])
+        features = []
+        for feature in source.get('features', []):
+            props = feature.get('properties') or {}
+            sido = props.get(options['sido_field'], '')
+            sigungu = props.get(options['sigungu_field'], '')
+            if sido_names and sido not in sido_names:
+                continue
+            geometry = shape(feature['geometry'])
+            if options['tolerance'] > 0:
+                geometry = geometry.simplify(options['tolerance'], preserve_topology=True)
+            features.append({
+                'type': 'Feature',
+                'properties': {'region_1depth_name': sido, 'region_2depth_name': sigungu},
+                'geometry': mapping(geometry),
+            })
+
+        if not features:
+            raise CommandError("No matching features found. Check --sido-field/--sigungu-field/--sido.")
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(features)} regions to {options['output']}"))
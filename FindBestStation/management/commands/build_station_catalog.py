@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from FindBestStation.spatial import StationIndex
+from FindBestStation.station_catalog import STATION_CATALOG_FILE, write_catalog
+from FindBestStation.station_table import FACTOR_FIELDS, StationTable, station_rows, station_sources
+
+
+class Command(BaseCommand):
+    help = ("Station 테이블(역 코드, 이름, 좌표, 팩터)과 공간 인덱스를 바이너리 역 카탈로그 하나로 만든다. "
+            "파일이 있으면 각 프로세스가 DB를 읽지 않고 mmap으로 연다. load_stations 뒤에 실행한다.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=STATION_CATALOG_FILE)
+
+    def handle(self, *args, **options):
+        # 기존 카탈로그가 아니라 DB에서 읽는다
+        table = StationTable.from_rows(station_rows())
+        if not len(table):
+            raise CommandError("Station table is empty. Run load_stations first.")
+
+        header = write_catalog(options['output'], table, StationIndex(table.stations), FACTOR_FIELDS,
+                               source_checksum=station_sources())
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {options['output']} ({header['count']} stations, version {header['version']})."))
@@ -0,0 +1,112 @@
+import os
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from FindBestStation.models import Station
+from FindBestStation.transit_matrix import (
+    NO_ROUTE, TRANSIT_MATRIX_FILE, UNKNOWN, TransitMatrix, walking_minutes,
+)
+from FindBestStation.spatial import StationIndex
+from FindBestStation.odsay_keys import load_api_keys
+from FindBestStation import utils
+
+# ODsay: 출발지와 도착지가 700m 이내라 경로 검색을 하지 않는 경우
+ODSAY_TOO_CLOSE_CODE = '-98'
+
+
+class Command(BaseCommand):
+    help = ("ODsay로 역간 최소 소요시간 행렬을 만든다. "
+            "호출 한도에 걸리면 지금까지 채운 값을 저장하고 멈추며, 다시 실행하면 이어서 채운다.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=TRANSIT_MATRIX_FILE)
+        parser.add_argument('--max-calls', type=int, default=0, help='이번 실행에서 호출할 최대 횟수 (0이면 제한 없음)')
+        parser.add_argument('--sleep', type=float, default=0.1, help='호출 사이 대기 시간(초)')
+        parser.add_argument('--checkpoint', type=int, default=200, help='몇 번 호출마다 파일에 저장할지')
+        parser.add_argument('--symmetric', action='store_true',
+                            help='반대 방향 값이 이미 있으면 호출하지 않고 그대로 쓴다')
+        parser.add_argument('--retry-no-route', action='store_true', help='경로 없음으로 저장된 칸도 다시 조회')
+
+    def handle(self, *args, **options):
+        stations = list(Station.objects.order_by('station_code').values('station_code', 'x', 'y'))
+        if not stations:
+            raise CommandError("Station table is empty. Run load_stations first.")
+        codes = [s['station_code'] for s in stations]
+        output = options['output']
+
+        if os.path.exists(output):
+            matrix = TransitMatrix.load(output, mmap_mode=None)
+            if matrix.station_codes != codes:
+                self.stdout.write("Station list changed; keeping overlapping cells.")
+                matrix = matrix.remap(codes)
+        else:
+            matrix = TransitMatrix.empty(codes)
+
+        all_keys = load_api_keys()
+        keys = list(all_keys)
+        if not keys:
+            raise CommandError("No ODSAY_API_KEYn environment variables found.")
+
+        index = StationIndex([{'station_code': s['station_code'], 'station_name': '', 'x': s['x'], 'y': s['y']}
+                              for s in stations])
+        pending = matrix.pending_pairs(retry_no_route=options['retry_no_route'])
+        self.stdout.write(f"{len(pending)} of {len(codes) * (len(codes) - 1)} pairs pending.")
+
+        calls = 0
+        saved_at = 0
+        key_idx = 0
+        try:
+            for i, j in pending:
+                if options['symmetric'] and matrix.data[j, i] != UNKNOWN:
+                    matrix.data[i, j] = matrix.data[j, i]
+                    continue
+                if options['max_calls'] and calls >= options['max_calls']:
+                    self.stdout.write("Reached --max-calls.")
+                    break
+
+                start, end = stations[i], stations[j]
+                while keys:
+                    api_key = keys[key_idx % len(keys)]
+                    key_idx += 1
+                    try:
+                        minutes, error = utils.request_odsay_transit_time(
+                            start['x'], start['y'], end['x'], end['y'], api_key)
+                    except requests.exceptions.RequestException as e:
+                        self.stderr.write(f"{codes[i]} -> {codes[j]}: {e}")
+                        break
+                    finally:
+                        calls += 1
+
+                    if error is None:
+                        matrix.set_minutes(i, j, minutes)
+                    elif utils.is_odsay_quota_error(error):
+                        # 이 키는 이번 실행에서 더 쓰지 않는다
+                        keys.remove(api_key)
+                        self.stdout.write(f"ODSAY_API_KEY{all_keys.index(api_key) + 1} hit its quota; {len(keys)} keys left.")
+                        continue
+                    elif utils.odsay_error_code(error)[0] == ODSAY_TOO_CLOSE_CODE:
+                        qx, qy = index.project(start['x'], start['y'])
+                        px, py = index.project(end['x'], end['y'])
+                        matrix.set_minutes(i, j, walking_minutes(((px - qx) ** 2 + (py - qy) ** 2) ** 0.5))
+                    elif utils.odsay_error_code(error)[0] in utils.ODSAY_ROUTE_ERROR_CODES:
+                        matrix.data[i, j] = NO_ROUTE
+                    else:
+                        # 서버 오류 등 경로와 상관없는 오류는 UNKNOWN으로 두어 다음 실행에서 다시 조회한다
+                        self.stderr.write(f"{codes[i]} -> {codes[j]}: {error}")
+                    break
+
+                if not keys:
+                    self.stdout.write("All API keys hit their quota. Re-run after the quota resets.")
+                    break
+                if calls - saved_at >= options['checkpoint']:
+                    matrix.save(output)
+                    saved_at = calls
+                time.sleep(options['sleep'])
+        finally:
+            matrix.save(output)
+
+        remaining = len(matrix.pending_pairs())
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {output} ({calls} calls this run, {remaining} pairs still pending)."))
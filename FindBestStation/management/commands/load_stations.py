@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from FindBestStation.loaders import STATION_JSON_FILE, load_stations_from_json
+
+
+class Command(BaseCommand):
+    help = "factor.json의 역 데이터를 Station 테이블에 불러온다 (파일이 바뀌지 않았으면 건너뜀)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=STATION_JSON_FILE)
+        parser.add_argument('--force', action='store_true', help='체크섬이 같아도 다시 불러온다')
+
+    def handle(self, *args, **options):
+        count = load_stations_from_json(options['file'], force=options['force'])
+        if count is None:
+            self.stdout.write(f"{options['file']} has not changed. Skipping.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Loaded {count} stations from {options['file']}."))
@@ -0,0 +1,317 @@
+import hmac
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse, HttpResponseNotFound
+
+# 요청 단위 계측.
+# 요청마다 RequestMetrics를 contextvar에 두고 span()으로 단계별 소요시간을, count()로 외부 API 호출,
+# 재시도, 120분 대체값, 캐시 hit/miss, ODsay 키별 사용량을 (그때 진행 중인 단계별로) 센다.
+# 요청 결과는 Server-Timing 헤더로, 누적값은 프로세스(워커)별 /metrics (Prometheus 텍스트 형식)로 나간다.
+# 스레드 풀에 넘기는 작업은 submit()으로 넘겨야 contextvar가 따라가서 현재 요청에 잡힌다.
+METRICS_PREFIX = os.getenv('METRICS_PREFIX', 'wsm')
+SERVER_TIMING = os.getenv('SERVER_TIMING', '1') != '0'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# /metrics 접근 제한. 둘 다 비어 있으면(기본) /metrics는 404.
+# METRICS_TOKEN: 'Authorization: Bearer <토큰>'으로 수집, METRICS_ALLOWED_IPS: 쉼표로 구분한 REMOTE_ADDR 목록
+# (리버스 프록시 뒤에서는 모든 요청이 프록시 주소로 보이므로 토큰을 쓴다)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = frozenset(ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip.strip())
+
+logger = logging.getLogger(__name__)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.label_names, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted((key, self._copy(value)) for key, value in self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _copy(self, value):
+        return value
+
+    def _samples(self, key, value):
+        return [f'{self.name}{self._labels(key)} {value}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [버킷별 누적 개수, 합, 개수]
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._values.get(self._key(labels))
+        return series[2] if series else 0
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+    def _samples(self, key, value):
+        counts, total, n = value
+        lines = [f'{self.name}_bucket{self._labels(key, [("le", float(bound))])} {count}'
+                 for bound, count in zip(self.buckets, counts)]
+        lines.append(f'{self.name}_bucket{self._labels(key, [("le", "+Inf")])} {n}')
+        lines.append(f'{self.name}_sum{self._labels(key)} {total}')
+        lines.append(f'{self.name}_count{self._labels(key)} {n}')
+        return lines
+
+
+class Registry:
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, label_names, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = cls(f'{self.prefix}_{name}', help_text, label_names, **kwargs)
+                    self._metrics[name] = metric
+        return metric
+
+    def counter(self, name, help_text='', label_names=()):
+        return self._get(Counter, name, help_text, label_names)
+
+    def histogram(self, name, help_text='', label_names=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, label_names, buckets=buckets)
+
+    def render(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'request_duration_seconds', 'Request latency by view and status.', ('view', 'status'))
+STAGE_SECONDS = registry.histogram(
+    'stage_duration_seconds', 'Latency of each pipeline stage.', ('stage',))
+
+# count()로 세는 값. 이름 -> (설명, 라벨). 모든 카운터에 단계(stage) 라벨이 붙는다
+COUNTERS = {
+    'upstream_calls': ('External API calls by provider (kakao, odsay, openai).', ('provider',)),
+    'odsay_retries': ('ODsay calls retried with another API key.', ()),
+    'odsay_hedges': ('Duplicate ODsay calls sent on another key after the hedge delay.', ()),
+    'transit_fallbacks': ('Transit times replaced by TRANSIT_FALLBACK_MINUTES.', ()),
+    'provider_fallbacks': ('Failed ODsay lookups answered by the fallback provider (graph).', ('provider',)),
+    'estimated_pairs': ('(user, station) transit times estimated because the request deadline passed.', ()),
+    'cache_hits': ('Cache hits by cache (transit, explanation, result, session).', ('cache',)),
+    'cache_misses': ('Cache misses by cache (transit, explanation, result, session).', ('cache',)),
+    'odsay_key_calls': ('ODsay calls by API key (ODSAY_API_KEYn).', ('key',)),
+    'coalesced': ('Calls that waited for an identical in-flight call (request, transit, region, explanation).',
+                  ('kind',)),
+}
+
+
+def counter(name):
+    help_text, label_names = COUNTERS[name]
+    return registry.counter(f'{name}_total', help_text, ('stage',) + label_names)
+
+
+class RequestMetrics:
+    """요청 하나의 단계별 소요시간과 카운터. 스레드 풀/태스크에서 같이 쓰므로 잠근다."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds):
+        # 같은 이름의 단계가 여러 번 나오면 더한다
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_count(self, stage, name, labels, amount=1):
+        key = (stage, name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + amount
+
+    def count(self, name, stage=None, **labels):
+        # 단계를 주지 않으면 모든 단계를 더한다
+        with self._lock:
+            return sum(n for (s, c, l), n in self.counts.items()
+                       if c == name and (stage is None or s == stage) and all(item in l for item in labels.items()))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def server_timing(self):
+        # stage;dur=ms;desc="counter.label=n ..." (단계 밖에서 센 값은 total에 붙인다)
+        with self._lock:
+            spans = dict(self.spans)
+            counts = sorted(self.counts.items())
+        descs = {}
+        for (stage, name, labels), n in counts:
+            label = '.'.join([name] + [str(value) for _, value in labels])
+            descs.setdefault(stage if stage in spans else 'total', []).append(f'{label}={n}')
+        entries = []
+        for name, seconds in list(spans.items()) + [('total', self.elapsed())]:
+            entry = f'{name};dur={seconds * 1000:.1f}'
+            if name in descs:
+                entry += ';desc="{}"'.format(' '.join(descs[name]))
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+_current = ContextVar('request_metrics', default=None)
+_stage = ContextVar('metrics_stage', default=None)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def request_metrics(metrics=None):
+    metrics = metrics or RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name):
+    # 단계 하나의 소요시간. 안에서 센 카운터는 이 단계로 잡힌다
+    token = _stage.set(name)
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started_at
+        _stage.reset(token)
+        STAGE_SECONDS.observe(seconds, stage=name)
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_span(name, seconds)
+        logger.debug("%s took %.1fms", name, seconds * 1000)
+
+
+def count(name, amount=1, **labels):
+    stage = _stage.get() or 'none'
+    counter(name).inc(amount, stage=stage, **labels)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_count(stage, name, labels, amount)
+
+
+def submit(executor, fn, *args, **kwargs):
+    # executor.submit과 같지만 현재 요청/단계 contextvar를 작업 스레드로 넘긴다
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
+
+
+class MetricsMiddleware:
+    """요청마다 RequestMetrics를 열고 지연시간을 기록한 뒤 Server-Timing 헤더를 붙인다."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with request_metrics() as metrics:
+            response = self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        with request_metrics() as metrics:
+            response = await self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        REQUEST_SECONDS.observe(metrics.elapsed(), view=view, status=response.status_code)
+        if SERVER_TIMING:
+            # 스트리밍 응답은 헤더를 보낼 때까지 끝난 단계만 들어간다
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+
+def metrics_allowed(request):
+    if METRICS_TOKEN and hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                             f'Bearer {METRICS_TOKEN}'.encode()):
+        return True
+    return request.META.get('REMOTE_ADDR') in METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    # 허용되지 않은 요청에는 엔드포인트가 있다는 것도 알리지 않는다
+    if not metrics_allowed(request):
+        return HttpResponseNotFound()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -14,3 +14,13 @@ class Station(models.Model):
 
     def __str__(self):
         return self.station_name
+
+
+class StationDataSource(models.Model):
+    # load_stations로 마지막에 불러온 역 데이터 파일의 체크섬
+    name = models.CharField(max_length=100, unique=True)
+    checksum = models.CharField(max_length=64)
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.checksum[:8]})'
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from . import metrics
+
+# ODSAY_API_KEYn 키 스케줄러.
+# 키마다 토큰 버킷(초당 요청 수), 하루 사용량, 에러가 난 키의 일시 격리를 관리해서
+# 여유가 있는 키로만 요청을 보낸다. 사용량은 프로세스(워커)마다 따로 센다.
+ODSAY_KEY_RATE = float(os.getenv('ODSAY_KEY_RATE', 10))  # 키당 초당 요청 수 (0이면 제한 없음)
+ODSAY_KEY_BURST = float(os.getenv('ODSAY_KEY_BURST', ODSAY_KEY_RATE or 1))
+ODSAY_KEY_DAILY_QUOTA = int(os.getenv('ODSAY_KEY_DAILY_QUOTA', 0))  # 워커당 키별 하루 호출 수 (0이면 제한 없음)
+ODSAY_KEY_QUARANTINE_SECONDS = float(os.getenv('ODSAY_KEY_QUARANTINE_SECONDS', 30))
+ODSAY_KEY_MAX_QUARANTINE_SECONDS = float(os.getenv('ODSAY_KEY_MAX_QUARANTINE_SECONDS', 600))
+
+# ODsay 호출 한도는 한국 시간 자정에 초기화된다
+KST = timezone(timedelta(hours=9))
+
+
+def today_kst():
+    return datetime.now(KST).date()
+
+
+def load_api_keys():
+    keys = []
+    idx = 1
+    while True:
+        key = os.getenv(f'ODSAY_API_KEY{idx}')
+        if key is None:
+            break
+        keys.append(key)
+        idx += 1
+    return keys
+
+
+class KeyState:
+    def __init__(self, key, burst, now, day):
+        self.key = key
+        self.tokens = burst
+        self.updated_at = now
+        self.day = day
+        self.used_today = 0
+        self.exhausted = False
+        self.quarantined_until = 0.0
+        self.consecutive_errors = 0
+        self.successes = 0
+        self.errors = 0
+
+
+class ODsayKeyScheduler:
+    def __init__(self, keys, rate=ODSAY_KEY_RATE, burst=ODSAY_KEY_BURST, daily_quota=ODSAY_KEY_DAILY_QUOTA,
+                 quarantine_seconds=ODSAY_KEY_QUARANTINE_SECONDS,
+                 max_quarantine_seconds=ODSAY_KEY_MAX_QUARANTINE_SECONDS,
+                 clock=time.monotonic, today=today_kst):
+        self.rate = rate
+        self.burst = burst
+        self.daily_quota = daily_quota
+        self.quarantine_seconds = quarantine_seconds
+        self.max_quarantine_seconds = max_quarantine_seconds
+        self.clock = clock
+        self.today = today
+        self._lock = threading.Lock()
+        now = clock()
+        day = today()
+        self.states = [KeyState(key, burst, now, day) for key in keys]
+        self._by_key = {state.key: state for state in self.states}
+        self._labels = {state.key: f'ODSAY_API_KEY{idx + 1}' for idx, state in enumerate(self.states)}
+        self._next = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def label(self, key):
+        # 로그/메트릭에는 키 값 대신 환경 변수 이름을 쓴다
+        return self._labels.get(key, 'unknown')
+
+    def _refresh(self, state, now, day):
+        if state.day != day:
+            state.day = day
+            state.used_today = 0
+            state.exhausted = False
+        if self.rate:
+            state.tokens = min(self.burst, state.tokens + (now - state.updated_at) * self.rate)
+        state.updated_at = now
+
+    def _has_quota(self, state):
+        return not state.exhausted and (not self.daily_quota or state.used_today < self.daily_quota)
+
+    def try_acquire(self, exclude=()):
+        """여유 있는 키를 하나 꺼낸다 -> (key, None) 또는 (None, 기다릴 초; 오늘 쓸 키가 없으면 None)."""
+        with self._lock:
+            now = self.clock()
+            day = self.today()
+            wait = None
+            n = len(self.states)
+            for offset in range(n):
+                state = self.states[(self._next + offset) % n]
+                if state.key in exclude:
+                    continue
+                self._refresh(state, now, day)
+                if not self._has_quota(state):
+                    continue
+                if state.quarantined_until > now:
+                    key_wait = state.quarantined_until - now
+                elif self.rate and state.tokens < 1:
+                    key_wait = (1 - state.tokens) / self.rate
+                else:
+                    if self.rate:
+                        state.tokens -= 1
+                    state.used_today += 1
+                    # 다음 호출은 다음 키부터 찾는다 (라운드 로빈)
+                    self._next = (self._next + offset + 1) % n
+                    metrics.count('odsay_key_calls', key=self._labels[state.key])
+                    return state.key, None
+                wait = key_wait if wait is None else min(wait, key_wait)
+            return None, wait
+
+    def acquire(self, timeout=None, exclude=()):
+        # 여유 있는 키가 생길 때까지 최대 timeout초 기다린다. 없으면 None
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            key, wait = self.try_acquire(exclude=exclude)
+            if key is not None or wait is None:
+                return key
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    return None
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def report_success(self, key):
+        with self._lock:
+            state = self._by_key[key]
+            state.successes += 1
+            state.consecutive_errors = 0
+
+    def report_error(self, key, quota_exceeded=False):
+        with self._lock:
+            state = self._by_key[key]
+            state.errors += 1
+            if quota_exceeded:
+                # 오늘은 더 쓰지 않는다
+                state.exhausted = True
+                return
+            # 연속으로 에러가 나면 격리 시간을 두 배씩 늘린다
+            state.consecutive_errors += 1
+            seconds = min(self.quarantine_seconds * 2 ** (state.consecutive_errors - 1),
+                          self.max_quarantine_seconds)
+            state.quarantined_until = self.clock() + seconds
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            return [
+                {
+                    'key': self._labels[state.key],
+                    'used_today': state.used_today,
+                    'successes': state.successes,
+                    'errors': state.errors,
+                    'exhausted': state.exhausted,
+                    'quarantined': state.quarantined_until > now,
+                }
+                for state in self.states
+            ]
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_key_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ODsayKeyScheduler(load_api_keys())
+    return _scheduler
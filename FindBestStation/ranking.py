@@ -0,0 +1,158 @@
+import logging
+
+INF = float('inf')
+# 걸러낸 역이라 조회하지 않은 칸 (소요시간 None = 경로 없음과 구별한다)
+SKIPPED = object()
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingRanker:
+    """(역, 사용자) 소요시간을 도착하는 대로 받아서, 상위 top_n에 들 수 없는 역을 미리 걸러낸다.
+
+    최종 점수 = f + (1 - (T - Tmin) / R) * 2 (rank_stations와 같은 식)이므로
+    역 c의 소요시간 T_c가 다 모였고 역 s의 하한이 P_s (<= T_s, 받은 결과의 합 + 남은 구간의 하한)일 때
+
+        S_c - S_s = (f_c - f_s) + 2 * (T_s - T_c) / R
+
+    가 앞으로 어떤 결과가 와도 양수이면 c가 s를 이긴다(지배). 이런 c가 top_n개 이상이면
+    s의 나머지 호출은 보낼 필요가 없다. R 대신 다 모인 역들의 소요시간 범위 R_lo와
+    (s가 남는다면 생기는 범위) max(T_c) - T_s 중 큰 값을 쓰고, T_s는 가장 불리한 P_s로 둔다.
+    모든 호출을 끝까지 했을 때의 R도 이보다 작을 수 없으므로 걸러낸 역은 끝까지 계산했어도
+    top_n에 들지 못한다.
+    소요시간 점수는 0~2 범위이므로(|T_s - T_c| <= R) f_c - f_s > 2이면 소요시간과 상관없이 c가 이긴다.
+    그래서 다 모인 역 중 top_n번째로 높은 팩터 점수 - 2보다 팩터 점수가 낮은 역은 조회 전이라도 바로 걸러낸다
+    (역을 팩터 점수 순으로 넣으면 threshold algorithm의 문턱값).
+    걸러낸 역도 소요시간이 다 모이면 최종 순위 계산(정규화 범위)에 넣는다. 다 모이지 않은 역은 넣을 수 없는데,
+    그 역이 범위 R을 넓히면 남은 역들의 순서가 바뀔 수 있으므로 reopen_if_unstable()로 top_n 순서가
+    가능한 모든 R(>= 지금 범위)에서 같은지 보고, 아니면 그 역들을 다시 열어 나머지 소요시간을 받는다.
+    그래서 결과는 모든 소요시간으로 rank_stations를 한 것과 같다.
+    """
+
+    def __init__(self, stations, factor_scores, n_users, top_n=3, lower_bounds=None):
+        # lower_bounds[i][u]: 역 i까지 사용자 u의 소요시간 하한(분). 없으면 0
+        self.stations = list(stations)
+        self.factor_scores = list(factor_scores)
+        self.n_users = n_users
+        self.top_n = top_n
+        n = len(self.stations)
+        self.lower_bounds = lower_bounds
+        self.partial = [0.0] * n
+        self.remaining = [0.0] * n if lower_bounds is None else [float(sum(row)) for row in lower_bounds]
+        self.received = [0] * n
+        self.pruned = [False] * n
+        # reopen_if_unstable()로 다시 연 역은 다시 걸러내지 않는다
+        self.reopened = [False] * n
+        for i, score in enumerate(self.factor_scores):
+            if score is None:
+                # DB에 없는 역은 순위에 넣지 않는다
+                logger.warning("Error processing station %s: not in Station table", self.stations[i]['station_name'])
+                self.factor_scores[i] = 0.0
+                self.partial[i] = INF
+
+    def __len__(self):
+        return len(self.stations)
+
+    def is_complete(self, i):
+        return self.received[i] >= self.n_users
+
+    def is_dead(self, i):
+        return self.partial[i] == INF
+
+    def is_settled(self, i):
+        # 더 기다릴 결과가 없는 역
+        return self.pruned[i] or self.is_dead(i) or self.is_complete(i)
+
+    def is_pruned(self, i):
+        return self.pruned[i] or self.is_dead(i)
+
+    def done(self):
+        return all(self.is_settled(i) for i in range(len(self)))
+
+    def lower_bound(self, i):
+        return self.partial[i] + self.remaining[i]
+
+    def add(self, i, transit_time, user=None):
+        """역 i의 사용자 user 소요시간을 더하고, 새로 걸러낸 역 인덱스 목록을 돌려준다.
+        걸러낸 역의 결과도 정규화 범위에 쓰이므로 더해 둔다."""
+        if self.is_dead(i) or self.is_complete(i):
+            return []
+        self.received[i] += 1
+        if self.lower_bounds is not None:
+            self.remaining[i] -= self.lower_bounds[i][user]
+        # 기존 find_best_station과 같이 0/None은 경로 없음(inf)으로 본다
+        self.partial[i] += transit_time if transit_time else INF
+        return self._prune()
+
+    def _included(self):
+        # 최종 순위 계산에 들어가는 역: 소요시간이 다 모였고 경로가 있는 역
+        return [i for i in range(len(self)) if self.is_complete(i) and not self.is_dead(i)]
+
+    def _order_is_stable(self, included):
+        # 다 모이지 않은 역이 정규화 범위 R을 넓혀도(x = 1/R이 (0, 1/R_lo]의 어디여도) top_n 순서가 같은지.
+        # 점수 차 S_a - S_b = (f_a - f_b) - 2 * (T_a - T_b) * x는 x에 대해 일차식이므로 양 끝의 부호만 보면 된다
+        if not included:
+            return True
+        times = [self.partial[i] for i in included]
+        range_lo = max(times) - min(times)
+        x_hi = 1 / range_lo if range_lo else 1.0
+
+        def at_hi(i):
+            return self.factor_scores[i] - 2 * self.partial[i] * x_hi
+
+        top = sorted(included, key=at_hi, reverse=True)[:self.top_n]
+        for a in top:
+            for b in included:
+                if a == b:
+                    continue
+                hi = at_hi(a) - at_hi(b)
+                # x -> 0이면 팩터 점수 차, 같으면 소요시간 차
+                lo = (self.factor_scores[a] - self.factor_scores[b]) or (self.partial[b] - self.partial[a])
+                if hi == 0 or lo == 0 or (hi > 0) != (lo > 0):
+                    return False
+        return True
+
+    def reopen_if_unstable(self):
+        """모든 역이 정해진 뒤에 부른다. 걸러냈지만 소요시간이 다 모이지 않은 역 때문에 top_n 순서가 달라질 수 있으면
+        그 역들을 다시 열고 목록을 돌려준다 (나머지 소요시간을 받아야 한다). 그럴 필요가 없으면 []."""
+        unresolved = [i for i in range(len(self)) if self.pruned[i] and not self.is_complete(i) and not self.is_dead(i)]
+        if not unresolved or self._order_is_stable(self._included()):
+            return []
+        for i in unresolved:
+            self.pruned[i] = False
+            self.reopened[i] = True
+        return unresolved
+
+    def _dominates(self, c, s, range_lo, max_time):
+        diff = self.factor_scores[c] - self.factor_scores[s]
+        if diff > 2:
+            return True
+        t_c, p_s = self.partial[c], self.lower_bound(s)
+        if p_s >= t_c:
+            return diff > 0 or (diff == 0 and p_s > t_c)
+        # p_s < t_c <= max_time이므로 범위는 0보다 크다
+        return diff > 2 * (t_c - p_s) / max(range_lo, max_time - p_s)
+
+    def _prune(self):
+        complete = self._included()
+        if len(complete) < self.top_n:
+            return []
+        times = [self.partial[i] for i in complete]
+        max_time = max(times)
+        range_lo = max_time - min(times)
+        threshold = sorted((self.factor_scores[c] for c in complete), reverse=True)[self.top_n - 1] - 2
+        newly_pruned = []
+        for s in range(len(self)):
+            if self.is_settled(s) or self.reopened[s]:
+                continue
+            if (self.factor_scores[s] < threshold
+                    or sum(1 for c in complete if self._dominates(c, s, range_lo, max_time)) >= self.top_n):
+                self.pruned[s] = True
+                newly_pruned.append(s)
+        return newly_pruned
+
+    def station_scores(self):
+        # rank_stations 입력: [(station, factor_score, total_transit_time)].
+        # 걸러낸 역도 다 모였으면 실제 합을 넣어 정규화 범위를 넓히게 한다 (top_n에는 들지 않는다)
+        return [(station, score, transit_time if self.is_complete(i) else INF)
+                for i, (station, score, transit_time) in enumerate(zip(self.stations, self.factor_scores, self.partial))]
@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from shapely import STRtree
+from shapely.geometry import Point, shape
+
+# 행정구역(시/군/구) 경계 GeoJSON.
+# 각 feature의 properties에 카카오 coord2regioncode 응답과 같은 형식의
+# region_1depth_name (예: '경기도'), region_2depth_name (예: '수원시 장안구')이 있어야 한다.
+REGION_BOUNDARY_FILE = os.getenv(
+    'REGION_BOUNDARY_FILE',
+    os.path.join(settings.BASE_DIR, 'FindBestStation', 'fixtures', 'regions.geojson'),
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RegionLookup:
+    """시/군/구 폴리곤 위에 STRtree를 만들어 좌표 -> (region_1depth, region_2depth)를 찾는다."""
+
+    def __init__(self, geometries, names):
+        self.geometries = list(geometries)
+        self.names = list(names)
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    @classmethod
+    def from_features(cls, features):
+        geometries = []
+        names = []
+        for feature in features:
+            props = feature.get('properties') or {}
+            geometries.append(shape(feature['geometry']))
+            names.append((props.get('region_1depth_name', ''), props.get('region_2depth_name', '')))
+        return cls(geometries, names)
+
+    @classmethod
+    def from_geojson(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls.from_features(data.get('features', []))
+
+    def lookup(self, lon, lat):
+        point = Point(lon, lat)
+        hits = self.tree.query(point, predicate='intersects')
+        if len(hits) == 0:
+            return None
+        # 경계선 위의 점은 여러 폴리곤에 걸리므로 인덱스가 가장 작은 것을 쓴다
+        return self.names[int(min(hits))]
+
+
+_region_lookup = None
+_region_lookup_loaded = False
+_region_lookup_lock = threading.Lock()
+
+
+def get_region_lookup():
+    # 경계 파일이 없으면 None (호출하는 쪽에서 카카오 API로 대체)
+    global _region_lookup, _region_lookup_loaded
+    if not _region_lookup_loaded:
+        with _region_lookup_lock:
+            if not _region_lookup_loaded:
+                if os.path.exists(REGION_BOUNDARY_FILE):
+                    _region_lookup = RegionLookup.from_geojson(REGION_BOUNDARY_FILE)
+                else:
+                    logger.info("Region boundary file not found: %s. Using Kakao coord2regioncode.", REGION_BOUNDARY_FILE)
+                _region_lookup_loaded = True
+    return _region_lookup
@@ -0,0 +1,214 @@
+import logging
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from django.core.cache import InvalidCacheBackendError, caches
+
+from . import metrics, utils
+from .cache import LRUCache
+from .deadlines import DeadlineExceeded, expired, remaining
+
+# 재검색 세션: 그룹이 출발지를 더하거나 빼고 팩터를 바꿀 때마다 처음부터 다시 계산하지 않도록
+# 후보역과 (출발지, 역) 소요시간을 세션 id 아래에 잠깐 남겨둔다.
+# 팩터만 바뀌면 남겨둔 소요시간으로 순위만 다시 매기고(외부 호출 없음), 출발지가 더해지면 그 출발지 칸만 조회한다.
+MEETUP_SESSION_TTL = int(os.getenv('MEETUP_SESSION_TTL', 30 * 60))
+MEETUP_SESSION_CACHE_SIZE = int(os.getenv('MEETUP_SESSION_CACHE_SIZE', 4096))
+MEETUP_SESSION_CACHE_ALIAS = os.getenv('MEETUP_SESSION_CACHE_ALIAS', 'meetup_sessions')
+# 세션 후보역 수. 팩터가 바뀌어도 다시 조회하지 않도록 팩터와 상관없이 (추정 소요시간만으로) 고른다
+MEETUP_SESSION_CANDIDATE_K = int(os.getenv('MEETUP_SESSION_CANDIDATE_K', 10))
+
+_MISSING = object()
+
+logger = logging.getLogger(__name__)
+
+
+def time_key(location, station):
+    return float(location['lon']), float(location['lat']), station['station_name']
+
+
+class MeetupSession:
+    """세션에 남겨두는 그룹 상태: 출발지, 팩터, 후보역, (출발지, 역) 소요시간."""
+
+    def __init__(self, session_id, locations, factors, stations=None, times=None):
+        self.id = session_id
+        self.locations = list(locations)
+        self.factors = list(factors)
+        # None이면 출발지가 바뀌어서 후보역을 다시 찾아야 한다
+        self.stations = stations
+        # {(lon, lat, 역 이름): 분}. 출발지 순서가 바뀌어도 그대로 쓸 수 있게 좌표로 찾는다
+        self.times = dict(times or {})
+
+    def state(self):
+        return {'locations': self.locations, 'factors': self.factors, 'stations': self.stations, 'times': self.times}
+
+    @classmethod
+    def from_state(cls, session_id, state):
+        return cls(session_id, state['locations'], state['factors'], state['stations'], state['times'])
+
+    def add_locations(self, locations):
+        if locations:
+            self.locations.extend({'lon': float(loc['lon']), 'lat': float(loc['lat'])} for loc in locations)
+            self.stations = None
+
+    def remove_locations(self, indices):
+        # indices: 지금 locations의 순서. 범위를 벗어나면 IndexError
+        indices = set(indices)
+        for index in indices:
+            if not 0 <= index < len(self.locations):
+                raise IndexError(f"Location index out of range: {index}")
+        if indices:
+            self.locations = [loc for u, loc in enumerate(self.locations) if u not in indices]
+            self.stations = None
+
+    def set_stations(self, stations):
+        self.stations = list(stations)
+        self._forget_unused()
+
+    def _forget_unused(self):
+        # 지금 출발지/후보역에 없는 칸은 버린다 (세션을 작게 유지)
+        keys = {time_key(loc, station) for loc in self.locations for station in self.stations}
+        self.times = {key: minutes for key, minutes in self.times.items() if key in keys}
+
+    def missing_pairs(self):
+        # 아직 소요시간이 없는 (역 인덱스, 사용자 인덱스)
+        return [(i, u) for i, station in enumerate(self.stations) for u, loc in enumerate(self.locations)
+                if time_key(loc, station) not in self.times]
+
+    def record(self, times):
+        for (i, u), minutes in times.items():
+            self.times[time_key(self.locations[u], self.stations[i])] = minutes
+
+    def known_times(self):
+        # -> {(역 인덱스, 사용자 인덱스): 분}
+        return {(i, u): self.times[time_key(loc, station)]
+                for i, station in enumerate(self.stations) for u, loc in enumerate(self.locations)
+                if time_key(loc, station) in self.times}
+
+
+class SessionStore:
+    """세션 2단 저장소: in-process LRU -> Django 캐시 백엔드 (다른 워커로 온 요청도 같은 세션을 쓴다).
+
+    get()은 저장된 상태로 새 MeetupSession을 만들어 돌려주므로, 바꾼 내용은 save()해야 남는다.
+    """
+
+    def __init__(self, shared=_MISSING, ttl=MEETUP_SESSION_TTL, maxsize=MEETUP_SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._shared = shared
+
+    @property
+    def shared(self):
+        if self._shared is _MISSING:
+            try:
+                self._shared = caches[MEETUP_SESSION_CACHE_ALIAS]
+            except InvalidCacheBackendError:
+                self._shared = None
+        return self._shared
+
+    def key(self, session_id):
+        return f'session:{session_id}'
+
+    def create(self, locations, factors):
+        session = MeetupSession(secrets.token_urlsafe(16), [], factors)
+        session.add_locations(locations)
+        return session
+
+    def get(self, session_id):
+        key = self.key(session_id)
+        state = self.local.get(key)
+        if state is None and self.shared is not None:
+            state = self.shared.get(key)
+        metrics.count('cache_hits' if state is not None else 'cache_misses', cache='session')
+        return MeetupSession.from_state(session_id, state) if state is not None else None
+
+    def save(self, session):
+        key = self.key(session.id)
+        state = session.state()
+        self.local.set(key, state)
+        if self.shared is not None:
+            self.shared.set(key, state, timeout=self.ttl)
+
+    def clear(self):
+        self.local.clear()
+
+
+session_store = SessionStore()
+
+
+def session_candidates(stations, user_locations, k=None):
+    # 팩터 점수를 모두 0으로 두고 prune_candidates로 추정 소요시간이 짧은 k개를 고른다 (DB에 없는 역은 빠진다)
+    k = MEETUP_SESSION_CANDIDATE_K if k is None else k
+    table_scores = utils.station_factor_scores(stations, [])
+    candidates, _ = utils.prune_candidates(
+        stations, [0.0 if score is not None else None for score in table_scores], user_locations, k=k)
+    return candidates
+
+
+def fetch_transit_times(stations, user_locations, pairs, deadline=None):
+    """pairs [(역 인덱스, 사용자 인덱스)]의 소요시간을 동시에 조회한다 -> ({(i, u): 분}, 실패한 칸 집합).
+    실패한 칸은 대체값으로 들어가고, 마감까지 받지 못한 칸은 빠진다."""
+    if not pairs:
+        return {}, set()
+    wanted = set(pairs)
+    times = {pair: minutes for pair, minutes in utils.precomputed_transit_times(stations, user_locations).items()
+             if pair in wanted}
+    failed = set()
+
+    def fetch(i, u):
+        if expired(deadline):
+            raise DeadlineExceeded()
+        user, station = user_locations[u], stations[i]
+        return utils.get_transit_time(user['lon'], user['lat'], station['x'], station['y'], deadline=deadline)
+
+    rest = [pair for pair in pairs if pair not in times]
+    if not rest:
+        return times, failed
+    executor = ThreadPoolExecutor(max_workers=utils.TRANSIT_FETCH_CONCURRENCY or len(rest))
+    try:
+        futures = {metrics.submit(executor, fetch, i, u): (i, u) for i, u in rest}
+        try:
+            for future in as_completed(futures, timeout=remaining(deadline)):
+                try:
+                    times[futures[future]] = future.result()
+                except DeadlineExceeded:
+                    continue
+                except Exception as e:
+                    logger.warning("Exception occurred: %s", e)
+                    metrics.count('transit_fallbacks')
+                    times[futures[future]] = utils.TRANSIT_FALLBACK_MINUTES
+                    failed.add(futures[future])
+        except FuturesTimeoutError:
+            pass
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return times, failed
+
+
+def rank_session(session, deadline=None):
+    """세션의 후보역 순위를 매긴다. 없는 칸만 조회하고, 받은 소요시간은 세션에 남긴다.
+    -> find_best_station과 같은 형식의 결과 (estimated_locations 포함)"""
+    stations, user_locations = session.stations, session.locations
+    with metrics.span('transit'):
+        fetched, failed = fetch_transit_times(stations, user_locations, session.missing_pairs(), deadline)
+        # 대체값은 다음 변경 때 다시 조회해 보도록 남기지 않는다
+        session.record({pair: minutes for pair, minutes in fetched.items() if pair not in failed})
+
+        times = session.known_times()
+        times.update(fetched)
+        missing = [(i, u) for i in range(len(stations)) for u in range(len(user_locations)) if (i, u) not in times]
+        if missing:
+            logger.warning("Transit deadline exceeded. Estimating %d transit times.", len(missing))
+            metrics.count('estimated_pairs', len(missing))
+            times.update(utils.estimate_transit_times(stations, user_locations, missing))
+
+    with metrics.span('scoring'):
+        factor_scores = utils.station_factor_scores(stations, session.factors)
+        station_scores = []
+        for i, (station, score) in enumerate(zip(stations, factor_scores)):
+            # rank_stations와 같이 DB에 없는 역, 경로가 없는 칸(0/None)이 있는 역은 순위에서 뺀다
+            row = [times[(i, u)] for u in range(len(user_locations))]
+            total = sum(row) if score is not None and all(row) else float('inf')
+            station_scores.append((station, score or 0.0, total))
+        return utils.with_estimated_locations(utils.rank_stations(station_scores), stations, set(missing))
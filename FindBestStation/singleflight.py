@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import weakref
+
+from . import metrics
+from .deadlines import DeadlineExceeded
+
+# 같은 키의 작업이 동시에 여러 번 들어오면 먼저 온 호출(leader)만 실행하고
+# 나머지(follower)는 그 결과를 기다려서 같이 쓴다. 끝난 키는 바로 지워서 결과를 따로 보관하지 않는다(캐시 아님).
+# 결과를 오래 재사용하는 건 각 캐시가 하고, 이건 캐시가 채워지기 전 동시에 몰린 호출만 하나로 합친다.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """스레드용. do(key, fn, ...)는 같은 key로 진행 중인 호출이 있으면 그 결과(또는 예외)를 돌려준다.
+    timeout(초)을 주면 follower는 그만큼만 기다리고 DeadlineExceeded를 낸다 (leader의 호출은 계속된다)."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, timeout=None, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.count('coalesced', kind=self.name)
+            # leader의 마감이 더 늦거나 없어도 자기 마감까지만 기다린다
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class _AsyncCall:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """asyncio용. 작업은 태스크 하나로 돌리고, 기다리는 쪽이 모두 취소됐을 때만 그 태스크를 취소한다.
+    timeout(초)을 주면 그만큼만 기다리고 DeadlineExceeded를 낸다 (기다리는 쪽이 남아 있으면 작업은 계속된다)."""
+
+    def __init__(self, name):
+        self.name = name
+        # 태스크는 이벤트 루프에 묶이므로 루프마다 따로 둔다
+        self._calls = weakref.WeakKeyDictionary()
+
+    def _loop_calls(self):
+        loop = asyncio.get_running_loop()
+        calls = self._calls.get(loop)
+        if calls is None:
+            calls = self._calls[loop] = {}
+        return calls
+
+    async def do(self, key, fn, *args, timeout=None, **kwargs):
+        calls = self._loop_calls()
+        call = calls.get(key)
+        if call is None:
+            call = calls[key] = _AsyncCall(asyncio.ensure_future(fn(*args, **kwargs)))
+            call.task.add_done_callback(lambda task: calls.pop(key, None) if calls.get(key) is call else None)
+        else:
+            metrics.count('coalesced', kind=self.name)
+
+        call.waiters += 1
+        try:
+            # leader가 취소돼도 기다리는 follower가 있으면 작업은 계속된다
+            return await asyncio.wait_for(asyncio.shield(call.task), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded() from None
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                call.task.cancel()
+
+    def __len__(self):
+        calls = self._calls.get(asyncio.get_running_loop())
+        return len(calls) if calls else 0
@@ -0,0 +1,186 @@
+import math
+import threading
+
+import numpy as np
+
+from .station_table import get_station_table
+
+# 위경도 -> 평면(m) 근사 변환에 쓰는 값 (서울 규모에서는 오차가 0.1% 미만)
+METERS_PER_DEG_LAT = 110574.0
+METERS_PER_DEG_LON_AT_EQUATOR = 111320.0
+
+
+class StationIndex:
+    """Station 좌표 위에 만든 균일 격자(grid) 공간 인덱스.
+
+    격자 칸마다 역 인덱스를 CSR 형태(cell_start, order)로 저장해 두고,
+    질의 지점이 속한 칸에서부터 링(ring) 단위로 넓혀가며 가까운 역을 찾는다.
+    """
+
+    def __init__(self, stations, cell_size_m=1000.0):
+        self.stations = list(stations)
+        self.cell_size = float(cell_size_m)
+        # get_station_index()가 만든 인덱스면 원본 StationTable
+        self.table = None
+
+        lon = np.array([s['x'] for s in self.stations], dtype=np.float64)
+        lat = np.array([s['y'] for s in self.stations], dtype=np.float64)
+        self.ref_lat = float(lat.mean()) if len(lat) else 37.55
+        self.m_per_deg_lon = METERS_PER_DEG_LON_AT_EQUATOR * math.cos(math.radians(self.ref_lat))
+
+        self.px = lon * self.m_per_deg_lon
+        self.py = lat * METERS_PER_DEG_LAT
+
+        if len(self.stations) == 0:
+            self.min_x = self.min_y = 0.0
+            self.nx = self.ny = 1
+            self.cell_start = np.zeros(2, dtype=np.int64)
+            self.order = np.zeros(0, dtype=np.int64)
+            return
+
+        self.min_x = float(self.px.min())
+        self.min_y = float(self.py.min())
+        ix = ((self.px - self.min_x) // self.cell_size).astype(np.int64)
+        iy = ((self.py - self.min_y) // self.cell_size).astype(np.int64)
+        self.nx = int(ix.max()) + 1
+        self.ny = int(iy.max()) + 1
+
+        cell_id = iy * self.nx + ix
+        self.order = np.argsort(cell_id, kind='stable')
+        self.cell_start = np.searchsorted(cell_id[self.order], np.arange(self.nx * self.ny + 1))
+
+    @classmethod
+    def from_catalog(cls, stations, catalog):
+        # 카탈로그에 저장해 둔 격자 배열을 그대로 쓴다 (좌표 투영과 정렬을 다시 하지 않음)
+        index = cls.__new__(cls)
+        index.stations = list(stations)
+        index.table = None
+        params = catalog.index_params
+        index.cell_size = float(params['cell_size'])
+        index.ref_lat = float(params['ref_lat'])
+        index.m_per_deg_lon = float(params['m_per_deg_lon'])
+        index.min_x, index.min_y = float(params['min_x']), float(params['min_y'])
+        index.nx, index.ny = int(params['nx']), int(params['ny'])
+        for name in ('px', 'py', 'cell_start', 'order'):
+            setattr(index, name, catalog.arrays[name])
+        return index
+
+    def __len__(self):
+        return len(self.stations)
+
+    def project(self, lon, lat):
+        # 경위도 -> 이 인덱스의 평면 좌표(m). 같은 인덱스로 투영한 두 점의 거리는 유클리드 거리로 잰다
+        return lon * self.m_per_deg_lon, lat * METERS_PER_DEG_LAT
+
+    def _cell_of(self, qx, qy):
+        return (int(math.floor((qx - self.min_x) / self.cell_size)),
+                int(math.floor((qy - self.min_y) / self.cell_size)))
+
+    def _cells_indices(self, x0, x1, y0, y1):
+        # [x0, x1] x [y0, y1] 범위(격자 안으로 잘라낸) 칸들에 들어있는 역 인덱스
+        x0, x1 = max(x0, 0), min(x1, self.nx - 1)
+        y0, y1 = max(y0, 0), min(y1, self.ny - 1)
+        if x0 > x1 or y0 > y1:
+            return []
+        chunks = []
+        for iy in range(y0, y1 + 1):
+            row = iy * self.nx
+            start, end = self.cell_start[row + x0], self.cell_start[row + x1 + 1]
+            if end > start:
+                chunks.append(self.order[start:end])
+        return chunks
+
+    def _ring_indices(self, cx, cy, r):
+        if r == 0:
+            chunks = self._cells_indices(cx, cx, cy, cy)
+        else:
+            chunks = (self._cells_indices(cx - r, cx + r, cy - r, cy - r)
+                      + self._cells_indices(cx - r, cx + r, cy + r, cy + r)
+                      + self._cells_indices(cx - r, cx - r, cy - r + 1, cy + r - 1)
+                      + self._cells_indices(cx + r, cx + r, cy - r + 1, cy + r - 1))
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64)
+
+    def nearest_indices(self, lon, lat, k=15, radius_m=None):
+        """(lon, lat)에서 가까운 순으로 최대 k개 역의 (인덱스 배열, 거리(m) 배열)."""
+        if len(self.stations) == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        qx, qy = self.project(lon, lat)
+        cx, cy = self._cell_of(qx, qy)
+        max_ring = max(cx, self.nx - 1 - cx, cy, self.ny - 1 - cy, 0)
+        if radius_m is not None:
+            max_ring = min(max_ring, int(radius_m // self.cell_size) + 1)
+
+        found_idx = []
+        found_dist = []
+        for r in range(max_ring + 1):
+            idx = self._ring_indices(cx, cy, r)
+            if len(idx):
+                found_idx.append(idx)
+                found_dist.append(np.hypot(self.px[idx] - qx, self.py[idx] - qy))
+            # 링 r 바깥의 역은 모두 r * cell_size 보다 멀다
+            bound = r * self.cell_size
+            if found_idx:
+                dist = np.concatenate(found_dist)
+                if radius_m is not None and bound >= radius_m:
+                    break
+                if len(dist) >= k and np.partition(dist, k - 1)[k - 1] <= bound:
+                    break
+
+        if not found_idx:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        idx = np.concatenate(found_idx)
+        dist = np.concatenate(found_dist)
+        if radius_m is not None:
+            mask = dist <= radius_m
+            idx, dist = idx[mask], dist[mask]
+        sel = np.argsort(dist, kind='stable')[:k]
+        return idx[sel], dist[sel]
+
+    def nearest(self, lon, lat, k=15, radius_m=None):
+        idx, _ = self.nearest_indices(lon, lat, k=k, radius_m=radius_m)
+        return [self.stations[i] for i in idx]
+
+    def within(self, lon, lat, radius_m):
+        """(lon, lat)에서 radius_m 이내의 모든 역 (가까운 순)."""
+        if len(self.stations) == 0:
+            return []
+        qx, qy = self.project(lon, lat)
+        cx, cy = self._cell_of(qx, qy)
+        r = int(radius_m // self.cell_size) + 1
+        chunks = self._cells_indices(cx - r, cx + r, cy - r, cy + r)
+        if not chunks:
+            return []
+        idx = np.concatenate(chunks)
+        dist = np.hypot(self.px[idx] - qx, self.py[idx] - qy)
+        mask = dist <= radius_m
+        idx, dist = idx[mask], dist[mask]
+        return [self.stations[i] for i in idx[np.argsort(dist, kind='stable')]]
+
+
+_station_index = None
+_station_index_lock = threading.Lock()
+
+
+def get_station_index():
+    # 역 테이블과 같은 순서로 만들어서 인덱스 번호를 테이블 인덱스로 그대로 쓸 수 있다.
+    # 역 테이블이 다시 만들어지면(Station 변경) 인덱스도 다시 만든다
+    global _station_index
+    table = get_station_table()
+    if _station_index is None or _station_index.table is not table:
+        with _station_index_lock:
+            if _station_index is None or _station_index.table is not table:
+                if table.catalog is not None:
+                    index = StationIndex.from_catalog(table.stations, table.catalog)
+                else:
+                    index = StationIndex(table.stations)
+                index.table = table
+                _station_index = index
+    return _station_index
+
+
+def reset_station_index():
+    global _station_index
+    with _station_index_lock:
+        _station_index = None
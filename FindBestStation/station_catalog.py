@@ -0,0 +1,127 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from django.conf import settings
+
+# 역 카탈로그: 역 테이블(코드, 이름, 좌표, 팩터)과 공간 인덱스 배열을 한 파일에 모은 바이너리.
+# build_station_catalog 명령으로 만들고, 있으면 get_station_table()이 DB 대신 이 파일을 mmap으로 연다.
+# 배열은 모두 파일을 직접 가리키는 읽기 전용 뷰라 워커가 몇 개든 OS 페이지 캐시의 한 벌을 같이 쓴다.
+#
+# 파일 형식: MAGIC(8) | 헤더 길이(uint32 LE) | 헤더 JSON | 배열들 (CATALOG_ALIGN 바이트 정렬)
+STATION_CATALOG_FILE = os.getenv(
+    'STATION_CATALOG_FILE',
+    os.path.join(settings.BASE_DIR, 'data', 'station_catalog.bin'),
+)
+CATALOG_MAGIC = b'WSMCAT\x00\x01'
+CATALOG_FORMAT = 1
+CATALOG_ALIGN = 64
+ARRAY_NAMES = ('codes', 'names', 'lon', 'lat', 'factors', 'px', 'py', 'cell_start', 'order')
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def _aligned(offset):
+    return (offset + CATALOG_ALIGN - 1) // CATALOG_ALIGN * CATALOG_ALIGN
+
+
+def _fixed_width(strings):
+    # 문자열 목록 -> UTF-8 고정 길이 바이트 배열
+    encoded = [s.encode('utf-8') for s in strings]
+    return np.array(encoded, dtype=f'S{max((len(b) for b in encoded), default=1) or 1}')
+
+
+def write_catalog(path, table, index, factor_fields, source_checksum=None):
+    """StationTable과 같은 순서로 만든 StationIndex를 카탈로그 파일로 쓴다 -> 헤더."""
+    arrays = {
+        'codes': _fixed_width(table.codes),
+        'names': _fixed_width(table.names),
+        'lon': np.ascontiguousarray(table.lon, dtype='<f8'),
+        'lat': np.ascontiguousarray(table.lat, dtype='<f8'),
+        'factors': np.ascontiguousarray(table.factors, dtype='<f8'),
+        'px': np.ascontiguousarray(index.px, dtype='<f8'),
+        'py': np.ascontiguousarray(index.py, dtype='<f8'),
+        'cell_start': np.ascontiguousarray(index.cell_start, dtype='<i8'),
+        'order': np.ascontiguousarray(index.order, dtype='<i8'),
+    }
+    digest = hashlib.sha1()
+    for name in ARRAY_NAMES:
+        digest.update(arrays[name].tobytes())
+    header = {
+        'format': CATALOG_FORMAT,
+        'version': digest.hexdigest()[:12],
+        'count': len(table),
+        'factor_fields': list(factor_fields),
+        'source_checksum': source_checksum,
+        'index': {
+            'cell_size': index.cell_size, 'ref_lat': index.ref_lat, 'm_per_deg_lon': index.m_per_deg_lon,
+            'min_x': index.min_x, 'min_y': index.min_y, 'nx': index.nx, 'ny': index.ny,
+        },
+        'arrays': {},
+    }
+    # 헤더 길이가 오프셋에 따라 바뀌므로 배열 시작 위치를 넉넉히 잡고 채운다
+    offset = _aligned(len(CATALOG_MAGIC) + 4 + 4096 + 64 * len(ARRAY_NAMES))
+    for name in ARRAY_NAMES:
+        array = arrays[name]
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    first_offset = header['arrays'][ARRAY_NAMES[0]]['offset']
+    if len(CATALOG_MAGIC) + 4 + len(header_bytes) > first_offset:
+        raise CatalogError("Catalog header is too large.")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # 쓰는 도중에 죽어도 기존 파일이 깨지지 않도록 임시 파일에 쓰고 교체
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(CATALOG_MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        for name in ARRAY_NAMES:
+            f.seek(header['arrays'][name]['offset'])
+            f.write(arrays[name].tobytes())
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+    return header
+
+
+class StationCatalog:
+    """카탈로그 파일을 mmap으로 연 것. arrays의 배열은 복사 없이 파일을 가리키는 읽기 전용 뷰."""
+
+    def __init__(self, path=STATION_CATALOG_FILE, factor_fields=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(CATALOG_MAGIC)] != CATALOG_MAGIC:
+            raise CatalogError(f"{path} is not a station catalog.")
+        (header_len,) = struct.unpack_from('<I', self._mmap, len(CATALOG_MAGIC))
+        start = len(CATALOG_MAGIC) + 4
+        self.header = json.loads(self._mmap[start:start + header_len].decode('utf-8'))
+        if self.header.get('format') != CATALOG_FORMAT:
+            raise CatalogError(f"{path} has catalog format {self.header.get('format')}, expected {CATALOG_FORMAT}.")
+        if factor_fields is not None and self.header['factor_fields'] != list(factor_fields):
+            raise CatalogError(f"{path} was built for factors {self.header['factor_fields']}.")
+
+        self.arrays = {}
+        for name, spec in self.header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape'], dtype=np.int64))
+            self.arrays[name] = np.frombuffer(self._mmap, dtype=dtype, count=count,
+                                              offset=spec['offset']).reshape(spec['shape'])
+
+    def __len__(self):
+        return self.header['count']
+
+    @property
+    def version(self):
+        return self.header['version']
+
+    @property
+    def index_params(self):
+        return self.header['index']
+
+    def strings(self, name):
+        return [value.decode('utf-8') for value in self.arrays[name]]
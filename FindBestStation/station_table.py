@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Station, StationDataSource
+from .station_catalog import STATION_CATALOG_FILE, StationCatalog
+
+FACTOR_IDS = [2, 3, 4, 5, 6, 7]
+FACTOR_FIELDS = [f'factor_{factor}' for factor in FACTOR_IDS]
+
+logger = logging.getLogger(__name__)
+
+
+def load_factor_weights():
+    return np.array([float(os.getenv(f'FACTOR_{factor}_WEIGHT', 1)) for factor in FACTOR_IDS])
+
+
+# 가중치는 환경변수에서 한 번만 읽는다
+FACTOR_WEIGHTS = load_factor_weights()
+# 다른 프로세스(load_stations 명령 등)에서 바꾼 역 데이터는 시그널로 알 수 없으므로
+# 이 간격(초)마다 StationDataSource 체크섬을 다시 읽어 역 테이블을 불러올 때와 다르면 다시 읽는다
+STATION_SOURCE_CHECK_SECONDS = float(os.getenv('STATION_SOURCE_CHECK_SECONDS', 10))
+
+
+def factor_columns(factors):
+    # factors가 None이면 전체 팩터. 2~7 밖의 값이면 ValueError
+    if factors is None:
+        factors = FACTOR_IDS
+    columns = []
+    for factor in factors:
+        if factor not in FACTOR_IDS:
+            raise ValueError(f"Unknown factor: {factor}")
+        columns.append(factor - FACTOR_IDS[0])
+    return np.array(columns, dtype=np.int64)
+
+
+class StationTable:
+    """프로세스 전체에서 공유하는 역 테이블 (좌표 배열 + 역 x 6 팩터 행렬)."""
+
+    def __init__(self, codes, names, lon, lat, factors):
+        self.codes = list(codes)
+        self.names = list(names)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.factors = np.asarray(factors, dtype=np.float64).reshape(len(self.codes), len(FACTOR_IDS))
+        self.by_code = {code: i for i, code in enumerate(self.codes)}
+        self.by_name = {}
+        for i, name in enumerate(self.names):
+            self.by_name.setdefault(name, i)
+        # 후보역 검색 결과로 돌려주는 dict
+        self.stations = [
+            {'station_code': code, 'station_name': name, 'x': float(x), 'y': float(y)}
+            for code, name, x, y in zip(self.codes, self.names, self.lon, self.lat)
+        ]
+        self._version = None
+        # from_catalog()로 만든 테이블이면 원본 StationCatalog (공간 인덱스 배열도 여기서 가져온다)
+        self.catalog = None
+        # 불러올 때의 station_sources(). 다르면 refresh_station_table()이 다시 읽는다
+        self.sources = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def version(self):
+        # 역 데이터와 팩터 가중치가 같으면 같은 값. 결과 캐시 키에 넣어서 둘 중 하나가 바뀌면 예전 결과를 안 쓴다
+        if self._version is None:
+            digest = hashlib.sha1('\n'.join(f'{code}\t{name}' for code, name in zip(self.codes, self.names)).encode())
+            for array in (self.lon, self.lat, self.factors, FACTOR_WEIGHTS):
+                digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+            self._version = digest.hexdigest()[:12]
+        return self._version
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = list(rows)
+        return cls(
+            [row['station_code'] for row in rows],
+            [row['station_name'] for row in rows],
+            [row['x'] for row in rows],
+            [row['y'] for row in rows],
+            [[row[field] for field in FACTOR_FIELDS] for row in rows],
+        )
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        # 좌표/팩터 배열은 카탈로그 파일을 가리키는 뷰 그대로 쓴다 (복사하지 않음)
+        table = cls(catalog.strings('codes'), catalog.strings('names'),
+                    catalog.arrays['lon'], catalog.arrays['lat'], catalog.arrays['factors'])
+        table.catalog = catalog
+        table.sources = catalog.header.get('source_checksum')
+        return table
+
+    def indices_of(self, stations):
+        # station dict 목록 -> 테이블 인덱스 배열 (없는 역은 -1)
+        return np.array([self.by_name.get(station['station_name'], -1) for station in stations], dtype=np.int64)
+
+    def factor_scores(self, indices, factors, weights=None):
+        """indices 역들의 팩터 점수 = 1 + sum(factor * weight). 한 번의 행렬 곱으로 계산한다."""
+        weights = FACTOR_WEIGHTS if weights is None else weights
+        columns = factor_columns(factors)
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(columns) == 0:
+            return np.ones(len(indices))
+        return 1.0 + self.factors[np.ix_(indices, columns)] @ weights[columns]
+
+
+def station_rows():
+    return Station.objects.values('station_code', 'station_name', 'x', 'y', *FACTOR_FIELDS).order_by('id')
+
+
+def station_sources():
+    # load_stations로 마지막에 불러온 파일 체크섬 {이름: 체크섬}. 없으면 None (카탈로그 헤더의 source_checksum과 같은 형식)
+    return dict(StationDataSource.objects.values_list('name', 'checksum')) or None
+
+
+def load_station_table():
+    # 역 카탈로그 파일이 있으면 mmap으로 열고(DB 조회 없음), 없거나 이 프로세스에서 Station이 바뀌었으면 DB에서 읽는다
+    if not _catalog_stale and os.path.exists(STATION_CATALOG_FILE):
+        try:
+            return StationTable.from_catalog(StationCatalog(STATION_CATALOG_FILE, FACTOR_FIELDS))
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring station catalog %s: %s", STATION_CATALOG_FILE, e)
+    sources = station_sources()
+    table = StationTable.from_rows(station_rows())
+    table.sources = sources
+    return table
+
+
+_station_table = None
+_station_table_lock = threading.Lock()
+# Station이 바뀐 뒤에는 카탈로그가 DB보다 오래됐으므로 build_station_catalog로 다시 만들 때까지 DB를 읽는다
+_catalog_stale = False
+
+
+def get_station_table():
+    global _station_table
+    if _station_table is None:
+        with _station_table_lock:
+            if _station_table is None:
+                _station_table = load_station_table()
+    return _station_table
+
+
+def reset_station_table(stale_catalog=False):
+    global _station_table, _catalog_stale
+    with _station_table_lock:
+        _station_table = None
+        _catalog_stale = _catalog_stale or stale_catalog
+
+
+_sources_checked_at = None
+
+
+def refresh_station_table():
+    """다른 프로세스에서 load_stations로 역 데이터를 바꿨으면 역 테이블을 다시 읽는다 -> 지금 역 테이블.
+    DB는 STATION_SOURCE_CHECK_SECONDS마다 한 번만 읽으므로 요청마다 불러도 된다 (async 코드에서는 sync_to_async로)."""
+    global _sources_checked_at
+    table = get_station_table()
+    now = time.monotonic()
+    if _sources_checked_at is not None and now - _sources_checked_at < STATION_SOURCE_CHECK_SECONDS:
+        return table
+    _sources_checked_at = now
+    if station_sources() != table.sources:
+        logger.info("Station data sources changed; reloading the station table.")
+        # 카탈로그도 예전 데이터로 만든 것이므로 다시 만들 때까지 DB를 읽는다
+        reset_station_table(stale_catalog=True)
+        table = get_station_table()
+    return table
+
+
+@receiver(post_save, sender=Station)
+@receiver(post_delete, sender=Station)
+def _invalidate_station_table(sender, **kwargs):
+    reset_station_table(stale_catalog=True)
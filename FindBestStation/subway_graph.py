@@ -0,0 +1,152 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+
+import networkx as nx
+import numpy as np
+from django.conf import settings
+
+from .spatial import get_station_index
+from .transit_matrix import walking_minutes
+
+# 지하철 노선 그래프로 소요시간을 계산한다 (ODsay 대신, ODsay가 실패했을 때, 후보역을 줄일 때).
+# 노선 파일 형식 (역 이름은 Station.station_name과 같아야 한다):
+# {
+#   "transfer_minutes": 5,                 # 기본 환승/승차 대기 시간(분)
+#   "transfers": {"신도림역": 7},           # 역별 환승 시간 (선택)
+#   "lines": [
+#     {"name": "2호선", "stations": ["시청역", "을지로입구역", ...], "minutes": 2, "circular": true},
+#     {"name": "2호선", "stations": ["성수역", "용답역", ...], "minutes": [2, 2, 3]}   # 지선은 같은 이름으로
+#   ]
+# }
+SUBWAY_NETWORK_FILE = os.getenv(
+    'SUBWAY_NETWORK_FILE',
+    os.path.join(settings.BASE_DIR, 'data', 'subway_network.json'),
+)
+SUBWAY_TRANSFER_MINUTES = float(os.getenv('SUBWAY_TRANSFER_MINUTES', 5))
+SUBWAY_SNAP_K = int(os.getenv('SUBWAY_SNAP_K', 3))
+SUBWAY_SNAP_RADIUS = float(os.getenv('SUBWAY_SNAP_RADIUS', 1500))
+# 이보다 오래 걸리는 경로는 찾지 않는다(분)
+SUBWAY_MAX_MINUTES = float(os.getenv('SUBWAY_MAX_MINUTES', 240))
+
+logger = logging.getLogger(__name__)
+
+
+class SubwayGraph:
+    """역 노드(역 이름)와 노선별 정차 노드((역 이름, 노선))로 된 무향 그래프.
+
+    역 -- (역, 노선) 간선은 환승 시간의 절반이라 한 번 타고 내리면 환승 시간 하나가 더해지고
+    (출발할 때 기다리는 시간), 같은 역에서 노선을 갈아탈 때도 환승 시간이 한 번 더해진다.
+    (역, 노선) -- (다음 역, 노선) 간선은 역간 운행 시간이다.
+    """
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+        # 공간 인덱스의 역 순서 -> 그래프의 역 노드 (노선 파일에 없는 역은 None)
+        self.index_nodes = [s['station_name'] if s['station_name'] in graph else None for s in index.stations]
+
+    def __len__(self):
+        return sum(1 for node in self.graph if isinstance(node, str))
+
+    @classmethod
+    def from_network(cls, network, index):
+        transfer_minutes = float(network.get('transfer_minutes', SUBWAY_TRANSFER_MINUTES))
+        transfers = network.get('transfers', {})
+        graph = nx.Graph()
+        for line in network['lines']:
+            name, stations = line['name'], line['stations']
+            circular = bool(line.get('circular'))
+            segments = list(zip(stations, stations[1:] + stations[:1] if circular else stations[1:]))
+            minutes = line.get('minutes', 2)
+            if not isinstance(minutes, list):
+                minutes = [minutes] * len(segments)
+            if len(minutes) != len(segments):
+                raise ValueError(f"Line {name}: {len(segments)} segments but {len(minutes)} run times.")
+            for station in stations:
+                graph.add_edge(station, (station, name), weight=float(transfers.get(station, transfer_minutes)) / 2)
+            for (a, b), run_minutes in zip(segments, minutes):
+                graph.add_edge((a, name), (b, name), weight=float(run_minutes))
+        return cls(graph, index)
+
+    @classmethod
+    def load(cls, path, index):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_network(json.load(f), index)
+
+    def snap(self, lon, lat):
+        # 가까운 역(그래프에 있는 역만) -> 걸어가는 시간(분)
+        idx, dist = self.index.nearest_indices(lon, lat, k=SUBWAY_SNAP_K, radius_m=SUBWAY_SNAP_RADIUS)
+        snapped = {}
+        for i, distance in zip(idx, dist):
+            node = self.index_nodes[i]
+            if node is not None:
+                snapped[node] = min(snapped.get(node, np.inf), walking_minutes(distance))
+        return snapped
+
+    def shortest_minutes(self, sources, targets, cutoff=SUBWAY_MAX_MINUTES):
+        """여러 출발 노드({노드: 시작 시간})에서 한 번의 Dijkstra로 targets까지의 최단 시간.
+        모든 target이 정해지면 멈춘다. 닿지 못한 target은 결과에 없다."""
+        targets = set(targets)
+        settled = {}
+        best = dict(sources)
+        order = itertools.count()
+        heap = [(minutes, next(order), node) for node, minutes in sources.items()]
+        heapq.heapify(heap)
+        adj = self.graph.adj
+        while heap and targets:
+            minutes, _, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled[node] = minutes
+            targets.discard(node)
+            for neighbor, attrs in adj[node].items():
+                candidate = minutes + attrs['weight']
+                if neighbor not in settled and candidate <= cutoff and candidate < best.get(neighbor, np.inf):
+                    best[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, next(order), neighbor))
+        return settled
+
+    def minutes_from(self, lon, lat, destinations):
+        """(lon, lat)에서 destinations(x, y가 있는 dict 목록) 각각까지의 소요시간(분, 경로가 없으면 None).
+        도착지마다 가까운 역에 붙이고, 출발지 하나에 Dijkstra는 한 번만 돈다."""
+        sources = self.snap(lon, lat)
+        snapped = [self.snap(d['x'], d['y']) for d in destinations]
+        reached = self.shortest_minutes(sources, set().union(*snapped)) if sources and destinations else {}
+
+        sx, sy = self.index.project(lon, lat)
+        results = []
+        for destination, walks in zip(destinations, snapped):
+            best = min((reached[node] + walk for node, walk in walks.items() if node in reached), default=np.inf)
+            # 가까운 거리면 바로 걸어가는 편이 빠를 수 있다
+            ex, ey = self.index.project(destination['x'], destination['y'])
+            direct = float(np.hypot(ex - sx, ey - sy))
+            if direct <= SUBWAY_SNAP_RADIUS:
+                best = min(best, walking_minutes(direct))
+            results.append(None if best == np.inf else max(int(round(best)), 1))
+        return results
+
+    def transit_time(self, start_x, start_y, end_x, end_y):
+        return self.minutes_from(start_x, start_y, [{'x': end_x, 'y': end_y}])[0]
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_subway_graph():
+    # 노선 파일이 없으면 None (이때는 역 테이블도 읽지 않는다). 역 데이터가 바뀌면 다시 만든다
+    global _graph
+    if not os.path.exists(SUBWAY_NETWORK_FILE):
+        return None
+    index = get_station_index()
+    if _graph is None or _graph.index is not index:
+        with _graph_lock:
+            if _graph is None or _graph.index is not index:
+                _graph = SubwayGraph.load(SUBWAY_NETWORK_FILE, index)
+                logger.info("Loaded subway network: %d stations, %d matched", len(_graph),
+                            sum(node is not None for node in _graph.index_nodes))
+    return _graph
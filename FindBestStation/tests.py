@@ -1,39 +1,1352 @@
+import asyncio
+import io
+import json
 import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import numpy as np
 import responses
-from django.test import TestCase
+from unittest import mock
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, TestCase
 from django.urls import reverse
+from .models import Station, StationDataSource
+from .loaders import STATION_JSON_FILE, load_stations_from_json
+from .spatial import StationIndex, get_station_index, reset_station_index
+from .station_catalog import StationCatalog, write_catalog
+from .ranking import StreamingRanker
+from .station_table import StationTable, get_station_table, reset_station_table
+from .regions import RegionLookup
+from .cache import LRUCache, ResultCache, TransitTimeCache
+from . import async_pipeline, metrics, utils, views
+from CGPT.explanations import explanation_service
+from .odsay_keys import ODsayKeyScheduler
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .deadlines import Deadline, DeadlineExceeded, LatencyTracker
+from .factor_rankings import N_SUBSETS, FactorRankings, subset_mask
+from .sessions import SessionStore
+from .isochrones import IsochroneEstimator, IsochroneGrid, fill_grid, station_minutes_from_matrix
+from .subway_graph import SubwayGraph
+from .transit_matrix import NO_ROUTE, UNKNOWN, MatrixTransitEstimator, TransitMatrix
 
 logger = logging.getLogger(__name__)
 
-class ODsayAPITestCase(TestCase):
+class ODsayAPITestCase(SimpleTestCase):
+    def setUp(self):
+        patchers = [
+            mock.patch.object(utils, 'transit_cache', TransitTimeCache(shared=None)),
+            mock.patch.object(utils, 'get_key_scheduler', lambda: self.scheduler),
+            mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'),
+            mock.patch.object(utils, 'TRANSIT_FALLBACK_PROVIDER', 'none'),
+        ]
+        self.scheduler = ODsayKeyScheduler(['key-1', 'key-2'], rate=0)
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     @responses.activate
-    def test_get_public_transport_info(self):
-        logger.info("Starting test_get_public_transport_info...")
-        
-        # 더미 데이터 설정
-        dummy_data = {
-            "result": {
-                "type": "dummy",
-                "message": "This is dummy data for testing purposes."
-            }
-        }
+    def test_get_transit_time(self):
+        logger.info("Starting test_get_transit_time...")
         responses.add(
             responses.GET,
-            'https://api.odsay.com/v1/api/searchPubTransPath',
-            json=dummy_data,
+            utils.ODSAY_TRANSIT_URL,
+            json={"result": {"path": [{"info": {"totalTime": 42}}, {"info": {"totalTime": 35}}]}},
             status=200
         )
 
-        # API 호출
-        response = self.client.get(reverse('get_public_transport_info'), data={
-            'SX': '127.1054328',
-            'SY': '37.3595963',
-            'EX': '127.1102192',
-            'EY': '37.3942435',
-            'SearchType': '0'
-        })
-        
-        logger.debug(f"API Response: {response.json()}")
+        self.assertEqual(utils.get_transit_time(127.1054328, 37.3595963, 127.1102192, 37.3942435), 35)
+        # 같은 구간은 캐시에서
+        self.assertEqual(utils.get_transit_time(127.1054328, 37.3595963, 127.1102192, 37.3942435), 35)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertIn('SX=127.1054328', responses.calls[0].request.url)
+
+    @responses.activate
+    def test_quota_error_retries_with_next_key(self):
+        responses.add(responses.GET, utils.ODSAY_TRANSIT_URL,
+                      json={"error": [{"code": "429", "message": "호출 한도 초과"}]}, status=200)
+        responses.add(responses.GET, utils.ODSAY_TRANSIT_URL,
+                      json={"result": {"path": [{"info": {"totalTime": 20}}]}}, status=200)
+
+        with metrics.request_metrics() as request_metrics, metrics.span('transit'):
+            self.assertEqual(utils.get_transit_time(127.0, 37.5, 127.1, 37.6), 20)
+        self.assertEqual([state['exhausted'] for state in self.scheduler.stats()], [True, False])
+        self.assertEqual(request_metrics.count('upstream_calls', stage='transit', provider='odsay'), 2)
+        self.assertEqual(request_metrics.count('odsay_retries'), 1)
+        self.assertEqual(request_metrics.count('odsay_key_calls', key='ODSAY_API_KEY2'), 1)
+        self.assertEqual(request_metrics.count('cache_misses', cache='transit'), 1)
+
+    @responses.activate
+    def test_route_error_falls_back(self):
+        responses.add(responses.GET, utils.ODSAY_TRANSIT_URL,
+                      json={"error": {"code": "-98", "msg": "출, 도착지가 700m이내입니다."}}, status=200)
+
+        with metrics.request_metrics() as request_metrics:
+            self.assertEqual(utils.get_transit_time(127.0, 37.5, 127.001, 37.5), utils.TRANSIT_FALLBACK_MINUTES)
+            # 실패는 잠깐 기억해서 다시 부르지 않는다
+            self.assertEqual(utils.get_transit_time(127.0, 37.5, 127.001, 37.5), utils.TRANSIT_FALLBACK_MINUTES)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(request_metrics.count('transit_fallbacks'), 2)
+
+    def test_slow_call_is_hedged_on_another_key(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def fake_request(start_x, start_y, end_x, end_y, api_key, timeout=None):
+            if api_key == 'key-1':
+                release.wait(5)
+                return 99, None
+            return 30, None
+
+        with mock.patch.object(utils, 'odsay_latency', LatencyTracker(default=0.05)), \
+                mock.patch.object(utils, 'request_odsay_transit_time', fake_request), \
+                metrics.request_metrics() as request_metrics:
+            started_at = time.monotonic()
+            self.assertEqual(utils.get_transit_time(127.0, 37.5, 127.1, 37.6), 30)
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertEqual(request_metrics.count('odsay_hedges'), 1)
+
+
+class StationIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.stations = [
+            {'station_code': str(i), 'station_name': f'{i}역',
+             'x': 126.8 + rng.random() * 0.4, 'y': 37.4 + rng.random() * 0.3}
+            for i in range(300)
+        ]
+        self.index = StationIndex(self.stations)
+
+    def brute_force(self, lon, lat, radius_m):
+        index = self.index
+        qx, qy = index.project(lon, lat)
+        dists = sorted(
+            (((index.px[i] - qx) ** 2 + (index.py[i] - qy) ** 2) ** 0.5, i)
+            for i in range(len(self.stations))
+        )
+        return [i for d, i in dists if d <= radius_m]
+
+    def test_nearest_matches_brute_force(self):
+        for lon, lat in [(126.978, 37.5665), (127.1, 37.45), (126.5, 37.2)]:
+            expected = self.brute_force(lon, lat, 20000)[:15]
+            result = self.index.nearest(lon, lat, k=15, radius_m=20000)
+            self.assertEqual([s['station_code'] for s in result], [str(i) for i in expected])
+
+    def test_within_radius(self):
+        expected = self.brute_force(126.978, 37.5665, 3000)
+        result = self.index.within(126.978, 37.5665, 3000)
+        self.assertEqual([s['station_code'] for s in result], [str(i) for i in expected])
+
+    def test_empty_index(self):
+        self.assertEqual(StationIndex([]).nearest(126.978, 37.5665), [])
+
+
+class RegionLookupTestCase(SimpleTestCase):
+    def square(self, x0, y0, x1, y1):
+        return {'type': 'Polygon', 'coordinates': [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]}
+
+    def test_lookup(self):
+        lookup = RegionLookup.from_features([
+            {'type': 'Feature', 'geometry': self.square(126.9, 37.5, 127.0, 37.6),
+             'properties': {'region_1depth_name': '서울특별시', 'region_2depth_name': '중구'}},
+            {'type': 'Feature', 'geometry': self.square(127.0, 37.2, 127.1, 37.3),
+             'properties': {'region_1depth_name': '경기도', 'region_2depth_name': '수원시 장안구'}},
+        ])
+        self.assertEqual(lookup.lookup(126.95, 37.55), ('서울특별시', '중구'))
+        self.assertEqual(lookup.lookup(127.05, 37.25), ('경기도', '수원시 장안구'))
+        self.assertIsNone(lookup.lookup(128.0, 36.0))
+
+
+class TransitMatrixTestCase(SimpleTestCase):
+    def setUp(self):
+        self.stations = [
+            {'station_code': 'A', 'station_name': 'A역', 'x': 126.90, 'y': 37.50},
+            {'station_code': 'B', 'station_name': 'B역', 'x': 127.00, 'y': 37.50},
+            {'station_code': 'C', 'station_name': 'C역', 'x': 127.10, 'y': 37.50},
+        ]
+        self.matrix = TransitMatrix.empty(['A', 'B', 'C'])
+        self.matrix.set_minutes(0, 1, 20)
+        self.matrix.set_minutes(0, 2, 35)
+        self.matrix.set_minutes(1, 2, None)
+
+    def test_save_load_and_remap(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'matrix.npy')
+            self.matrix.save(path)
+            loaded = TransitMatrix.load(path)
+        self.assertEqual(loaded.station_codes, ['A', 'B', 'C'])
+        self.assertEqual(int(loaded.data[0, 1]), 20)
+        self.assertEqual(int(loaded.data[1, 2]), NO_ROUTE)
+
+        remapped = loaded.remap(['C', 'A', 'D'])
+        self.assertEqual(int(remapped.data[1, 0]), 35)
+        self.assertEqual(int(remapped.data[2, 1]), UNKNOWN)
+
+    def test_estimator_adds_walking_time(self):
+        estimator = MatrixTransitEstimator(self.matrix, StationIndex(self.stations))
+        # 역 위에서 출발하면 행렬 값 그대로
+        self.assertEqual(estimator.transit_time(126.90, 37.50, 127.00, 37.50), 20)
+        # 역에서 약 550m 떨어진 곳에서 출발하면 도보 시간이 더해진다
+        self.assertEqual(estimator.transit_time(126.90, 37.505, 127.00, 37.50), 30)
+        # 경로 없음 / 주변에 역 없음
+        self.assertIsNone(estimator.transit_time(127.00, 37.50, 127.10, 37.50))
+        self.assertIsNone(estimator.transit_time(126.50, 37.20, 127.00, 37.50))
+
+
+class SubwayGraphTestCase(SimpleTestCase):
+    def setUp(self):
+        self.stations = [
+            {'station_code': 'A', 'station_name': 'A역', 'x': 126.90, 'y': 37.50},
+            {'station_code': 'B', 'station_name': 'B역', 'x': 126.95, 'y': 37.50},
+            {'station_code': 'C', 'station_name': 'C역', 'x': 127.00, 'y': 37.50},
+            {'station_code': 'D', 'station_name': 'D역', 'x': 126.95, 'y': 37.55},
+            {'station_code': 'E', 'station_name': 'E역', 'x': 127.20, 'y': 37.70},
+        ]
+        # 1호선 A-B-C, 2호선 B-D, 환승/승차 4분. E역은 노선 파일에 없다
+        self.graph = SubwayGraph.from_network({
+            'transfer_minutes': 4,
+            'lines': [
+                {'name': '1호선', 'stations': ['A역', 'B역', 'C역'], 'minutes': 10},
+                {'name': '2호선', 'stations': ['B역', 'D역'], 'minutes': [8]},
+            ],
+        }, StationIndex(self.stations))
+        self.user = {'lon': 126.90, 'lat': 37.50}
+        patchers = [
+            mock.patch.object(utils, 'get_subway_graph', lambda: self.graph),
+            mock.patch.object(utils, 'transit_cache', TransitTimeCache(shared=None)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_one_to_many_with_transfers(self):
+        # 승차 2 + 운행 + 하차 2, D역은 B역에서 갈아타서 환승 4분이 더해진다
+        self.assertEqual(self.graph.minutes_from(126.90, 37.50, self.stations), [1, 14, 24, 26, None])
+        # 역에서 약 550m 떨어진 곳에서 출발하면 도보 시간이 더해진다
+        self.assertEqual(self.graph.transit_time(126.90, 37.505, 127.00, 37.50), 34)
+        self.assertEqual(len(self.graph), 4)
+
+    def test_primary_provider_skips_odsay(self):
+        with mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'graph'), \
+                mock.patch.object(utils, 'CANDIDATE_PRUNE_K', 0), \
+                mock.patch.object(utils, 'station_factor_scores', lambda stations, factors: [1.0] * len(stations)), \
+                mock.patch.object(utils, 'get_odsay_transit_time', side_effect=AssertionError):
+            best = utils.find_best_station(self.stations[1:4], [self.user], [])
+        self.assertEqual([station['station_name'] for station in best], ['B역', 'C역', 'D역'])
+
+    @responses.activate
+    def test_fallback_when_odsay_fails(self):
+        responses.add(responses.GET, utils.ODSAY_TRANSIT_URL, json={"error": {"code": "-99", "msg": "검색결과가 없습니다."}})
+        with mock.patch.object(utils, 'get_key_scheduler', lambda: ODsayKeyScheduler(['key-1'], rate=0)), \
+                mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'), \
+                mock.patch.object(utils, 'TRANSIT_FALLBACK_PROVIDER', 'graph'), \
+                metrics.request_metrics() as request_metrics:
+            self.assertEqual(utils.get_transit_time(126.90, 37.50, 127.00, 37.50), 24)
+            # 최근 실패한 구간도 120분 대신 그래프 값
+            self.assertEqual(utils.get_transit_time(126.90, 37.50, 127.00, 37.50), 24)
+            # 그래프로도 닿지 않으면 120분
+            self.assertEqual(utils.get_transit_time(126.90, 37.50, 127.20, 37.70), utils.TRANSIT_FALLBACK_MINUTES)
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(request_metrics.count('provider_fallbacks', provider='graph'), 2)
+        self.assertEqual(request_metrics.count('transit_fallbacks'), 1)
+
+    def test_graph_prefilter(self):
+        # 직선거리로는 D역이 가깝지만 노선으로는 C역이 빠르다
+        candidates = [self.stations[2], self.stations[3]]
+        with mock.patch.object(utils, 'CANDIDATE_ESTIMATOR', 'distance'):
+            pruned, _ = utils.prune_candidates(candidates, [1.0, 1.0], [self.user], k=1)
+        self.assertEqual(pruned[0]['station_name'], 'D역')
+        with mock.patch.object(utils, 'CANDIDATE_ESTIMATOR', 'graph'):
+            pruned, _ = utils.prune_candidates(candidates, [1.0, 1.0], [self.user], k=1)
+        self.assertEqual(pruned[0]['station_name'], 'C역')
+
+
+class DeadlineTestCase(SimpleTestCase):
+    def setUp(self):
+        self.stations = [
+            {'station_code': 'A', 'station_name': 'A역', 'x': 126.98, 'y': 37.55},
+            {'station_code': 'B', 'station_name': 'B역', 'x': 127.00, 'y': 37.55},
+            {'station_code': 'C', 'station_name': 'C역', 'x': 127.02, 'y': 37.55},
+        ]
+        self.users = [{'lon': 126.95, 'lat': 37.50}, {'lon': 127.05, 'lat': 37.60}]
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        patchers = [
+            mock.patch.object(utils, 'CANDIDATE_PRUNE_K', 0),
+            mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'),
+            mock.patch.object(utils, 'get_subway_graph', lambda: None),
+            mock.patch.object(utils, 'station_factor_scores', lambda stations, factors: [1.0] * len(stations)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def is_slow(self, start_x, end_x):
+        # B역까지 첫 번째 사용자의 소요시간만 마감 안에 오지 않는다
+        return start_x == self.users[0]['lon'] and end_x == self.stations[1]['x']
+
+    def assert_partial_result(self, best):
+        estimated = {station['station_name']: station['estimated_locations'] for station in best}
+        self.assertEqual(estimated, {'A역': [], 'B역': [0], 'C역': []})
+        self.assertFalse(views.is_cacheable([{'estimated_locations': [0], 'chatgpt_response_pc': {},
+                                              'chatgpt_response_mobile': {}}]))
+
+    def test_ranks_with_estimates_after_deadline(self):
+        def fake_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+            if self.is_slow(start_x, end_x):
+                self.release.wait(5)
+            return 20
+
+        with mock.patch.object(utils, 'get_transit_time', fake_transit_time), \
+                metrics.request_metrics() as request_metrics:
+            started_at = time.monotonic()
+            best = utils.find_best_station(self.stations, self.users, [], Deadline(0.2))
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assert_partial_result(best)
+        self.assertEqual(request_metrics.count('estimated_pairs'), 1)
+
+    def test_async_ranks_with_estimates_after_deadline(self):
+        async def fake_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+            if self.is_slow(start_x, end_x):
+                await asyncio.sleep(5)
+            return 20
+
+        with mock.patch.object(async_pipeline, 'get_transit_time_async', fake_transit_time):
+            started_at = time.monotonic()
+            best = asyncio.run(async_pipeline.find_best_station_async(self.stations, self.users, [], Deadline(0.2)))
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assert_partial_result(best)
+
+
+class IsochroneGridTestCase(SimpleTestCase):
+    def setUp(self):
+        self.stations = [
+            {'station_code': 'A', 'station_name': 'A역', 'x': 126.90, 'y': 37.50},
+            {'station_code': 'B', 'station_name': 'B역', 'x': 127.00, 'y': 37.50},
+            {'station_code': 'C', 'station_name': 'C역', 'x': 127.10, 'y': 37.50},
+        ]
+        matrix = TransitMatrix.empty(['A', 'B', 'C'])
+        matrix.set_minutes(0, 1, 20)
+        matrix.set_minutes(0, 2, 35)
+        matrix.set_minutes(1, 2, None)
+        self.index = StationIndex(self.stations)
+        self.grid = IsochroneGrid.empty(['A', 'B', 'C'], (126.89, 37.49, 127.11, 37.51), 250)
+        fill_grid(self.grid, self.index, station_minutes_from_matrix(matrix, ['A', 'B', 'C']), 3, 1500)
+
+    def test_mmap_round_trip_and_gather(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'grid.npy')
+            self.grid.save(path)
+            loaded = IsochroneGrid.load(path)
+            self.assertIsInstance(loaded.data, np.memmap)
+            self.assertEqual(loaded.data.dtype, np.uint8)
+            estimator = IsochroneEstimator(loaded, StationIndex(self.stations))
+
+            users = [{'lon': 126.9001, 'lat': 37.5001}, {'lon': 126.90, 'lat': 37.505}, {'lon': 126.50, 'lat': 37.20}]
+            block = estimator.minutes_matrix(users, self.stations)
+            self.assertEqual(block.shape, (3, 3))
+            # 역 근처 칸: 칸 중심에서 걷는 시간(250m 칸이라 4분 이내) + 행렬 값
+            self.assertTrue(20 <= block[0, 1] <= 24 and 35 <= block[0, 2] <= 39)
+            # 약 550m 떨어진 칸은 도보 시간이 더 붙는다
+            self.assertGreater(block[1, 1], block[0, 1])
+            # 격자 밖
+            self.assertTrue(np.isinf(block[2]).all())
+            self.assertEqual(estimator.transit_time(126.9001, 37.5001, 127.00, 37.50), int(block[0, 1]))
+            # B역 근처에서 C역은 경로 없음, 후보역 좌표가 표의 역이 아니면 None
+            self.assertIsNone(estimator.transit_time(127.0001, 37.5001, 127.10, 37.50))
+            self.assertIsNone(estimator.transit_time(126.9001, 37.5001, 127.05, 37.50))
+
+            with mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'grid'), \
+                    mock.patch.object(utils, 'get_isochrone_estimator', lambda: estimator):
+                known = utils.precomputed_transit_times(self.stations, users[:2])
+            self.assertEqual(known[(1, 0)], int(block[0, 1]))
+            self.assertEqual(len(known), int(np.isfinite(block[:2]).sum()))
+            del estimator, loaded
+
+
+class TransitTimeCacheTestCase(SimpleTestCase):
+    def test_lru_eviction_and_ttl(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.set('d', 4, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('d'))
+
+    def test_quantized_two_tier_lookup(self):
+        shared = LocMemCache('transit-test', {})
+        cache = TransitTimeCache(shared=shared, grid=0.001)
+        cache.set(127.00001, 37.50001, 127.1, 37.6, 25)
+        # 같은 격자 칸이면 같은 결과
+        self.assertEqual(cache.get(127.0002, 37.5003, 127.1, 37.6), 25)
+        self.assertIsNone(cache.get(127.002, 37.5, 127.1, 37.6))
+
+        # 프로세스가 새로 떠도 공유 캐시에서 읽는다
+        restarted = TransitTimeCache(shared=shared, grid=0.001)
+        self.assertEqual(restarted.get(127.0, 37.5, 127.1, 37.6), 25)
+        self.assertEqual(restarted.stats()['shared_hits'], 1)
+
+    def test_failures_are_not_cached_as_results(self):
+        cache = TransitTimeCache(shared=None, failure_ttl=60)
+        cache.set_failure(127.0, 37.5, 127.1, 37.6)
+        self.assertIsNone(cache.get(127.0, 37.5, 127.1, 37.6))
+        self.assertTrue(cache.is_recent_failure(127.0, 37.5, 127.1, 37.6))
+        cache.set(127.0, 37.5, 127.1, 37.6, 30)
+        self.assertFalse(cache.is_recent_failure(127.0, 37.5, 127.1, 37.6))
+
 
+class MetricsTestCase(SimpleTestCase):
+    def test_counters_follow_span_into_worker_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with metrics.request_metrics() as request_metrics:
+            with metrics.span('transit'), ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [metrics.submit(executor, metrics.count, 'upstream_calls', provider='odsay')
+                           for _ in range(3)]
+                for future in futures:
+                    future.result()
+            metrics.count('cache_hits', cache='explanation')
+        self.assertEqual(request_metrics.count('upstream_calls', stage='transit'), 3)
+
+        server_timing = request_metrics.server_timing()
+        self.assertRegex(server_timing, r'^transit;dur=[0-9.]+;desc="upstream_calls.odsay=3", ')
+        # 단계 밖에서 센 값은 total에
+        self.assertRegex(server_timing, r'total;dur=[0-9.]+;desc="cache_hits.explanation=1"$')
+
+    def test_prometheus_text_format(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('stage',), buckets=(0.1, 1))
+        histogram.observe(0.05, stage='a')
+        histogram.observe(0.5, stage='a')
+        counter = metrics.Counter('test_total', 'Test.', ('provider',))
+        counter.inc(provider='o"dsay')
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{stage="a",le="0.1"} 1',
+            'test_seconds_bucket{stage="a",le="1.0"} 2',
+            'test_seconds_bucket{stage="a",le="+Inf"} 2',
+            'test_seconds_sum{stage="a"} 0.55',
+            'test_seconds_count{stage="a"} 2',
+        ])
+        self.assertEqual(counter.render()[2:], ['test_total{provider="o\\"dsay"} 1'])
+
+    def test_metrics_endpoint_is_closed_by_default(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+        with mock.patch.object(metrics, 'METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code,
+                             404)
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'}).status_code,
+                             200)
+        with mock.patch.object(metrics, 'METRICS_ALLOWED_IPS', frozenset({'10.0.0.5'})):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def test_concurrent_calls_share_one_execution(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        flight = SingleFlight('test')
+        release = threading.Event()
+        calls = []
+
+        def slow(value):
+            calls.append(value)
+            release.wait(5)
+            if value == 'boom':
+                raise ValueError(value)
+            return value * 2
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(flight.do, 'k', slow, 21) for _ in range(4)]
+            # 나머지 호출이 leader를 기다리기 시작할 때까지
+            time.sleep(0.05)
+            release.set()
+            self.assertEqual([future.result() for future in futures], [42] * 4)
+        self.assertEqual(calls, [21])
+        self.assertEqual(len(flight), 0)
+
+        # 예외도 같이 받는다. 끝난 키는 다시 실행한다
+        release.clear()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(flight.do, 'k', slow, 'boom') for _ in range(2)]
+            time.sleep(0.05)
+            release.set()
+            for future in futures:
+                self.assertRaises(ValueError, future.result)
+        self.assertEqual(calls, [21, 'boom'])
+
+    def test_follower_stops_waiting_at_its_own_deadline(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        flight = SingleFlight('test')
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow():
+            release.wait(5)
+            return 1
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # 마감 없는 leader (배치/세션 경로)
+            leader = executor.submit(flight.do, 'k', slow)
+            time.sleep(0.02)
+            started_at = time.monotonic()
+            with self.assertRaises(DeadlineExceeded):
+                flight.do('k', slow, timeout=0.05)
+            self.assertLess(time.monotonic() - started_at, 1)
+            release.set()
+            self.assertEqual(leader.result(), 1)
+
+    async def test_async_follower_stops_waiting_at_its_own_deadline(self):
+        flight = AsyncSingleFlight('test')
+
+        async def slow():
+            await asyncio.sleep(0.2)
+            return 1
+
+        leader = asyncio.ensure_future(flight.do('k', slow))
+        await asyncio.sleep(0)
+        with self.assertRaises(DeadlineExceeded):
+            await flight.do('k', slow, timeout=0.01)
+        # 기다리는 leader가 남아 있으므로 작업은 계속된다
+        self.assertEqual(await leader, 1)
+
+    async def test_async_follower_survives_leader_cancellation(self):
+
+        flight = AsyncSingleFlight('test')
+        calls = []
+
+        async def slow(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            return value * 2
+
+        leader = asyncio.ensure_future(flight.do('k', slow, 21))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('k', slow, 21))
+        await asyncio.sleep(0)
+        leader.cancel()
+        self.assertEqual(await follower, 42)
+        self.assertEqual(calls, [21])
+        self.assertEqual(len(flight), 0)
+
+    async def test_duplicate_transit_pairs_call_odsay_once(self):
+
+        calls = []
+
+        async def fake_fetch(*args, **kwargs):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return 17
+
+        with mock.patch.object(async_pipeline, 'transit_cache', TransitTimeCache(shared=None)), \
+                mock.patch.object(async_pipeline, 'fetch_odsay_transit_time_async', fake_fetch), \
+                mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'):
+            # 같은 격자 안의 두 출발지 (같은 기준점으로 옮겨진 사용자)
+            results = await asyncio.gather(
+                async_pipeline.get_transit_time_async(126.9784, 37.5666, 127.0276, 37.4979),
+                async_pipeline.get_transit_time_async(126.97841, 37.56661, 127.0276, 37.4979))
+        self.assertEqual(results, [17, 17])
+        self.assertEqual(len(calls), 1)
+
+    async def test_shared_cache_tier_is_read_and_written_off_the_loop(self):
+        shared = LocMemCache('transit-async-test', {})
+        loop_thread = threading.get_ident()
+        threads = []
+
+        class RecordingCache(TransitTimeCache):
+            def get_shared(self, *args):
+                threads.append(threading.get_ident())
+                return super().get_shared(*args)
+
+        async def fake_fetch(*args, **kwargs):
+            return 23
+
+        with mock.patch.object(async_pipeline, 'transit_cache', RecordingCache(shared=shared)), \
+                mock.patch.object(async_pipeline, 'fetch_odsay_transit_time_async', fake_fetch), \
+                mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'):
+            self.assertEqual(await async_pipeline.get_transit_time_async(126.9784, 37.5666, 127.0276, 37.4979), 23)
+        self.assertNotIn(loop_thread, threads)
+
+        # 다른 워커(새 in-process 캐시)도 공유 캐시에서 읽는다
+        with mock.patch.object(async_pipeline, 'transit_cache', RecordingCache(shared=shared)), \
+                mock.patch.object(async_pipeline, 'fetch_odsay_transit_time_async', None), \
+                mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'):
+            self.assertEqual(await async_pipeline.get_transit_time_async(126.9784, 37.5666, 127.0276, 37.4979), 23)
+
+
+class AsyncFindOptimalStationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        load_stations_from_json(STATION_JSON_FILE)
+
+    def setUp(self):
+        patcher = mock.patch.object(views, 'result_cache', ResultCache(shared=None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        reset_station_table()
+
+    async def fake_region(self, lon, lat):
+        return ('서울특별시', '중구')
+
+    async def fake_transit_time(self, start_x, start_y, end_x, end_y, deadline=None):
+        # 출발지에서 직선거리에 비례하는 가짜 소요시간
+        return int(((start_x - end_x) ** 2 + (start_y - end_y) ** 2) ** 0.5 * 300) + 5
+
+    def fake_explain_many(self, station_names, factors):
+        return {(station_name, view_type): {'response': f'{station_name}:{view_type}'}
+                for station_name in station_names for view_type in ('pc', 'mobile')}
+
+    def test_find_optimal_station_async(self):
+        with mock.patch.object(async_pipeline, 'get_region_async', self.fake_region), \
+                mock.patch.object(async_pipeline, 'get_transit_time_async', self.fake_transit_time), \
+                mock.patch.object(explanation_service, 'explain_many', self.fake_explain_many):
+            response = self.client.post(
+                reverse('find_optimal_station_async'),
+                data={'locations': [{'lon': 126.9784, 'lat': 37.5666}, {'lon': 127.0276, 'lat': 37.4979}],
+                      'factors': [3, 4]},
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+        best_stations = response.json()['best_stations']
+        self.assertEqual(len(best_stations), 3)
+        self.assertEqual(best_stations[0]['chatgpt_response_pc'],
+                         {'response': f"{best_stations[0]['station_name']}:pc"})
+        self.assertEqual(best_stations[0]['chatgpt_response_mobile'],
+                         {'response': f"{best_stations[0]['station_name']}:mobile"})
+        self.assertEqual(best_stations[0]['factors'], [3, 4])
+
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['region', 'midpoint', 'candidates', 'scoring', 'transit', 'explanation', 'total'])
+
+        with mock.patch.object(metrics, 'METRICS_TOKEN', 'secret'):
+            response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), dummy_data)
\ No newline at end of file
+        self.assertIn('wsm_stage_duration_seconds_bucket{stage="transit",le="+Inf"}', response.content.decode())
+        self.assertIn('wsm_request_duration_seconds_count{view="find_optimal_station_async",status="200"}',
+                      response.content.decode())
+
+    async def test_stream_sends_stations_before_explanations(self):
+        with mock.patch.object(async_pipeline, 'get_region_async', self.fake_region), \
+                mock.patch.object(async_pipeline, 'get_transit_time_async', self.fake_transit_time), \
+                mock.patch.object(explanation_service, 'explain_many', self.fake_explain_many):
+            response = await self.async_client.post(
+                reverse('find_optimal_station_stream'),
+                data={'locations': [{'lon': 126.9784, 'lat': 37.5666}, {'lon': 127.0276, 'lat': 37.4979}],
+                      'factors': [3]},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith('text/event-stream'))
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        events = [
+            (lines[0][len('event: '):], json.loads(lines[1][len('data: '):]))
+            for lines in (block.split('\n') for block in body.strip().split('\n\n'))
+        ]
+        self.assertEqual(events[0][0], 'stations')
+        names = [station['station_name'] for station in events[0][1]['best_stations']]
+        self.assertEqual(len(names), 3)
+        explanations = [data for event, data in events if event == 'explanation']
+        self.assertEqual(len(explanations), 6)
+        self.assertEqual({data['station_name'] for data in explanations}, set(names))
+        self.assertEqual(events[-1], ('done', {}))
+
+    def test_only_pruned_candidates_are_timed(self):
+        calls = []
+
+        async def counting_transit_time(*args, **kwargs):
+            calls.append(args)
+            return await self.fake_transit_time(*args, **kwargs)
+
+        with mock.patch.object(async_pipeline, 'get_region_async', self.fake_region), \
+                mock.patch.object(async_pipeline, 'get_transit_time_async', counting_transit_time), \
+                mock.patch.object(explanation_service, 'explain_many', self.fake_explain_many), \
+                mock.patch.object(utils, 'CANDIDATE_PRUNE_K', 4):
+            response = self.client.post(
+                reverse('find_optimal_station_async'),
+                data={'locations': [{'lon': 126.9784, 'lat': 37.5666}, {'lon': 127.0276, 'lat': 37.4979}]},
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+        # 후보 4개 x 2명을 넘지 않는다 (걸러진 역은 더 적다)
+        self.assertLessEqual(len(calls), 4 * 2)
+        self.assertLessEqual(len({(end_x, end_y) for _, _, end_x, end_y in calls}), 4)
+
+    def test_batch_fetches_each_unique_pair_once(self):
+        regions, calls, explained = [], [], []
+
+        async def counting_region(lon, lat):
+            regions.append((lon, lat))
+            return await self.fake_region(lon, lat)
+
+        async def counting_transit_time(*args, **kwargs):
+            calls.append(args)
+            return await self.fake_transit_time(*args, **kwargs)
+
+        def counting_explain_many(station_names, factors):
+            explained.append(factors)
+            return self.fake_explain_many(station_names, factors)
+
+        city_hall, gangnam, hongdae = ({'lon': 126.9784, 'lat': 37.5666}, {'lon': 127.0276, 'lat': 37.4979},
+                                       {'lon': 126.9237, 'lat': 37.5563})
+        groups = [
+            {'locations': [city_hall, gangnam], 'factors': [3]},
+            {'locations': [city_hall, gangnam], 'factors': [3]},
+            {'locations': [gangnam, city_hall, hongdae], 'factors': [4]},
+            {'locations': [city_hall]},
+        ]
+        with mock.patch.object(async_pipeline, 'get_region_async', counting_region), \
+                mock.patch.object(async_pipeline, 'get_transit_time_async', counting_transit_time), \
+                mock.patch.object(explanation_service, 'explain_many', counting_explain_many):
+            response = self.client.post(reverse('find_optimal_stations_batch'), data={'groups': groups},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results, stats = response.json()['results'], response.json()['stats']
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[2]['best_stations']), 3)
+        self.assertEqual(results[2]['best_stations'][0]['factors'], [4])
+        self.assertEqual(results[3], {'error': '2 to 5 locations must be provided.', 'status': 400})
+
+        self.assertEqual(len(regions), 3)
+        self.assertEqual(stats['unique_origins'], 3)
+        self.assertEqual(stats['unique_midpoints'], 2)
+        # 겹치는 구간은 한 번만 조회한다
+        self.assertEqual(len(calls), stats['unique_transit_pairs'])
+        self.assertEqual(len(set(calls)), len(calls))
+        self.assertLess(len(calls), (2 + 2 + 3) * utils.CANDIDATE_PRUNE_K)
+        # 팩터 조합마다 한 번
+        self.assertEqual(sorted(explained), [('3',), ('4',)])
+
+    def test_repeated_get_is_served_from_result_cache(self):
+        calls = []
+
+        async def counting_transit_time(*args, **kwargs):
+            calls.append(args)
+            return await self.fake_transit_time(*args, **kwargs)
+
+        url = reverse('find_optimal_station_async')
+        query = {'locations': ['126.9784,37.5666', '127.0276,37.4979'], 'factors': ['3', '4']}
+        with mock.patch.object(async_pipeline, 'get_region_async', self.fake_region), \
+                mock.patch.object(async_pipeline, 'get_transit_time_async', counting_transit_time), \
+                mock.patch.object(explanation_service, 'explain_many', self.fake_explain_many):
+            first = self.client.get(url, query)
+            self.assertEqual(first.status_code, 200)
+            self.assertIn('public', first['Cache-Control'])
+            self.assertIn('max-age=', first['Cache-Control'])
+            fetched = len(calls)
+
+            # 출발지/팩터 순서가 다르고 좌표가 조금 달라도 같은 결과
+            second = self.client.get(url, {'locations': ['127.02761,37.49789', '126.9784,37.5666'],
+                                           'factors': ['4', '3']})
+            self.assertEqual(second.json(), first.json())
+            self.assertEqual(second['ETag'], first['ETag'])
+            self.assertEqual(len(calls), fetched)
+
+            not_modified = self.client.get(url, query, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+
+            # 역 데이터가 바뀌면 다시 계산한다
+            station = Station.objects.get(station_name=first.json()['best_stations'][0]['station_name'])
+            station.factor_3 += 1
+            station.save()
+            self.assertEqual(self.client.get(url, query).status_code, 200)
+            self.assertGreater(len(calls), fetched)
+
+    def test_rejects_single_location(self):
+        response = self.client.post(
+            reverse('find_optimal_station_async'),
+            data={'locations': [{'lon': 126.9784, 'lat': 37.5666}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class MeetupSessionTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        load_stations_from_json(STATION_JSON_FILE)
+
+    def setUp(self):
+        reset_station_table()
+        self.calls = []
+        patchers = [
+            mock.patch.object(views, 'session_store', SessionStore(shared=None)),
+            mock.patch.object(views, 'calculate_midpoint', utils.midpoint_of),
+            mock.patch.object(utils, 'get_transit_time', self.fake_transit_time),
+            mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'),
+            mock.patch.object(explanation_service, 'explain_many', self.fake_explain_many),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_transit_time(self, start_x, start_y, end_x, end_y, deadline=None):
+        self.calls.append((start_x, start_y, end_x, end_y))
+        return int(((start_x - end_x) ** 2 + (start_y - end_y) ** 2) ** 0.5 * 300) + 5
+
+    def fake_explain_many(self, station_names, factors):
+        return {(station_name, view_type): {'response': station_name}
+                for station_name in station_names for view_type in ('pc', 'mobile')}
+
+    def post(self, data):
+        return self.client.post(reverse('meetup_session'), data=data, content_type='application/json')
+
+    def test_edits_reuse_session_transit_times(self):
+        response = self.post({'locations': [{'lon': 126.9784, 'lat': 37.5666}, {'lon': 127.0276, 'lat': 37.4979}],
+                              'factors': [3]})
+        self.assertEqual(response.status_code, 200)
+        session_id = response.json()['session_id']
+        self.assertEqual(len(response.json()['best_stations']), 3)
+        # 후보역마다 출발지 두 곳을 한 번씩
+        stations = {(x, y) for _, _, x, y in self.calls}
+        self.assertEqual(len(self.calls), 2 * len(stations))
+
+        # 팩터만 바꾸면 외부 호출 없이 순위만 다시 매긴다
+        self.calls.clear()
+        response = self.post({'session_id': session_id, 'factors': [5, 6]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(response.json()['factors'], [5, 6])
+        self.assertEqual(response.json()['best_stations'][0]['factors'], [5, 6])
+
+        # 출발지를 더하면 새 출발지 칸과 새로 후보에 든 역만 조회한다
+        response = self.post({'session_id': session_id, 'add_locations': [{'lon': 127.0, 'lat': 37.55}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['locations']), 3)
+        self.assertTrue(self.calls)
+        for start_x, start_y, end_x, end_y in self.calls:
+            self.assertTrue((start_x, start_y) == (127.0, 37.55) or (end_x, end_y) not in stations)
+
+        self.calls.clear()
+        response = self.post({'session_id': session_id, 'remove_locations': [2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['locations']), 2)
+        self.assertFalse(any((start_x, start_y) == (127.0, 37.55) for start_x, start_y, _, _ in self.calls))
+
+    def test_invalid_session_requests(self):
+        self.assertEqual(self.post({'session_id': 'missing', 'factors': [3]}).status_code, 404)
+
+        response = self.post({'locations': [{'lon': 126.9784, 'lat': 37.5666}, {'lon': 127.0276, 'lat': 37.4979}]})
+        session_id = response.json()['session_id']
+        self.assertEqual(self.post({'session_id': session_id, 'remove_locations': [5]}).status_code, 400)
+        # 출발지가 2개보다 적어지는 변경은 거절하고 세션에도 남기지 않는다
+        self.assertEqual(self.post({'session_id': session_id, 'remove_locations': [0]}).status_code, 400)
+        response = self.post({'session_id': session_id, 'factors': [2]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['locations']), 2)
+
+
+class CandidatePruningTestCase(SimpleTestCase):
+    def test_haversine_matrix(self):
+        # 서울시청 -> 강남역 약 8.9km
+        distances = utils.haversine_matrix([126.9784], [37.5666], [126.9784, 127.0276], [37.5666, 37.4979])
+        self.assertEqual(distances.shape, (1, 2))
+        self.assertAlmostEqual(distances[0, 0], 0)
+        self.assertAlmostEqual(distances[0, 1] / 1000, 8.9, delta=0.2)
+
+    def test_prune_keeps_top_k_by_estimated_score(self):
+        users = [{'lon': 127.0, 'lat': 37.5}, {'lon': 127.01, 'lat': 37.5}]
+        stations = [{'station_name': f'{i}역', 'x': 127.01 + i * 0.01, 'y': 37.5} for i in range(6)]
+        factor_scores = [1.0, 1.0, None, 1.0, 10.0, 1.0]
+        pruned, scores = utils.prune_candidates(stations, factor_scores, users, k=3)
+        # 팩터 점수가 높은 먼 역, 가까운 역 순. DB에 없는 역은 빠진다
+        self.assertEqual([s['station_name'] for s in pruned], ['4역', '0역', '1역'])
+        self.assertEqual(scores, [10.0, 1.0, 1.0])
+
+    def test_prune_disabled(self):
+        stations = [{'station_name': 'A역', 'x': 127.0, 'y': 37.5}]
+        self.assertEqual(utils.prune_candidates(stations, [None], [], k=0), (stations, [None]))
+
+
+class FactorRankingsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        load_stations_from_json(STATION_JSON_FILE)
+
+    def setUp(self):
+        reset_station_table()
+        self.addCleanup(reset_station_table)
+
+    def test_subset_rankings_match_factor_scores(self):
+        table = get_station_table()
+        weights = np.array([1, 2, 1, 0.5, 1, 3])
+        rankings = FactorRankings(table, weights)
+        self.assertEqual(rankings.scores.shape, (N_SUBSETS, len(table)))
+        for factors in ([], [2], [3, 7], [4, 5, 6], [2, 3, 4, 5, 6, 7]):
+            mask = subset_mask(factors)
+            np.testing.assert_allclose(rankings.scores[mask],
+                                       table.factor_scores(np.arange(len(table)), factors, weights=weights))
+            ordered = rankings.scores[mask, rankings.order[mask]]
+            self.assertTrue(np.all(np.diff(ordered) <= 0))
+        self.assertEqual(subset_mask([7, 2, 7]), subset_mask([2, 7]))
+        with self.assertRaises(ValueError):
+            subset_mask([8])
+
+    def test_threshold_strategy_matches_full_ranking_with_fewer_calls(self):
+        users = [{'lon': 126.9784, 'lat': 37.5666}, {'lon': 127.0276, 'lat': 37.4979}, {'lon': 127.1, 'lat': 37.51}]
+        stations = get_station_index().nearest(127.02, 37.53, k=40)
+        factors = [2, 3, 4, 5, 6, 7]
+        calls = []
+
+        def fake_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+            calls.append((start_x, start_y, end_x, end_y))
+            return int(((start_x - end_x) ** 2 + (start_y - end_y) ** 2) ** 0.5 * 300) + 5
+
+        def slow_transit_time(*args, **kwargs):
+            # 결과를 받아 걸러내기 전에 워커가 큐를 다 비우지 않도록
+            time.sleep(0.002)
+            return fake_transit_time(*args, **kwargs)
+
+        full_top = self.full_ranking(stations, users, factors, fake_transit_time)
+        calls.clear()
+
+        with mock.patch.object(utils, 'CANDIDATE_STRATEGY', 'threshold'), \
+                mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'), \
+                mock.patch.object(utils, 'TRANSIT_FETCH_CONCURRENCY', 1), \
+                mock.patch.object(utils, 'get_transit_time', slow_transit_time):
+            best = utils.find_best_station(stations, users, factors)
+        self.assertEqual(self.names(best), self.names(full_top))
+        self.assertLess(len(calls), len(stations) * len(users) // 2)
+
+    def test_threshold_strategy_matches_full_ranking_on_random_groups(self):
+        rng = random.Random(3)
+        for _ in range(12):
+            users = [{'lon': 126.85 + rng.random() * 0.3, 'lat': 37.45 + rng.random() * 0.15}
+                     for _ in range(rng.randint(2, 4))]
+            stations = get_station_index().nearest(126.9 + rng.random() * 0.2, 37.5 + rng.random() * 0.08, k=30)
+            factors = rng.sample([2, 3, 4, 5, 6, 7], rng.randint(1, 6))
+            # 팩터 점수는 같은 역이 많으므로 소요시간이 같지 않게 해서 동점을 없앤다
+            noise = {station['station_name']: rng.random() * 30 for station in stations}
+
+            def fake_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+                name = next(station['station_name'] for station in stations
+                            if (station['x'], station['y']) == (end_x, end_y))
+                return ((start_x - end_x) ** 2 + (start_y - end_y) ** 2) ** 0.5 * 300 + 5 + noise[name]
+
+            def slow_transit_time(*args, **kwargs):
+                time.sleep(0.001)
+                return fake_transit_time(*args, **kwargs)
+
+            full_top = self.full_ranking(stations, users, factors, fake_transit_time)
+            with mock.patch.object(utils, 'CANDIDATE_STRATEGY', 'threshold'), \
+                    mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'), \
+                    mock.patch.object(utils, 'TRANSIT_FETCH_CONCURRENCY', 1), \
+                    mock.patch.object(utils, 'get_transit_time', slow_transit_time):
+                best = utils.find_best_station(stations, users, factors)
+            # 순서까지 같아야 한다
+            self.assertEqual(self.names(best), self.names(full_top))
+
+    def full_ranking(self, stations, users, factors, transit_time):
+        scores = utils.station_factor_scores(stations, factors)
+        return utils.rank_stations([
+            (station, score, sum(transit_time(user['lon'], user['lat'], station['x'], station['y'])
+                                 for user in users))
+            for station, score in zip(stations, scores) if score is not None])
+
+    def names(self, stations):
+        return [station['station_name'] for station in stations]
+
+
+class StreamingRankerTestCase(SimpleTestCase):
+    def test_prunes_dominated_station(self):
+        stations = [{'station_name': f'{i}역'} for i in range(4)]
+        ranker = StreamingRanker(stations, [3.0, 3.0, 3.0, 1.0], n_users=2)
+        for i, times in enumerate([(10, 10), (10, 12), (10, 14)]):
+            for minutes in times:
+                self.assertEqual(ranker.add(i, minutes), [])
+        self.assertFalse(ranker.done())
+        # 더 느리고 팩터 점수도 낮으니 두 번째 결과를 기다릴 필요가 없다
+        self.assertEqual(ranker.add(3, 30), [3])
+        self.assertTrue(ranker.done())
+        self.assertEqual(utils.rank_stations(ranker.station_scores()), stations[:3])
+
+    async def test_async_pipeline_cancels_calls_of_pruned_stations(self):
+        stations = [{'station_name': f'{i}역', 'x': 127.0 + i * 0.01, 'y': 37.5} for i in range(4)]
+        times = {0: (10, 10), 1: (10, 12), 2: (10, 14)}
+        cancelled = []
+
+        async def fake_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+            i = round((end_x - 127.0) / 0.01)
+            u = int(start_x)
+            if i == 3:
+                # 팩터 점수가 2 넘게 낮아 앞의 세 역이 다 모이면 걸러지는 역
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled.append((i, u))
+                    raise
+            await asyncio.sleep(0.01)
+            return times[i][u]
+
+        with mock.patch.object(utils, 'select_candidates', lambda *args: (stations, [3.0, 2.9, 2.8, 0.5])), \
+                mock.patch.object(utils, 'transit_lower_bounds', lambda *args: None), \
+                mock.patch.object(utils, 'TRANSIT_TIME_PROVIDER', 'odsay'), \
+                mock.patch.object(utils, 'TRANSIT_FETCH_CONCURRENCY', 0), \
+                mock.patch.object(async_pipeline, 'get_transit_time_async', fake_transit_time):
+            started_at = time.monotonic()
+            best = await async_pipeline.find_best_station_async(
+                stations, [{'lon': 0.0, 'lat': 37.5}, {'lon': 1.0, 'lat': 37.5}], [2])
+            await asyncio.sleep(0)
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertEqual([station['station_name'] for station in best], ['0역', '1역', '2역'])
+        self.assertEqual(sorted(cancelled), [(3, 0), (3, 1)])
+
+    def test_factor_threshold_prunes_unseen_stations(self):
+        # 팩터 점수 순으로 넣은 역들. 앞의 세 역이 다 모이면 팩터 점수가 2 넘게 낮은 역은 조회 전에 걸러진다
+        stations = [{'station_name': f'{i}역'} for i in range(6)]
+        ranker = StreamingRanker(stations, [9.0, 8.5, 8.0, 7.0, 5.9, 1.0], n_users=1)
+        self.assertEqual(ranker.add(0, 90), [])
+        self.assertEqual(ranker.add(1, 80), [])
+        self.assertEqual(ranker.add(2, 10), [4, 5])
+        self.assertFalse(ranker.is_settled(3))
+
+    def test_pruned_stations_never_reach_top_3(self):
+        rng = random.Random(1)
+        total_pruned = 0
+        for _ in range(200):
+            n_stations, n_users = rng.randint(4, 8), rng.randint(2, 4)
+            stations = [{'station_name': f'{i}역'} for i in range(n_stations)]
+            factor_scores = [1 + rng.random() * 6 for _ in stations]
+            times = [[rng.randint(5, 90) for _ in range(n_users)] for _ in stations]
+            full_top = utils.rank_stations(
+                [(station, score, sum(t)) for station, score, t in zip(stations, factor_scores, times)])
+
+            # 실제 소요시간보다 작은 임의의 하한
+            lower_bounds = [[minutes * rng.random() for minutes in row] for row in times]
+            ranker = StreamingRanker(stations, factor_scores, n_users, lower_bounds=lower_bounds)
+            events = [(i, u, minutes) for i, row in enumerate(times) for u, minutes in enumerate(row)]
+            rng.shuffle(events)
+            pruned = set()
+            for i, u, minutes in events:
+                pruned.update(ranker.add(i, minutes, u))
+            self.assertFalse(pruned & {stations.index(station) for station in full_top})
+            if not pruned:
+                self.assertEqual(utils.rank_stations(ranker.station_scores()), full_top)
+            total_pruned += len(pruned)
+        self.assertGreater(total_pruned, 0)
+
+    def test_pruned_fetch_matches_full_ranking(self):
+        # find_best_station처럼 걸러진 역의 칸은 조회하지 않고, 다 정해지면 reopen_if_unstable()로 다시 연 역만 마저 조회한다.
+        # 걸러낸 역이 있어도 순위(순서 포함)는 모든 소요시간으로 rank_stations를 한 것과 같아야 한다
+        rng = random.Random(2)
+        pruned_runs = reopened_runs = 0
+        for _ in range(3000):
+            n_stations, n_users = rng.randint(4, 10), rng.randint(1, 4)
+            stations = [{'station_name': f'{i}역'} for i in range(n_stations)]
+            factor_scores = [1 + rng.random() * rng.choice([1, 3, 6]) for _ in stations]
+            times = [[rng.randint(5, 90) for _ in range(n_users)] for _ in stations]
+            full_top = utils.rank_stations(
+                [(station, score, sum(t)) for station, score, t in zip(stations, factor_scores, times)])
+
+            lower_bounds = [[minutes * rng.random() for minutes in row] for row in times]
+            ranker = StreamingRanker(stations, factor_scores, n_users, lower_bounds=lower_bounds)
+            events = [(i, u) for i in range(n_stations) for u in range(n_users)]
+            rng.shuffle(events)
+            received = set()
+            pruned = skipped = False
+            while events:
+                for i, u in events:
+                    if ranker.is_pruned(i):
+                        skipped = True
+                        continue
+                    received.add((i, u))
+                    pruned |= bool(ranker.add(i, times[i][u], u))
+                self.assertTrue(ranker.done())
+                reopened = ranker.reopen_if_unstable()
+                reopened_runs += bool(reopened)
+                events = [(i, u) for i in reopened for u in range(n_users) if (i, u) not in received]
+            if pruned and skipped:
+                pruned_runs += 1
+                self.assertEqual(utils.rank_stations(ranker.station_scores()), full_top)
+        self.assertGreater(pruned_runs, 100)
+        self.assertGreater(reopened_runs, 0)
+
+    def test_threshold_order_matches_full_ranking(self):
+        # CANDIDATE_STRATEGY=threshold처럼 팩터 점수 순으로 역마다 조회할 때도 순위(순서 포함)가 같아야 한다
+        rng = random.Random(4)
+        pruned_runs = 0
+        for _ in range(3000):
+            n_stations, n_users = rng.randint(4, 20), rng.randint(1, 4)
+            stations = [{'station_name': f'{i}역'} for i in range(n_stations)]
+            factor_scores = [1 + rng.random() * rng.choice([1, 3, 6]) for _ in stations]
+            times = [[rng.randint(5, 90) for _ in range(n_users)] for _ in stations]
+            full_top = utils.rank_stations(
+                [(station, score, sum(t)) for station, score, t in zip(stations, factor_scores, times)])
+
+            ranker = StreamingRanker(stations, factor_scores, n_users,
+                                     lower_bounds=[[minutes * rng.random() for minutes in row] for row in times])
+            pending = sorted(range(n_stations), key=lambda i: -factor_scores[i])
+            received = set()
+            skipped = False
+            while pending:
+                for i in pending:
+                    for u in range(n_users):
+                        if ranker.is_pruned(i):
+                            skipped = True
+                            break
+                        if (i, u) not in received:
+                            received.add((i, u))
+                            ranker.add(i, times[i][u], u)
+                pending = ranker.reopen_if_unstable()
+            if skipped:
+                pruned_runs += 1
+                self.assertEqual(utils.rank_stations(ranker.station_scores()), full_top)
+        self.assertGreater(pruned_runs, 1000)
+
+
+class ODsayKeySchedulerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.day = 1
+        self.scheduler = ODsayKeyScheduler(
+            ['k1', 'k2'], rate=1, burst=2, daily_quota=3, quarantine_seconds=10,
+            clock=lambda: self.now, today=lambda: self.day)
+
+    def test_token_bucket_and_round_robin(self):
+        keys = [self.scheduler.try_acquire()[0] for _ in range(4)]
+        self.assertEqual(keys, ['k1', 'k2', 'k1', 'k2'])
+        key, wait = self.scheduler.try_acquire()
+        self.assertIsNone(key)
+        self.assertAlmostEqual(wait, 1.0)
+
+        self.now += 1
+        self.assertEqual(self.scheduler.try_acquire()[0], 'k1')
+
+    def test_daily_quota_resets_next_day(self):
+        for _ in range(6):
+            self.now += 10
+            self.assertIsNotNone(self.scheduler.try_acquire()[0])
+        self.now += 10
+        self.assertEqual(self.scheduler.try_acquire(), (None, None))
+
+        self.day += 1
+        self.assertIsNotNone(self.scheduler.try_acquire()[0])
+
+    def test_quarantine_and_quota_errors(self):
+        self.scheduler.report_error('k1')
+        self.assertEqual([self.scheduler.try_acquire()[0] for _ in range(2)], ['k2', 'k2'])
+
+        self.scheduler.report_error('k2', quota_exceeded=True)
+        key, wait = self.scheduler.try_acquire()
+        self.assertIsNone(key)
+        self.assertAlmostEqual(wait, 10.0)
+
+        self.now += 10
+        self.assertEqual(self.scheduler.try_acquire()[0], 'k1')
+
+
+class LoadStationsTestCase(TestCase):
+    def test_bulk_load_is_idempotent(self):
+        count = load_stations_from_json(STATION_JSON_FILE)
+        self.assertEqual(count, Station.objects.count())
+        self.assertEqual(StationDataSource.objects.count(), 1)
+
+        # 파일이 그대로면 쿼리 한 번으로 끝난다
+        with self.assertNumQueries(1):
+            self.assertIsNone(load_stations_from_json(STATION_JSON_FILE))
+
+    def test_reload_updates_existing_rows(self):
+        load_stations_from_json(STATION_JSON_FILE)
+        station = Station.objects.get(station_code='1005')
+        station.factor_2 = 99
+        station.save()
+
+        load_stations_from_json(STATION_JSON_FILE, force=True)
+        station.refresh_from_db()
+        self.assertNotEqual(station.factor_2, 99)
+
+
+class BuildIsochroneGridTestCase(TestCase):
+    def setUp(self):
+        load_stations_from_json(STATION_JSON_FILE)
+        reset_station_table()
+        self.addCleanup(reset_station_table)
+
+    def test_builds_grid_from_transit_matrix(self):
+        from django.core.management import call_command
+        from .management.commands import build_isochrone_grid
+
+        table = get_station_table()
+        with tempfile.TemporaryDirectory() as tmp:
+            matrix_path = os.path.join(tmp, 'matrix.npy')
+            grid_path = os.path.join(tmp, 'grid.npy')
+            TransitMatrix.empty(table.codes).save(matrix_path)
+            with mock.patch.object(build_isochrone_grid, 'TRANSIT_MATRIX_FILE', matrix_path):
+                call_command('build_isochrone_grid', output=grid_path, cell_size=1000, stdout=io.StringIO())
+            grid = IsochroneGrid.load(grid_path)
+            self.assertEqual(grid.station_codes, table.codes)
+
+            # 역이 있는 칸에서는 그 역까지 걸어가는 시간만
+            i = table.by_code['1005']
+            block = grid.minutes(grid.cells_of([table.lon[i]], [table.lat[i]]), [i])
+            self.assertLessEqual(block[0, 0], 20)
+            del grid
+
+
+class BuildTransitMatrixTestCase(TestCase):
+    def setUp(self):
+        load_stations_from_json(STATION_JSON_FILE)
+
+    def test_only_route_errors_are_saved_as_no_route(self):
+        from django.core.management import call_command
+        from .management.commands import build_transit_matrix
+
+        replies = iter([
+            (None, {'code': '500', 'message': '서버 오류'}),
+            (None, [{'code': '-99', 'message': '검색결과가 없습니다.'}]),
+            (12, None),
+        ])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'matrix.npy')
+            with mock.patch.object(build_transit_matrix, 'load_api_keys', lambda: ['key-1']), \
+                    mock.patch.object(utils, 'request_odsay_transit_time', lambda *args: next(replies)):
+                call_command('build_transit_matrix', output=path, max_calls=3, sleep=0,
+                             stdout=io.StringIO(), stderr=io.StringIO())
+            matrix = TransitMatrix.load(path, mmap_mode=None)
+            first, second, third = map(tuple, TransitMatrix.empty(matrix.station_codes).pending_pairs()[:3])
+            # 서버 오류는 다음 실행에서 다시 조회한다
+            self.assertEqual(int(matrix.data[first]), UNKNOWN)
+            self.assertEqual(int(matrix.data[second]), NO_ROUTE)
+            self.assertEqual(int(matrix.data[third]), 12)
+            self.assertEqual(tuple(matrix.pending_pairs()[0]), first)
+
+
+class StationCatalogTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        load_stations_from_json(STATION_JSON_FILE)
+
+    def setUp(self):
+        from . import station_table
+
+        reset_station_table()
+        reset_station_index()
+        self.addCleanup(reset_station_index)
+        self.addCleanup(reset_station_table)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'station_catalog.bin')
+        patcher = mock.patch.multiple(station_table, STATION_CATALOG_FILE=self.path, _catalog_stale=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self):
+        from django.core.management import call_command
+
+        call_command('build_station_catalog', output=self.path, stdout=io.StringIO())
+        reset_station_table()
+
+    def test_catalog_round_trips_station_table(self):
+        db_table = get_station_table()
+        self.assertIsNone(db_table.catalog)
+        self.build()
+
+        with self.assertNumQueries(0):
+            table = get_station_table()
+            index = get_station_index()
+        self.assertIsNotNone(table.catalog)
+        self.assertEqual(table.codes, db_table.codes)
+        self.assertEqual(table.names, db_table.names)
+        np.testing.assert_array_equal(table.factors, db_table.factors)
+        self.assertEqual(table.version, db_table.version)
+        # 좌표/팩터/인덱스 배열은 파일을 가리키는 읽기 전용 뷰
+        for array in (table.lon, table.factors, index.order):
+            self.assertFalse(array.flags.owndata)
+            self.assertFalse(array.flags.writeable)
+
+        fresh = StationIndex(db_table.stations)
+        for lon, lat in [(127.0276, 37.4979), (126.9780, 37.5665), (127.1000, 37.5140)]:
+            idx, dist = index.nearest_indices(lon, lat, k=5)
+            expected_idx, expected_dist = fresh.nearest_indices(lon, lat, k=5)
+            np.testing.assert_array_equal(idx, expected_idx)
+            np.testing.assert_allclose(dist, expected_dist)
+
+    def test_station_change_falls_back_to_database(self):
+        self.build()
+        self.assertIsNotNone(get_station_table().catalog)
+        station = Station.objects.get(station_code='1005')
+        station.factor_2 += 1
+        station.save()
+
+        table = get_station_table()
+        self.assertIsNone(table.catalog)
+        self.assertEqual(table.factors[table.by_code['1005'], 0], station.factor_2)
+
+    def test_reloads_after_load_stations_in_another_process(self):
+        from . import station_table
+
+        patcher = mock.patch.object(station_table, '_sources_checked_at', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.build()
+        table = get_station_table()
+        self.assertEqual(table.sources, dict(StationDataSource.objects.values_list('name', 'checksum')))
+        self.assertIs(station_table.refresh_station_table(), table)
+
+        # 다른 프로세스의 load_stations처럼 이 프로세스에 시그널이 오지 않는 변경
+        Station.objects.filter(station_code='1005').update(factor_2=99)
+        StationDataSource.objects.update(checksum='changed')
+        # 확인 간격 안에서는 DB를 읽지 않는다
+        with self.assertNumQueries(0):
+            self.assertIs(station_table.refresh_station_table(), table)
+        with mock.patch.object(station_table, 'STATION_SOURCE_CHECK_SECONDS', 0):
+            reloaded = station_table.refresh_station_table()
+        self.assertIsNone(reloaded.catalog)
+        self.assertEqual(reloaded.factors[reloaded.by_code['1005'], 0], 99)
+        self.assertNotEqual(reloaded.version, table.version)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a catalog')
+        with self.assertRaises(ValueError):
+            StationCatalog(self.path)
+        # 읽을 수 없는 카탈로그는 무시하고 DB에서 읽는다
+        with self.assertLogs('FindBestStation.station_table', 'WARNING'):
+            self.assertIsNone(get_station_table().catalog)
+
+        table = StationTable(['1'], ['A역'], [127.0], [37.5], [[1, 2, 3, 4, 5, 6]])
+        write_catalog(self.path, table, StationIndex(table.stations), ['factor_2'])
+        with self.assertRaises(ValueError):
+            StationCatalog(self.path, factor_fields=['factor_2', 'factor_3'])
+
+
+class StationTableTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        load_stations_from_json(STATION_JSON_FILE)
+
+    def setUp(self):
+        reset_station_table()
+        self.addCleanup(reset_station_table)
+
+    def test_vectorized_scores_match_per_station_sum(self):
+        table = get_station_table()
+        stations = list(Station.objects.order_by('?')[:20])
+        indices = table.indices_of([{'station_name': s.station_name} for s in stations])
+        weights = np.array([1, 1, 1, 0.5, 1, 2])
+        scores = table.factor_scores(indices, [2, 5, 7], weights=weights)
+        for station, score in zip(stations, scores):
+            expected = 1 + station.factor_2 * 1 + station.factor_5 * 0.5 + station.factor_7 * 2
+            self.assertAlmostEqual(score, expected)
+
+    def test_missing_station_and_unknown_factor(self):
+        table = StationTable(['1'], ['A역'], [127.0], [37.5], [[1, 2, 3, 4, 5, 6]])
+        self.assertEqual(list(table.indices_of([{'station_name': 'A역'}, {'station_name': 'B역'}])), [0, -1])
+        with self.assertRaises(ValueError):
+            table.factor_scores([0], [8])
+
+    def test_table_is_rebuilt_after_station_change(self):
+        table = get_station_table()
+        self.assertIs(get_station_table(), table)
+        station = Station.objects.first()
+        station.factor_2 += 1
+        station.save()
+        self.assertIsNot(get_station_table(), table)
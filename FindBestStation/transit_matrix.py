@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .spatial import get_station_index
+
+# 역 x 역 최소 대중교통 소요시간(분) 행렬. build_transit_matrix 명령으로 만든다.
+TRANSIT_MATRIX_FILE = os.getenv(
+    'TRANSIT_MATRIX_FILE',
+    os.path.join(settings.BASE_DIR, 'data', 'transit_matrix.npy'),
+)
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = 0xFFFF   # 아직 조회하지 않은 칸
+NO_ROUTE = 0xFFFE  # 조회했지만 경로가 없었던 칸
+MAX_MINUTES = 0xFFFD
+
+WALK_SPEED_M_PER_MIN = float(os.getenv('WALK_SPEED_M_PER_MIN', 70))
+WALK_DETOUR_FACTOR = float(os.getenv('WALK_DETOUR_FACTOR', 1.3))
+TRANSIT_MATRIX_SNAP_K = int(os.getenv('TRANSIT_MATRIX_SNAP_K', 3))
+TRANSIT_MATRIX_SNAP_RADIUS = float(os.getenv('TRANSIT_MATRIX_SNAP_RADIUS', 1500))
+
+
+def walking_minutes(distance_m):
+    return distance_m * WALK_DETOUR_FACTOR / WALK_SPEED_M_PER_MIN
+
+
+def _meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+class TransitMatrix:
+    """station_codes 순서대로 정렬된 uint16 정사각 행렬 (행: 출발역, 열: 도착역)."""
+
+    def __init__(self, station_codes, data):
+        self.station_codes = list(station_codes)
+        self.code_to_idx = {code: i for i, code in enumerate(self.station_codes)}
+        self.data = data
+
+    def __len__(self):
+        return len(self.station_codes)
+
+    @classmethod
+    def empty(cls, station_codes):
+        n = len(station_codes)
+        data = np.full((n, n), UNKNOWN, dtype=np.uint16)
+        np.fill_diagonal(data, 0)
+        return cls(station_codes, data)
+
+    @classmethod
+    def load(cls, path=TRANSIT_MATRIX_FILE, mmap_mode='r'):
+        with open(_meta_path(path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        data = np.load(path, mmap_mode=mmap_mode)
+        if data.dtype != np.uint16 or data.shape != (len(meta['station_codes']),) * 2:
+            raise ValueError(f"Transit matrix {path} does not match its metadata.")
+        return cls(meta['station_codes'], data)
+
+    def save(self, path=TRANSIT_MATRIX_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 쓰는 도중에 죽어도 기존 파일이 깨지지 않도록 임시 파일에 쓰고 교체
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.data, dtype=np.uint16))
+        os.replace(tmp_path, path)
+
+        meta_path = _meta_path(path)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'station_codes': self.station_codes}, f, ensure_ascii=False)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def remap(self, station_codes):
+        # 역 목록이 바뀌었을 때 이미 채운 칸은 살려서 새 순서의 행렬을 만든다
+        remapped = TransitMatrix.empty(station_codes)
+        old_idx = np.array([self.code_to_idx.get(code, -1) for code in station_codes], dtype=np.int64)
+        keep = np.flatnonzero(old_idx >= 0)
+        if len(keep):
+            remapped.data[np.ix_(keep, keep)] = self.data[np.ix_(old_idx[keep], old_idx[keep])]
+        return remapped
+
+    def set_minutes(self, i, j, minutes):
+        if minutes is None:
+            self.data[i, j] = NO_ROUTE
+        else:
+            self.data[i, j] = min(int(round(minutes)), MAX_MINUTES)
+
+    def pending_pairs(self, retry_no_route=False):
+        mask = self.data == UNKNOWN
+        if retry_no_route:
+            mask |= self.data == NO_ROUTE
+        return np.argwhere(mask)
+
+
+class MatrixTransitEstimator:
+    """출발/도착 좌표를 가까운 역으로 붙이고(도보 시간 추가) 행렬에서 소요시간을 읽는다."""
+
+    def __init__(self, matrix, index):
+        self.matrix = matrix
+        self.index = index
+        # 공간 인덱스의 역 순서 -> 행렬 인덱스 (행렬에 없는 역은 -1)
+        self.matrix_idx = np.array(
+            [matrix.code_to_idx.get(s['station_code'], -1) for s in index.stations],
+            dtype=np.int64,
+        )
+
+    def snap(self, lon, lat):
+        idx, dist = self.index.nearest_indices(
+            lon, lat, k=TRANSIT_MATRIX_SNAP_K, radius_m=TRANSIT_MATRIX_SNAP_RADIUS)
+        m_idx = self.matrix_idx[idx]
+        keep = m_idx >= 0
+        return m_idx[keep], walking_minutes(dist[keep])
+
+    def transit_time(self, start_x, start_y, end_x, end_y):
+        o_idx, o_walk = self.snap(start_x, start_y)
+        d_idx, d_walk = self.snap(end_x, end_y)
+        if len(o_idx) == 0 or len(d_idx) == 0:
+            return None
+
+        block = self.matrix.data[np.ix_(o_idx, d_idx)].astype(np.float64)
+        block[block > MAX_MINUTES] = np.inf
+        best = float((o_walk[:, None] + block + d_walk[None, :]).min())
+
+        # 가까운 거리면 바로 걸어가는 편이 빠를 수 있다
+        sx, sy = self.index.project(start_x, start_y)
+        ex, ey = self.index.project(end_x, end_y)
+        direct = float(np.hypot(ex - sx, ey - sy))
+        if direct <= TRANSIT_MATRIX_SNAP_RADIUS:
+            best = min(best, walking_minutes(direct))
+
+        if best == float('inf'):
+            return None
+        return max(int(round(best)), 1)
+
+
+_estimator = None
+_estimator_loaded = False
+_estimator_lock = threading.Lock()
+
+
+def get_matrix_estimator():
+    # 행렬 파일이 없으면 None
+    global _estimator, _estimator_loaded
+    index = get_station_index()
+    if not _estimator_loaded or (_estimator is not None and _estimator.index is not index):
+        with _estimator_lock:
+            if not _estimator_loaded or (_estimator is not None and _estimator.index is not index):
+                if os.path.exists(TRANSIT_MATRIX_FILE):
+                    _estimator = MatrixTransitEstimator(TransitMatrix.load(TRANSIT_MATRIX_FILE), index)
+                else:
+                    logger.info("Transit matrix not found: %s. Using ODsay.", TRANSIT_MATRIX_FILE)
+                    _estimator = None
+                _estimator_loaded = True
+    return _estimator
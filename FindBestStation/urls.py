@@ -1,8 +1,12 @@
 from django.urls import path
-from .views import find_optimal_station #, search_places
+from .views import find_optimal_station, find_optimal_station_async, find_optimal_station_stream, find_optimal_stations_batch, meetup_session #, search_places
 
 
 urlpatterns = [
     path('find_optimal_station/', find_optimal_station, name='find_optimal_station'),
+    path('find_optimal_station_async/', find_optimal_station_async, name='find_optimal_station_async'),
+    path('find_optimal_station_stream/', find_optimal_station_stream, name='find_optimal_station_stream'),
+    path('find_optimal_stations_batch/', find_optimal_stations_batch, name='find_optimal_stations_batch'),
+    path('session/', meetup_session, name='meetup_session'),
     #path('search_places/', search_places, name='search_places'),
 ]
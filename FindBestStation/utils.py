@@ -1,76 +1,141 @@
 import requests
 from dotenv import load_dotenv
 import os
-from .models import Station
+from .spatial import get_station_index
+from .station_table import get_station_table
+from .factor_rankings import get_factor_rankings
+from .regions import get_region_lookup
+from .transit_matrix import get_matrix_estimator
+from .subway_graph import get_subway_graph
+from .isochrones import get_isochrone_estimator
+from .cache import transit_cache
+from . import http_client
+from .odsay_keys import get_key_scheduler
+from .ranking import SKIPPED, StreamingRanker
+from .singleflight import SingleFlight
+from .deadlines import DeadlineExceeded, expired, odsay_latency, remaining
+from . import metrics
 from pyproj import Transformer, CRS
 import requests
 import time
-import urllib.parse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from functools import lru_cache, partial
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 KAKAO_API_KEY = os.getenv("KAKAO_API_KEY")
+# 외부 API 주소 (벤치마크/테스트에서는 로컬 스텁 서버로 바꿔서 쓴다)
+KAKAO_API_BASE = os.getenv('KAKAO_API_BASE', 'https://dapi.kakao.com')
+ODSAY_API_BASE = os.getenv('ODSAY_API_BASE', 'https://api.odsay.com')
+KAKAO_REGION_URL = f"{KAKAO_API_BASE}/v2/local/geo/coord2regioncode.json"
 NAVER_CLIENT_ID = os.getenv("NAVER_CLIENT_ID")
 NAVER_CLIENT_SECRET = os.getenv("NAVER_CLIENT_SECRET")
 FORMAT = "json"
-search_url = f"https://dapi.kakao.com/v2/local/search/keyword.{FORMAT}"
-transcoord_url = f"https://dapi.kakao.com/v2/local/geo/transcoord.{FORMAT}"  # target URL
-api_keys = []
-api_key_idx = 0
-
-def load_api_keys():
-    global api_keys
-    idx = 1
-    while True:
-        key = os.getenv(f'ODSAY_API_KEY{idx}')
-        if key is None:
-            break
-        api_keys.append(key)
-        idx += 1
-        
-def get_next_api_key():
-    global api_key_idx
-    key = api_keys[api_key_idx]
-    api_key_idx = (api_key_idx + 1) % N
-    return key
-
-load_api_keys()
-N = len(api_keys)  # API 키의 총 개수
-
-# EPSG:5179 좌표계 = 네이버 지도 좌표계
-crs_epsg5179 = CRS.from_epsg(5179)
-# WGS84 좌표계 = 카카오맵 좌표계
-crs_wgs84 = CRS.from_epsg(4326)
-
-f_transformer = Transformer.from_crs(crs_epsg5179, crs_wgs84)
-r_transformer = Transformer.from_crs(crs_wgs84, crs_epsg5179)
+search_url = f"{KAKAO_API_BASE}/v2/local/search/keyword.{FORMAT}"
+transcoord_url = f"{KAKAO_API_BASE}/v2/local/geo/transcoord.{FORMAT}"  # target URL
+
+# 후보역 검색 방식: 'local' (DB 역 좌표 공간 인덱스) 또는 'kakao' (카카오 키워드 검색)
+STATION_SEARCH_MODE = os.getenv('STATION_SEARCH_MODE', 'local')
+STATION_SEARCH_K = int(os.getenv('STATION_SEARCH_K', 15))
+STATION_SEARCH_RADIUS = float(os.getenv('STATION_SEARCH_RADIUS', 20000))
+
+# ODsay를 부르기 전에 직선거리로 추정한 소요시간 + 팩터 점수로 후보역을 K개까지 줄인다 (0이면 줄이지 않음)
+CANDIDATE_PRUNE_K = int(os.getenv('CANDIDATE_PRUNE_K', 5))
+# 직선거리 -> 대중교통 소요시간 추정에 쓰는 평균 속도(m/분)와 우회 계수
+ESTIMATED_TRANSIT_SPEED_M_PER_MIN = float(os.getenv('ESTIMATED_TRANSIT_SPEED_M_PER_MIN', 350))
+ESTIMATED_DETOUR_FACTOR = float(os.getenv('ESTIMATED_DETOUR_FACTOR', 1.3))
+# 후보역을 줄일 때 쓰는 추정 소요시간: 'distance' (직선거리) 또는 'graph' (지하철 노선 그래프, 없으면 직선거리)
+CANDIDATE_ESTIMATOR = os.getenv('CANDIDATE_ESTIMATOR', 'distance')
+# 후보역 고르기. 'estimate': 추정 점수 상위 CANDIDATE_PRUNE_K개만 조회,
+# 'threshold': 후보역 전부를 팩터 조합별로 미리 정렬해 둔 순서로 조회하면서 top 3에 들 수 없는 역을 걸러낸다
+# (TRANSIT_MAX_SPEED_M_PER_MIN을 켜지 않으면 정확한 순위. 조회 수가 후보역 수에 비례해서 늘지 않으므로
+# STATION_SEARCH_K/RADIUS를 넓혀도 된다)
+CANDIDATE_STRATEGY = os.getenv('CANDIDATE_STRATEGY', 'estimate')
+EARTH_RADIUS_M = 6371008.8
+
+# find_best_station에서 동시에 진행할 소요시간 조회 수 (0이면 한꺼번에)
+TRANSIT_FETCH_CONCURRENCY = int(os.getenv('TRANSIT_FETCH_CONCURRENCY', 8))
+# 아직 오지 않은 소요시간의 하한을 잡을 때 쓰는 직선거리 기준 최고 속도(m/분). 기본 0이면 하한 0 (항상 안전).
+# 켜면 더 많이 걸러내지만, 급행이나 노선 그래프/행렬/격자 값이 이 속도보다 빠른 구간이 있으면
+# 하한이 실제보다 커져서 top 3에 들 역을 걸러낼 수 있다 (그때는 순위가 정확하지 않다)
+TRANSIT_MAX_SPEED_M_PER_MIN = float(os.getenv('TRANSIT_MAX_SPEED_M_PER_MIN', 0))
+
+# 소요시간 계산 방식: 'odsay' (실시간 API), 'matrix' (미리 만든 역간 소요시간 행렬, 없으면 ODsay),
+# 'graph' (지하철 노선 그래프 최단 경로, 노선 파일이 없거나 경로가 없으면 ODsay)
+# 또는 'grid' (미리 만든 격자 칸 x 역 소요시간 표, 표 파일이 없거나 값이 없으면 ODsay)
+TRANSIT_TIME_PROVIDER = os.getenv('TRANSIT_TIME_PROVIDER', 'odsay')
+# ODsay 조회에 실패했을 때(에러, 호출 한도 초과, 여유 있는 키 없음) TRANSIT_FALLBACK_MINUTES 대신 쓸 계산 방식:
+# 'graph' (노선 그래프, 노선 파일이 없으면 TRANSIT_FALLBACK_MINUTES) 또는 'none'
+TRANSIT_FALLBACK_PROVIDER = os.getenv('TRANSIT_FALLBACK_PROVIDER', 'graph')
+ODSAY_TRANSIT_URL = f"{ODSAY_API_BASE}/v1/api/searchPubTransPathT"
+# ODsay 조회에 실패했을 때 쓰는 소요시간(분)
+TRANSIT_FALLBACK_MINUTES = 120
+ODSAY_MAX_ATTEMPTS = int(os.getenv('ODSAY_MAX_ATTEMPTS', 10))
+# 여유 있는 키가 없을 때 기다리는 최대 시간(초)
+ODSAY_KEY_WAIT = float(os.getenv('ODSAY_KEY_WAIT', 2))
+# 헤징(같은 호출을 다른 키로 한 번 더)에 쓰는 스레드 수. 헤징을 켜면 ODsay 호출은 모두 이 풀에서 돈다.
+# 기본값은 ODsay 커넥션 풀 크기(HTTP_POOL_MAXSIZE_ODSAY). 풀보다 크면 넘치는 호출마다 연결을 새로 맺고 버린다
+ODSAY_HEDGE_WORKERS = int(os.getenv('ODSAY_HEDGE_WORKERS', http_client.pool_maxsize(ODSAY_API_BASE)))
+# 키 문제가 아니라 경로 자체가 없는 경우 (700m 이내, 검색 결과 없음, 정류장 없음, 서비스 지역 아님)
+ODSAY_ROUTE_ERROR_CODES = {'-98', '-99', '3', '4', '5', '6'}
+
+# 동시에 들어온 같은 지역 판별 / 같은 구간(소요시간 캐시 격자 기준) 조회는 한 번만 외부 API를 부른다
+region_flight = SingleFlight('region')
+transit_flight = SingleFlight('transit')
+odsay_executor = ThreadPoolExecutor(max_workers=ODSAY_HEDGE_WORKERS, thread_name_prefix='odsay')
+
+# 좌표 변환기는 처음 쓸 때 만든다 (워커 부팅 시간 단축)
+@lru_cache(maxsize=None)
+def get_transformers():
+    # EPSG:5179 좌표계 = 네이버 지도 좌표계
+    crs_epsg5179 = CRS.from_epsg(5179)
+    # WGS84 좌표계 = 카카오맵 좌표계
+    crs_wgs84 = CRS.from_epsg(4326)
+
+    f_transformer = Transformer.from_crs(crs_epsg5179, crs_wgs84)
+    r_transformer = Transformer.from_crs(crs_wgs84, crs_epsg5179)
+    return f_transformer, r_transformer
 
 def wgs84_to_epsg5179(lon, lat):
-  x, y = r_transformer.transform(lat, lon) # x, y
+  x, y = get_transformers()[1].transform(lat, lon) # x, y
   return x, y
 
 def epsg5179_to_wgs84(lon, lat):
-  x, y = f_transformer.transform(lat, lon) # x, y
+  x, y = get_transformers()[0].transform(lat, lon) # x, y
   return x, y
 
 def is_within_seoul(lon, lat):
-    url = "https://dapi.kakao.com/v2/local/geo/coord2regioncode.json"
     headers = {"Authorization": f"KakaoAK {KAKAO_API_KEY}"}
     params = {"x": lon, "y": lat}
     
-    response = requests.get(url, headers=headers, params=params)
+    metrics.count('upstream_calls', provider='kakao')
+    response = http_client.get(KAKAO_REGION_URL, headers=headers, params=params)
     if response.status_code == 200:
-        data = response.json()
-        documents = data.get('documents', [])
-        if documents:
-            region_1depth_name = documents[0].get('region_1depth_name', '')
-            region_2depth_name = documents[0].get('region_2depth_name', '')
-            print(region_1depth_name)
-            return region_1depth_name, region_2depth_name
-            
+        return parse_region_documents(response.json())
+
+def parse_region_documents(data):
+    documents = data.get('documents', [])
+    if documents:
+        region_1depth_name = documents[0].get('region_1depth_name', '')
+        region_2depth_name = documents[0].get('region_2depth_name', '')
+        logger.debug("region: %s %s", region_1depth_name, region_2depth_name)
+        return region_1depth_name, region_2depth_name
+
+def get_region(lon, lat):
+    # 로컬 행정구역 경계로 먼저 판별하고, 경계 파일이 없거나 경계 밖이면 카카오 API 사용
+    lookup = get_region_lookup()
+    if lookup is not None:
+        region = lookup.lookup(lon, lat)
+        if region is not None:
+            return region
+    return region_flight.do((lon, lat), is_within_seoul, lon, lat)
 
 def find_nearest_seoul(lon, lat):
-    url = "https://dapi.kakao.com/v2/local/search/keyword.json"
+    url = f"{KAKAO_API_BASE}/v2/local/search/keyword.json"
     headers = {"Authorization": f"KakaoAK {KAKAO_API_KEY}"}
     params = {
         "query": "서울",
@@ -80,7 +145,8 @@ def find_nearest_seoul(lon, lat):
         "sort": "distance"
     }
     
-    response = requests.get(url, headers=headers, params=params)
+    metrics.count('upstream_calls', provider='kakao')
+    response = http_client.get(url, headers=headers, params=params)
     if response.status_code == 200:
         data = response.json()
         documents = data.get('documents', [])
@@ -95,48 +161,44 @@ def find_nearest_seoul(lon, lat):
         raise ValueError("Error while searching for nearest Seoul location.")
 
 def adjust_location(loc):
+    return location_for_region(loc, get_region(loc['lon'], loc['lat']))
+
+def location_for_region(loc, region):
+    # 서울이면 그대로, 인천/경기면 지역별 대표역 좌표로 옮긴다
+    if region is None:
+        return None
     lon, lat = loc['lon'], loc['lat']
-    location_first, location_second=is_within_seoul(lon,lat)
-    print(f'location_first:{location_first}, location_second:{location_second}')
+    location_first, location_second = region
+    logger.debug("location_first:%s, location_second:%s", location_first, location_second)
     if location_first == '서울특별시':
         return {'lon': lon, 'lat': lat}
     elif location_first == '인천광역시':
         try:
             return {'lon': 126.801, 'lat': 37.563 }
         except ValueError as e: 
-            print(e)
+            logger.warning("%s", e)
             return None
     elif location_first == '경기도':
         location_second = location_second.split(' ')[0]
         if location_second == '고양시':  # 구파발역
-            print(1)
             return {'lon': 126.918, 'lat': 37.636}
         elif location_second in ['동두천시', '연천군', '의정부시', '포천시', '양주시']:  # 도봉산역
-            print(2)
             return {'lon': 127.046, 'lat': 37.689}
         elif location_second in ['광명시', '의왕시', '시흥시', '안산시']:  # 금천구청역
-            print(3)
             return {'lon': 126.896, 'lat': 37.456}
         elif location_second == '김포시':  # 김포공항역
-            print(4)
             return {'lon': 126.801, 'lat': 37.562}
         elif location_second in ['과천시', '군포시', '수원시',  '안양시']:  # 남태령역
-            print(5)
             return {'lon': 126.989, 'lat': 37.464}
         elif location_second == '파주시':  # 수색역
-            print(6)
             return {'lon': 126.896, 'lat': 37.581}
         elif location_second in ['가평군', '구리시', '남양주시', '양평군']:  # 양원역
-            print(7)
             return {'lon': 127.108, 'lat': 37.607}
         elif location_second == '부천시':  # 온수역
-            print(8)
             return {'lon': 126.824, 'lat': 37.492}
         elif location_second in ['광주시', '용인시', '성남시', '여주시', '이천시', '안성시', '오산시', '평택시', '화성시']:  # 청계산입구역
-            print(9)
             return {'lon': 127.055, 'lat': 37.448}
         elif location_second == '하남시':  # 강일역
-            print(10)
             return {'lon': 127.176, 'lat': 37.558}
         else:
             return None
@@ -145,24 +207,38 @@ def adjust_location(loc):
 
 def adjust_locations_to_seoul(locations):
     adjusted_locations = []
+    if get_region_lookup() is not None:
+        # 네트워크 호출이 없으므로 스레드 없이 바로 처리
+        for loc in locations:
+            result = adjust_location(loc)
+            if not result:
+                logger.warning("Failed to adjust location: %s", loc)
+                return None
+            adjusted_locations.append(result)
+        return adjusted_locations
+
     with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_location = {executor.submit(adjust_location, loc): loc for loc in locations}
+        future_to_location = {metrics.submit(executor, adjust_location, loc): loc for loc in locations}
         for future in as_completed(future_to_location):
             result = future.result()
             if result:
                 adjusted_locations.append(result)
             else:
-                print(f"Failed to adjust location: {future_to_location[future]}")
+                logger.warning("Failed to adjust location: %s", future_to_location[future])
                 return None
     return adjusted_locations
 
 def calculate_midpoint(locations):
     
-    adjusted_locations = adjust_locations_to_seoul(locations)
-    print(adjusted_locations)
+    with metrics.span('region'):
+        adjusted_locations = adjust_locations_to_seoul(locations)
+    logger.debug("adjusted_locations: %s", adjusted_locations)
     if adjusted_locations is None:
         return 0, 0
-    
+    with metrics.span('midpoint'):
+        return midpoint_of(adjusted_locations)
+
+def midpoint_of(adjusted_locations):
     epsg5179_coords = [wgs84_to_epsg5179(loc['lon'], loc['lat']) for loc in adjusted_locations]
 
     midpoint_x = sum(coord[0] for coord in epsg5179_coords) / len(epsg5179_coords)
@@ -172,45 +248,66 @@ def calculate_midpoint(locations):
     return midpoint_lon, midpoint_lat
 
 
-place_search_url = f"https://dapi.kakao.com/v2/local/search/keyword.{FORMAT}"
+place_search_url = f"{KAKAO_API_BASE}/v2/local/search/keyword.{FORMAT}"
+
+def find_nearest_stations(midpoint):
+    with metrics.span('candidates'):
+        if STATION_SEARCH_MODE == 'kakao':
+            return find_nearest_stations_kakao(midpoint)
+
+        index = get_station_index()
+        if len(index) == 0:
+            # DB에 역 데이터가 없으면 카카오 검색으로 대체
+            logger.warning("Station table is empty. Falling back to Kakao keyword search.")
+            return find_nearest_stations_kakao(midpoint)
+        return find_nearest_stations_local(midpoint)
+
+def find_nearest_stations_local(midpoint):
+    index = get_station_index()
+    return index.nearest(midpoint[0], midpoint[1], k=STATION_SEARCH_K, radius_m=STATION_SEARCH_RADIUS)
 
 def find_nearest_stations_kakao(midpoint):
     headers = {
         "Authorization": f"KakaoAK {KAKAO_API_KEY}"
     }
-    params = {
+    params = kakao_station_search_params(midpoint)
+    
+    metrics.count('upstream_calls', provider='kakao')
+    response = http_client.get(place_search_url, headers=headers, params=params)
+    if response.status_code == 200:
+        return parse_station_documents(response.json())
+    else:
+        logger.warning("Error in processing request: %s", response.status_code)
+        return []
+
+def kakao_station_search_params(midpoint):
+    return {
         "query": "지하철역",
         "x": midpoint[0],  # 경도
         "y": midpoint[1],  # 위도
         "radius": 20000,
         "sort": "distance",
     }
-    
-    response = requests.get(place_search_url, headers=headers, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        stations = []
-        added_station_names = set() 
-        for document in data['documents']:
-            station_name_cleaned = document['place_name'].split(' ')[0]
-            if station_name_cleaned not in added_station_names:
-                station = {
-                    'station_code': document['id'],
-                    'station_name': station_name_cleaned,
-                    'x': float(document['x']),
-                    'y': float(document['y'])
-                }
-                stations.append(station)
-                added_station_names.add(station_name_cleaned)
-        return stations
-    else:
-        print(f"Error in processing request: {response.status_code}")
-        return []
+
+def parse_station_documents(data):
+    stations = []
+    added_station_names = set() 
+    for document in data['documents']:
+        station_name_cleaned = document['place_name'].split(' ')[0]
+        if station_name_cleaned not in added_station_names:
+            station = {
+                'station_code': document['id'],
+                'station_name': station_name_cleaned,
+                'x': float(document['x']),
+                'y': float(document['y'])
+            }
+            stations.append(station)
+            added_station_names.add(station_name_cleaned)
+    return stations
     
 
-def get_transit_time(start_x, start_y, end_x, end_y):
-    base_url = "https://api.odsay.com/v1/api/searchPubTransPathT"
-    api_key = get_next_api_key()
+def request_odsay_transit_time(start_x, start_y, end_x, end_y, api_key, timeout=None):
+    # ODsay 한 번 호출 -> (최소 소요시간(분) 또는 None, error payload 또는 None)
     params = {
         "SX": start_x,
         "SY": start_y,
@@ -218,116 +315,409 @@ def get_transit_time(start_x, start_y, end_x, end_y):
         "EY": end_y,
         "apiKey": api_key
     }
-    encoded_params = urllib.parse.urlencode(params)
-    request_url = f"{base_url}?{encoded_params}"
-
-    retries = 10
-    delay = 0.3
-
-    for attempt in range(retries):
+    metrics.count('upstream_calls', provider='odsay')
+    kwargs = {} if timeout is None else {'timeout': timeout}
+    started_at = time.monotonic()
+    response = http_client.get(ODSAY_TRANSIT_URL, params=params, **kwargs)
+    response.raise_for_status()
+    odsay_latency.observe(time.monotonic() - started_at)
+    return parse_odsay_response(response.json())
+
+def odsay_http_timeout(deadline):
+    # 마감이 있으면 (connect, read) 타임아웃을 남은 시간 안으로 줄인다
+    if deadline is None:
+        return None
+    left = max(deadline.remaining(), 0.01)
+    return min(http_client.HTTP_CONNECT_TIMEOUT, left), min(http_client.HTTP_READ_TIMEOUT, left)
+
+def report_late_odsay_result(scheduler, api_key, future):
+    # 헤징에서 진 호출도 끝나면 키 상태에 반영한다
+    if not future.cancelled() and future.exception() is None:
+        handle_odsay_result(scheduler, api_key, future.result()[1])
+
+def request_odsay_hedged(scheduler, api_key, start_x, start_y, end_x, end_y, deadline=None):
+    """api_key로 호출하고, 최근 응답 시간 분위수(hedge delay)가 지나도 답이 없으면 다른 키로 한 번 더 보낸다.
+    -> (먼저 답한 호출의 키, 분, error). 둘 다 실패하면 먼저 난 예외, 마감까지 답이 없으면 DeadlineExceeded."""
+    delay = odsay_latency.hedge_delay()
+    timeout = odsay_http_timeout(deadline)
+    if delay is None:
+        return (api_key,) + request_odsay_transit_time(start_x, start_y, end_x, end_y, api_key, timeout=timeout)
+
+    calls = {metrics.submit(odsay_executor, request_odsay_transit_time,
+                            start_x, start_y, end_x, end_y, api_key, timeout=timeout): api_key}
+    done, _ = wait(calls, timeout=remaining(deadline, delay))
+    if not done and not expired(deadline):
+        hedge_key, _ = scheduler.try_acquire(exclude={api_key})
+        if hedge_key is not None:
+            metrics.count('odsay_hedges')
+            calls[metrics.submit(odsay_executor, request_odsay_transit_time,
+                                 start_x, start_y, end_x, end_y, hedge_key, timeout=timeout)] = hedge_key
+
+    pending = set(calls)
+    first_error = None
+    while pending:
+        done, pending = wait(pending, timeout=remaining(deadline), return_when=FIRST_COMPLETED)
+        if not done:
+            for future in pending:
+                future.add_done_callback(partial(report_late_odsay_result, scheduler, calls[future]))
+            raise DeadlineExceeded()
+        for future in done:
+            try:
+                minutes, error = future.result()
+            except requests.exceptions.RequestException as e:
+                first_error = first_error or e
+                continue
+            for other in pending:
+                other.add_done_callback(partial(report_late_odsay_result, scheduler, calls[other]))
+            return calls[future], minutes, error
+    raise first_error
+
+def parse_odsay_response(data):
+    # -> (최소 소요시간(분) 또는 None, error payload 또는 None)
+    if 'result' in data and 'path' in data['result']:
+        durations = [path['info']['totalTime'] for path in data['result']['path']]
+        return (min(durations) if durations else None), None
+    elif 'error' in data:
+        return None, data['error']
+    raise requests.exceptions.RequestException("No result or error in response")
+
+def odsay_error_code(error):
+    # ODsay error는 dict 또는 dict의 list로 온다
+    if isinstance(error, list):
+        error = error[0] if error else {}
+    if not isinstance(error, dict):
+        return '', str(error)
+    return str(error.get('code', '')), str(error.get('message') or error.get('msg') or '')
+
+def is_odsay_quota_error(error):
+    code, message = odsay_error_code(error)
+    return code == '429' or '초과' in message or 'limit' in message.lower()
+
+def get_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+    if TRANSIT_TIME_PROVIDER == 'matrix':
+        estimator = get_matrix_estimator()
+        if estimator is not None:
+            minutes = estimator.transit_time(start_x, start_y, end_x, end_y)
+            if minutes is not None:
+                return minutes
+    elif TRANSIT_TIME_PROVIDER == 'graph':
+        graph = get_subway_graph()
+        if graph is not None:
+            minutes = graph.transit_time(start_x, start_y, end_x, end_y)
+            if minutes is not None:
+                return minutes
+    elif TRANSIT_TIME_PROVIDER == 'grid':
+        estimator = get_isochrone_estimator()
+        if estimator is not None:
+            minutes = estimator.transit_time(start_x, start_y, end_x, end_y)
+            if minutes is not None:
+                return minutes
+    return get_odsay_transit_time(start_x, start_y, end_x, end_y, deadline=deadline)
+
+def precomputed_transit_times(stations, user_locations):
+    # TRANSIT_TIME_PROVIDER가 'grid'면 격자 표에서 한 번의 gather로, 'graph'면 사용자마다 Dijkstra 한 번으로
+    # 모든 후보역까지의 소요시간을 구한다 -> {(역 인덱스, 사용자 인덱스): 분}.
+    # 값이 없는 칸은 빠지고, 그 칸만 get_transit_time으로 조회한다
+    if TRANSIT_TIME_PROVIDER == 'grid':
+        estimator = get_isochrone_estimator()
+        if estimator is None:
+            return {}
+        block = estimator.minutes_matrix(user_locations, stations)
+        return {(int(i), int(u)): int(block[u, i]) for u, i in zip(*np.nonzero(np.isfinite(block)))}
+    if TRANSIT_TIME_PROVIDER != 'graph':
+        return {}
+    graph = get_subway_graph()
+    if graph is None:
+        return {}
+    times = {}
+    for u, user in enumerate(user_locations):
+        for i, minutes in enumerate(graph.minutes_from(user['lon'], user['lat'], stations)):
+            if minutes is not None:
+                times[(i, u)] = minutes
+    return times
+
+def fallback_transit_time(start_x, start_y, end_x, end_y):
+    # ODsay를 쓸 수 없을 때: 노선 그래프로 계산해 보고, 안 되면 TRANSIT_FALLBACK_MINUTES
+    if TRANSIT_FALLBACK_PROVIDER == 'graph':
+        graph = get_subway_graph()
+        minutes = graph.transit_time(start_x, start_y, end_x, end_y) if graph is not None else None
+        if minutes is not None:
+            metrics.count('provider_fallbacks', provider='graph')
+            return minutes
+    metrics.count('transit_fallbacks')
+    return TRANSIT_FALLBACK_MINUTES
+
+def get_odsay_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+    minutes = transit_cache.get(start_x, start_y, end_x, end_y)
+    if minutes is not None:
+        return minutes
+    if transit_cache.is_recent_failure(start_x, start_y, end_x, end_y):
+        return fallback_transit_time(start_x, start_y, end_x, end_y)
+    return transit_flight.do(transit_cache.key(start_x, start_y, end_x, end_y),
+                             fetch_and_cache_transit_time, start_x, start_y, end_x, end_y,
+                             timeout=remaining(deadline), deadline=deadline)
+
+def fetch_and_cache_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+    # 마감이 지나면 DeadlineExceeded (실패로 기억하지 않는다)
+    minutes = fetch_odsay_transit_time(start_x, start_y, end_x, end_y, deadline=deadline)
+    if minutes is None:
+        # 실패는 실제 결과와 따로 짧게만 기억한다
+        transit_cache.set_failure(start_x, start_y, end_x, end_y)
+        return fallback_transit_time(start_x, start_y, end_x, end_y)
+    transit_cache.set(start_x, start_y, end_x, end_y, minutes)
+    return minutes
+
+def fetch_odsay_transit_time(start_x, start_y, end_x, end_y, deadline=None):
+    # 실패하면 None, 마감이 지나면 DeadlineExceeded
+    scheduler = get_key_scheduler()
+    for attempt in range(ODSAY_MAX_ATTEMPTS):
+        if expired(deadline):
+            raise DeadlineExceeded()
+        api_key = scheduler.acquire(timeout=remaining(deadline, ODSAY_KEY_WAIT))
+        if api_key is None:
+            if expired(deadline):
+                raise DeadlineExceeded()
+            logger.warning("No ODsay API key has headroom.")
+            return None
+        if attempt:
+            metrics.count('odsay_retries')
         try:
-            response = requests.get(request_url)
-            response.raise_for_status()
-            data = response.json()
-
-            if 'result' in data and 'path' in data['result']:
-                min_duration = float('inf')
-                for path in data['result']['path']:
-                    duration = path['info']['totalTime']
-                    if duration < min_duration:
-                        min_duration = duration
-                return min_duration if min_duration != float('inf') else 120
-            elif 'error' in data:
-                # retry with a different api key
-                api_key = get_next_api_key()
-                time.sleep(0.3)
-            else:
-                raise requests.exceptions.RequestException("No result or error in response")
+            api_key, minutes, error = request_odsay_hedged(scheduler, api_key, start_x, start_y, end_x, end_y, deadline)
         except requests.exceptions.RequestException as e:
-            return 120  # Return 120 minutes if request fails
-
-    return 120
-
-def find_best_station(stations, user_locations, factors):
-    station_scores = []
-    factor_weights = {
-        2: float(os.getenv('FACTOR_2_WEIGHT', 1)),
-        3: float(os.getenv('FACTOR_3_WEIGHT', 1)),
-        4: float(os.getenv('FACTOR_4_WEIGHT', 1)),
-        5: float(os.getenv('FACTOR_5_WEIGHT', 1)),
-        6: float(os.getenv('FACTOR_6_WEIGHT', 1)),
-        7: float(os.getenv('FACTOR_7_WEIGHT', 1))
-    }
-    
-    def fetch_transit_time_for_station(station, user_location):
-        return get_transit_time(user_location['lon'], user_location['lat'], station['x'], station['y'])
-    
-    def process_station(station):
+            logger.warning("ODsay request failed: %s", e)
+            return None
+
+        if handle_odsay_result(scheduler, api_key, error):
+            return minutes
+        if odsay_error_code(error)[0] in ODSAY_ROUTE_ERROR_CODES:
+            return None
+        # retry with a different api key
+    return None
+
+def handle_odsay_result(scheduler, api_key, error):
+    # 키 상태를 갱신하고, 결과를 그대로 써도 되면 True
+    if error is None:
+        scheduler.report_success(api_key)
+        return True
+    if odsay_error_code(error)[0] in ODSAY_ROUTE_ERROR_CODES:
+        scheduler.report_success(api_key)
+    else:
+        scheduler.report_error(api_key, quota_exceeded=is_odsay_quota_error(error))
+    return False
+
+def station_factor_scores(stations, factors):
+    # 후보역 전체의 팩터 점수를 한 번에 계산한다. DB에 없는 역은 None
+    table = get_station_table()
+    indices = table.indices_of(stations)
+    scores = table.factor_scores(np.maximum(indices, 0), factors)
+    return [float(score) if idx >= 0 else None for idx, score in zip(indices, scores)]
+
+def haversine_matrix(lon1, lat1, lon2, lat2):
+    # 출발지(행) x 도착지(열) 대원거리(m) 행렬
+    lon1, lat1 = (np.radians(np.asarray(v, dtype=np.float64))[:, None] for v in (lon1, lat1))
+    lon2, lat2 = (np.radians(np.asarray(v, dtype=np.float64))[None, :] for v in (lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def estimate_transit_minutes(distance_m):
+    return distance_m * ESTIMATED_DETOUR_FACTOR / ESTIMATED_TRANSIT_SPEED_M_PER_MIN
+
+def transit_lower_bounds(stations, user_locations):
+    # 역 x 사용자 소요시간 하한(분): 직선거리를 TRANSIT_MAX_SPEED_M_PER_MIN로 간다고 본 시간
+    if not TRANSIT_MAX_SPEED_M_PER_MIN or not stations:
+        return None
+    distances = haversine_matrix(
+        [station['x'] for station in stations], [station['y'] for station in stations],
+        [user['lon'] for user in user_locations], [user['lat'] for user in user_locations])
+    return (distances / TRANSIT_MAX_SPEED_M_PER_MIN).tolist()
+
+def prune_candidates(stations, factor_scores, user_locations, k=None):
+    # 추정 소요시간으로 rank_stations와 같은 점수를 매겨 상위 k개만 (점수 순으로) 남긴다.
+    # DB에 없는 역(팩터 점수 None)은 어차피 순위에 들지 않으므로 뺀다
+    k = CANDIDATE_PRUNE_K if k is None else k
+    if not k:
+        return stations, factor_scores
+    known = [i for i, score in enumerate(factor_scores) if score is not None]
+    if not known or not user_locations:
+        return [stations[i] for i in known], [factor_scores[i] for i in known]
+
+    distances = haversine_matrix(
+        [user['lon'] for user in user_locations], [user['lat'] for user in user_locations],
+        [stations[i]['x'] for i in known], [stations[i]['y'] for i in known])
+    estimated = estimate_transit_minutes(distances)
+    if CANDIDATE_ESTIMATOR == 'graph':
+        graph = get_subway_graph()
+        if graph is not None:
+            # 사용자마다 Dijkstra 한 번. 그래프로 닿지 않는 칸은 직선거리 추정값을 그대로 쓴다
+            candidates = [stations[i] for i in known]
+            for u, user in enumerate(user_locations):
+                for j, minutes in enumerate(graph.minutes_from(user['lon'], user['lat'], candidates)):
+                    if minutes is not None:
+                        estimated[u, j] = minutes
+    total_minutes = estimated.sum(axis=0)
+    time_range = (total_minutes.max() - total_minutes.min()) or 1
+    scores = np.array([factor_scores[i] for i in known]) + (1 - (total_minutes - total_minutes.min()) / time_range) * 2
+    top = np.argsort(-scores, kind='stable')[:k]
+    return [stations[known[i]] for i in top], [factor_scores[known[i]] for i in top]
+
+def rank_candidates_by_factors(stations, factors):
+    # 후보역을 factors 조합의 가중 팩터 점수 내림차순으로 늘어놓는다 (미리 정렬해 둔 순위로). DB에 없는 역은 뺀다
+    rankings = get_factor_rankings()
+    indices = rankings.table.indices_of(stations)
+    known = np.flatnonzero(indices >= 0)
+    ordered = known[rankings.argsort(indices[known], factors)]
+    return [stations[i] for i in ordered], rankings.scores_of(indices[ordered], factors).tolist()
+
+def select_candidates(stations, factors, user_locations):
+    # -> 조회할 (후보역, 팩터 점수). 앞 역부터 조회한다
+    if CANDIDATE_STRATEGY == 'threshold':
+        return rank_candidates_by_factors(stations, factors)
+    return prune_candidates(stations, station_factor_scores(stations, factors), user_locations)
+
+def rank_stations(station_scores, top_n=3):
+    # station_scores: [(station, factor_score, total_transit_time)]
+    # 최종 점수 = 팩터 점수 + 정규화한 소요시간 점수(0~2, 짧을수록 높음)
+    transit_times = [transit_time for _, _, transit_time in station_scores if transit_time != float('inf')]
+    if not transit_times:
+        return []
+    max_time = max(transit_times)
+    min_time = min(transit_times)
+    logger.debug("maxtime:%s, mintime:%s", max_time, min_time)
+    time_range = (max_time - min_time) or 1
+
+    final_station_scores=[]
+    for (station, station_score, transit_time) in station_scores:
+        if(transit_time != float('inf')):
+            final_station_scores.append((station, station_score + (1-((transit_time - min_time)/time_range)) * 2))
+
+    final_station_scores.sort(key=lambda x: x[1],reverse=True)
+    return [station for station, score in final_station_scores[:top_n]]
+
+def estimate_transit_times(stations, user_locations, pairs):
+    # 마감까지 받지 못한 (역, 사용자) 칸의 추정 소요시간(분) -> {(i, u): 분}.
+    # 노선 그래프가 있으면 그 값, 없거나 닿지 않으면 후보역을 줄일 때와 같은 직선거리 추정
+    graph = get_subway_graph()
+    by_user = {}
+    for i, u in pairs:
+        by_user.setdefault(u, []).append(i)
+    estimates = {}
+    for u, indices in by_user.items():
+        user = user_locations[u]
+        targets = [stations[i] for i in indices]
+        graph_minutes = graph.minutes_from(user['lon'], user['lat'], targets) if graph is not None else [None] * len(targets)
+        distances = haversine_matrix([user['lon']], [user['lat']],
+                                     [station['x'] for station in targets], [station['y'] for station in targets])[0]
+        for i, minutes, distance in zip(indices, graph_minutes, distances):
+            estimates[(i, u)] = minutes if minutes is not None else max(float(estimate_transit_minutes(distance)), 1.0)
+    return estimates
+
+def fill_estimated_times(ranker, stations, user_locations, received):
+    # 아직 순위가 정해지지 않은 역의 받지 못한 칸을 추정값으로 채운다 -> 채운 (i, u) 집합
+    missing = [(i, u) for i in range(len(stations)) if not ranker.is_settled(i)
+               for u in range(len(user_locations)) if (i, u) not in received]
+    if not missing:
+        return set()
+    logger.warning("Transit deadline exceeded. Estimating %d transit times.", len(missing))
+    metrics.count('estimated_pairs', len(missing))
+    for (i, u), minutes in estimate_transit_times(stations, user_locations, missing).items():
+        ranker.add(i, minutes, u)
+    return set(missing)
+
+def with_estimated_locations(best_stations, stations, estimated):
+    # 결과 역마다 소요시간을 추정값으로 채운 출발지(locations 순서) 목록을 붙인다
+    positions = {station['station_name']: i for i, station in enumerate(stations)}
+    return [
+        dict(station, estimated_locations=sorted(u for i, u in estimated if i == positions[station['station_name']]))
+        for station in best_stations
+    ]
+
+def find_best_station(stations, user_locations, factors, deadline=None):
+    # deadline(deadlines.Deadline)이 지나면 그때까지 받은 소요시간으로 순위를 매긴다 (받지 못한 칸은 추정값)
+    try:
+        with metrics.span('scoring'):
+            stations, factor_scores = select_candidates(stations, factors, user_locations)
+    except ValueError as e:
+        logger.warning("Error processing stations: %s", e)
+        return None
+    if not stations:
+        return []
+
+    ranker = StreamingRanker(stations, factor_scores, len(user_locations),
+                             lower_bounds=transit_lower_bounds(stations, user_locations))
+
+    def fetch_transit_time_for_station(i, user_location):
+        # 큐에서 기다리는 사이 걸러진 역이면 호출하지 않는다
+        if ranker.is_pruned(i):
+            return SKIPPED
+        if expired(deadline):
+            raise DeadlineExceeded()
+        station = stations[i]
+        return get_transit_time(user_location['lon'], user_location['lat'], station['x'], station['y'], deadline=deadline)
+
+    try:
+        # 앞 순위(추정 점수) 역부터 차례로 요청해서 먼저 끝난 역으로 나머지를 걸러낸다
+        max_workers = TRANSIT_FETCH_CONCURRENCY or len(stations) * len(user_locations)
+        # 마감 뒤에 남은 호출을 기다리지 않도록 with 대신 shutdown(wait=False)로 닫는다
+        executor = ThreadPoolExecutor(max_workers=max_workers)
         try:
-            total_transit_time = 0
-            with ThreadPoolExecutor(max_workers=len(user_locations)) as executor:
+            with metrics.span('transit'):
+                # 격자 표/노선 그래프로 구한 칸은 바로 넣고 나머지만 조회한다
+                known = precomputed_transit_times(stations, user_locations)
+                for (i, u), transit_time in known.items():
+                    ranker.add(i, transit_time, u)
+                received = set(known)
                 futures = {
-                    executor.submit(fetch_transit_time_for_station, station, user): user
-                    for user in user_locations
+                    metrics.submit(executor, fetch_transit_time_for_station, i, user): (i, u)
+                    for i in range(len(stations))
+                    for u, user in enumerate(user_locations)
+                    if (i, u) not in known and not ranker.is_settled(i)
                 }
-                
-                for future in as_completed(futures):
-                    try:
-                        transit_time = future.result()
-                        if transit_time:
-                            total_transit_time += transit_time
-                        else:
-                            total_transit_time += float('inf')
-                    except Exception as e:
-                        print(f"Exception occurred: {e}")
-
-            station_obj = Station.objects.get(station_name=station['station_name'])
-            
-            final_score = 1.0
-            factors_process=[]
-            if factors == None:
-                factors_process=[2,3,4,5,6,7]
-            else: 
-                factors_process=factors
-            for factor in factors_process:
-                factor_attr = f'factor_{factor}'
-                factor_value = getattr(station_obj, factor_attr, 0)
-                final_score += factor_value * factor_weights[factor]
-                
-
-            print(f'station:{station}, final_score:{final_score}, total_transit_time:{total_transit_time}')
-            return (station, final_score, total_transit_time)
-
-        except Exception as e:
-            print(f"Error processing station {station['station_name']}: {e}")
-            return (station, float(0), float('inf'))
-
-    try:
-        with ThreadPoolExecutor(max_workers=len(stations)) as station_executor:
-            station_futures = {station_executor.submit(process_station, station): station for station in stations}
-            transit_times = []
-            for future in as_completed(station_futures):
-                station, station_score, transit_time = future.result()
-                station_scores.append((station, station_score, transit_time))
-                if(transit_time != float('inf')) :
-                    transit_times.append(transit_time)
-                    print(transit_time)
-        
-        max_time = max(transit_times)
-        min_time = min(transit_times)
-        print(f'maxtime:{max_time}, mintime:{min_time}')
-        # print('!!!!!!!!'+max_time+', '+ min_time + '!!!!!!!!')
-        final_station_scores=[]
-        for (station, station_score, transit_time) in station_scores:
-            if(transit_time != float('inf')):
-                final_station_scores.append((station, station_score + (1-((transit_time - min_time)/(max_time-min_time))) * 2))
-                print(final_station_scores)
-        
-        final_station_scores.sort(key=lambda x: x[1],reverse=True)
-        return [station for station, score in final_station_scores[:3]]
+                try:
+                    while futures:
+                        for future in as_completed(futures, timeout=remaining(deadline)):
+                            if future.cancelled():
+                                continue
+                            i, u = futures[future]
+                            try:
+                                transit_time = future.result()
+                            except DeadlineExceeded:
+                                continue
+                            except Exception as e:
+                                logger.warning("Exception occurred: %s", e)
+                                metrics.count('transit_fallbacks')
+                                transit_time = TRANSIT_FALLBACK_MINUTES
+                            if transit_time is SKIPPED:
+                                continue
+                            received.add((i, u))
+                            for pruned in ranker.add(i, transit_time, u):
+                                logger.debug("Pruned station %s", stations[pruned]['station_name'])
+                                for other, (j, _) in futures.items():
+                                    if j == pruned:
+                                        other.cancel()
+                            if ranker.done():
+                                break
+                        # 걸러낸 역의 소요시간이 모자라 순위가 달라질 수 있으면 그 역들의 나머지 칸을 마저 조회한다
+                        reopened = set(ranker.reopen_if_unstable()) if ranker.done() else set()
+                        futures = {future: pair for future, pair in futures.items()
+                                   if not future.done() and pair[0] in reopened}
+                        waiting = set(futures.values())
+                        futures.update({
+                            metrics.submit(executor, fetch_transit_time_for_station, i, user): (i, u)
+                            for i in sorted(reopened)
+                            for u, user in enumerate(user_locations)
+                            if (i, u) not in received and (i, u) not in waiting
+                        })
+                except FuturesTimeoutError:
+                    pass
+                estimated = fill_estimated_times(ranker, stations, user_locations, received)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        with metrics.span('scoring'):
+            return with_estimated_locations(rank_stations(ranker.station_scores()), stations, estimated)
 
     except Exception as e:
-        print(f"Error processing stations: {e}")
+        logger.warning("Error processing stations: %s", e)
 
 # def find_best_station(stations, user_locations, factors):
 #     station_scores = []
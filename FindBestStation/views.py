@@ -1,101 +1,129 @@
-from django.http import JsonResponse
+import asyncio
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.response import Response
-from .utils import calculate_midpoint, find_nearest_stations_kakao, find_best_station
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import os
-from dotenv import load_dotenv
+from .utils import calculate_midpoint, find_nearest_stations, find_best_station
+from . import async_pipeline, batch
+from asgiref.sync import sync_to_async
+from CGPT.explanations import explanation_service, normalize_factors
+from .station_table import FACTOR_IDS, refresh_station_table
+from .cache import RESULT_CACHE_MAX_AGE, result_cache
+from .deadlines import Deadline
+from .sessions import rank_session, session_candidates, session_store
+from .singleflight import AsyncSingleFlight, SingleFlight
+from . import metrics
 import json
-from FindBestStation.models import Station  # Station 모델을 정의한 곳으로 경로를 수정해야 합니다.
-
-def load_stations_from_json(json_file):
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-        for entry in data:
-            fields = entry['fields']
-            station_code = fields['station_code']
-            station_name = fields['station_name']
-            x = fields['x']
-            y = fields['y']
-            factor_2 = fields['factor_2']
-            factor_3 = fields['factor_3']
-            factor_4 = fields['factor_4']
-            factor_5 = fields['factor_5']
-            factor_6 = fields['factor_6']
-            factor_7 = fields['factor_7']
-
-            # 이미 존재하는 역인지 확인
-            if Station.objects.filter(station_code=station_code).exists():
-                print(f"Station with code {station_code} already exists. Skipping...")
-                continue
-
-            # Station 객체 생성 및 저장
-            station = Station.objects.create(
-                station_code=station_code,
-                station_name=station_name,
-                x=x,
-                y=y,
-                factor_2=factor_2,
-                factor_3=factor_3,
-                factor_4=factor_4,
-                factor_5=factor_5,
-                factor_6=factor_6,
-                factor_7=factor_7
-            )
-
-            print(f"Station {station_name} created successfully.")
-
-# JSON 파일 경로
-json_file_path = 'factor.json'
-
-# JSON 데이터를 Django 모델에 로드
-load_stations_from_json(json_file_path)
-
-load_dotenv()
-KAKAO_API_KEY = os.getenv("KAKAO_API_KEY")
-
-FORMAT = "json"
-search_url = f"https://dapi.kakao.com/v2/local/search/keyword.{FORMAT}"
-transcoord_url = f"https://dapi.kakao.com/v2/local/geo/transcoord.{FORMAT}"
-
-def process_station_requests(best_station, factors):
-    if factors:
-        factors_query = '&'.join([f'factor={factor}' for factor in factors])
-        base_url = "http://ec2-52-64-207-15.ap-southeast-2.compute.amazonaws.com:8080/api/CGPT/query"
-        redirect_url_pc = f"{base_url}/?station_name={best_station['station_name']}&{factors_query}&view_type='pc'"
-        redirect_url_mobile = f"{base_url}/?station_name={best_station['station_name']}&{factors_query}&view_type='mobile'"
-    else:
-        base_url = "http://ec2-52-64-207-15.ap-southeast-2.compute.amazonaws.com:8080/api/CGPT/query"
-        redirect_url_pc = f"{base_url}/?station_name={best_station['station_name']}&view_type='pc'"
-        redirect_url_mobile = f"{base_url}/?station_name={best_station['station_name']}&view_type='mobile'"
-        
-    def fetch_url(url):
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e)}
+import logging
+
+logger = logging.getLogger(__name__)
 
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        future_pc = executor.submit(fetch_url, redirect_url_pc)
-        future_mobile = executor.submit(fetch_url, redirect_url_mobile)
+# 같은 그룹이 링크를 같이 열어서 같은 요청이 동시에 들어오면 한 번만 계산한다 (키는 결과 캐시 키)
+request_flight = SingleFlight('request')
+async_request_flight = AsyncSingleFlight('request')
 
-        chatgpt_response_pc = future_pc.result()
-        chatgpt_response_mobile = future_mobile.result()
 
+def station_result(best_station, factors, chatgpt_response_pc, chatgpt_response_mobile):
     return {
         "station_name": best_station['station_name'],
         "coordinates": {"lon": best_station['x'], "lat": best_station['y']},
         "factors": factors,
+        # 마감(REQUEST_BUDGET_SECONDS)까지 소요시간을 받지 못해 추정값으로 순위를 매긴 출발지(locations 순서)
+        "estimated_locations": best_station.get('estimated_locations', []),
         "chatgpt_response_pc": chatgpt_response_pc,
         "chatgpt_response_mobile": chatgpt_response_mobile
     }
 
+def station_results(best_stations, factors, explanations):
+    return [
+        station_result(best_station, factors,
+                       explanations[(best_station['station_name'], 'pc')],
+                       explanations[(best_station['station_name'], 'mobile')])
+        for best_station in best_stations
+    ]
+
+def process_station_requests(best_stations, factors):
+    # 설명은 프로세스 안에서 바로 만든다. 캐시에 없는 역/view_type은 한 번의 호출로 같이 만든다
+    with metrics.span('explanation'):
+        explanations = explanation_service.explain_many([station['station_name'] for station in best_stations], factors)
+    return station_results(best_stations, factors, explanations)
+
+async def process_station_requests_async(best_stations, factors):
+    with metrics.span('explanation'):
+        explanations = await sync_to_async(explanation_service.explain_many, thread_sensitive=False)(
+            [station['station_name'] for station in best_stations], factors)
+    return station_results(best_stations, factors, explanations)
+
+class MeetupError(Exception):
+    # 중간 지점/후보역/최적 역을 찾지 못했을 때. 같은 계산을 기다리던 요청도 같은 에러를 받는다
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+    def response(self):
+        return JsonResponse({'error': self.message}, status=self.status)
+
+def has_explanation_errors(results):
+    # GPT 설명이 실패한 결과는 캐시하지 않는다
+    return any('error' in result[f'chatgpt_response_{view_type}']
+               for result in results for view_type in ('pc', 'mobile'))
+
+def has_estimated_times(results):
+    # 추정 소요시간이 들어간 결과도 캐시하지 않는다 (다음 요청은 다시 조회해 본다)
+    return any(result['estimated_locations'] for result in results)
+
+def is_cacheable(results):
+    return not has_explanation_errors(results) and not has_estimated_times(results)
+
+def result_cache_key(locations, factors):
+    # 다른 프로세스에서 역 데이터가 바뀌었으면 테이블을 다시 읽어서 버전(키)이 바뀐다
+    return result_cache.key(locations, factors, refresh_station_table().version)
+
+def cacheable_response(request, response, etag):
+    # GET 요청이면 CDN/브라우저가 같은 요청을 받아낼 수 있도록 ETag와 Cache-Control을 붙인다
+    if request.method != 'GET' or etag is None:
+        return response
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        response = not_modified
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=RESULT_CACHE_MAX_AGE)
+    return response
+
+def parse_meetup_params(method, data):
+    # POST: JSON body, GET: ?locations=lon,lat&factors=n
+    if method == 'POST':
+        locations = [{'lon': loc['lon'], 'lat': loc['lat']} for loc in data.get('locations', [])]
+        factors = [int(factor) for factor in data.get('factors', [])]
+    else:
+        locations = [tuple(map(float, loc.split(','))) for loc in data.getlist('locations')]
+        locations = [{'lon': lon, 'lat': lat} for lon, lat in locations]
+        factors = [int(factor) for factor in data.getlist('factors')]
+    return locations, factors
+
+def meetup_params_error(locations, factors):
+    # 잘못된 요청이면 에러 메시지, 아니면 None
+    if not locations or len(locations) < 2 or len(locations) > 5:
+        return '2 to 5 locations must be provided.'
+
+    if len(factors) > 6:
+        return 'Up to 6 factors can be provided.'
+
+    if any(factor not in FACTOR_IDS for factor in factors):
+        return 'Factors must be between 2 and 7.'
+    return None
+
+def validate_meetup_params(locations, factors):
+    error = meetup_params_error(locations, factors)
+    if error is not None:
+        return JsonResponse({'error': error}, status=400)
+    return None
+
 
 @swagger_auto_schema(
     method='post',
@@ -134,6 +162,11 @@ def process_station_requests(best_station, factors):
                         'lat': openapi.Schema(type=openapi.TYPE_NUMBER, description='Latitude'),
                     },
                 ),
+                'estimated_locations': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                    description='Indexes of locations whose transit time was estimated after the deadline',
+                ),
             }
         ),
         400: 'Invalid coordinates or unable to process',
@@ -143,65 +176,305 @@ def process_station_requests(best_station, factors):
 
 @api_view(['POST', 'GET'])
 def find_optimal_station(request):
-    if request.method == 'POST':
-        locations = request.data.get('locations', [])
-        factors = request.data.get('factors', [])
-        try:
-            locations = [{'lon': loc['lon'], 'lat': loc['lat']} for loc in locations]
-            factors = [int(factor) for factor in factors]
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=400)
-    elif request.method == 'GET':
-        locations = request.query_params.getlist('locations')
-        factors = request.query_params.getlist('factors')
-        # Convert locations and factors to appropriate types
-        try:
-            locations = [tuple(map(float, loc.split(','))) for loc in locations]
-            locations = [{'lon': lon, 'lat': lat} for lon, lat in locations]
-            factors = [int(factor) for factor in factors]
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=400)
+    data = request.data if request.method == 'POST' else request.query_params
+    try:
+        locations, factors = parse_meetup_params(request.method, data)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-    print(f"locations: {locations}")
-    print(f"factors: {factors}")
+    logger.debug("locations: %s, factors: %s", locations, factors)
 
-    if not locations or len(locations) < 2 or len(locations) > 5:
-        return JsonResponse({'error': '2 to 5 locations must be provided.'}, status=400)
+    error_response = validate_meetup_params(locations, factors)
+    if error_response is not None:
+        return error_response
+
+    # 같은 출발지(격자 단위)와 팩터 조합이면 저장해 둔 결과를 그대로 쓴다
+    cache_key = result_cache_key(locations, factors)
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        try:
+            cached = request_flight.do(cache_key, find_meetup_results, locations, factors, cache_key)
+        except MeetupError as e:
+            return e.response()
+    results, etag = cached
+    return cacheable_response(request, Response({"best_stations": results}), etag)
 
-    if len(factors) > 6:
-        return JsonResponse({'error': 'Up to 6 factors can be provided.'}, status=400)
 
+def find_meetup_results(locations, factors, cache_key):
+    # -> (결과, ETag). 결과 캐시에 넣을 수 없는 결과면 ETag는 None
+    deadline = Deadline.after()
     midpoint = calculate_midpoint(locations)
     if midpoint == (0, 0):
-        return JsonResponse({'error': 'Midpoint is not within 20km of Seoul and cannot be adjusted to a Seoul location.'}, status=400)
-    print(f'midpoint: {midpoint}')
+        raise MeetupError('Midpoint is not within 20km of Seoul and cannot be adjusted to a Seoul location.', 400)
+    logger.debug("midpoint: %s", midpoint)
 
     # Step 3: 중간 지점에서 20km 반경의 지하철역 확인
-    nearest_stations = find_nearest_stations_kakao(midpoint)
+    nearest_stations = find_nearest_stations(midpoint)
     if not nearest_stations:
-        return JsonResponse({'error': 'No nearby stations found.'}, status=404)
+        raise MeetupError('No nearby stations found.', 404)
 
     # Step 4: 최적의 장소를 팩터로 가중치 세워서 정리. 
-    print("--------------------------------")
-    print(f"nearest_stations: {nearest_stations}")
-    # print(f"locations: {locations}")
-    # print(f"factors: {factors}")
-    print("--------------------------------")
+    logger.debug("nearest_stations: %s", nearest_stations)
     
-    best_stations = find_best_station(nearest_stations, locations, factors)
+    best_stations = find_best_station(nearest_stations, locations, factors, deadline)
+    if not best_stations:
+        raise MeetupError("No optimal station found", 404)
 
-    if best_stations:
-        results = []
+    results = process_station_requests(best_stations, factors)
+    etag = result_cache.set(cache_key, results) if is_cacheable(results) else None
+    return results, etag
 
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [
-                executor.submit(process_station_requests, best_station, factors)
-                for best_station in best_stations
-            ]
-            for future in as_completed(futures):
-                results.append(future.result())
 
-        return Response({"best_stations": results})
-    else:
-        return Response({"error": "No optimal station found"}, status=404)
-    
\ No newline at end of file
+
+def parse_meetup_request(request):
+    # 요청 -> (locations, factors). 잘못된 요청이면 에러 JsonResponse
+    try:
+        data = json.loads(request.body or b'{}') if request.method == 'POST' else request.GET
+        locations, factors = parse_meetup_params(request.method, data)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    error_response = validate_meetup_params(locations, factors)
+    if error_response is not None:
+        return error_response
+    return locations, factors
+
+
+async def route_meetup_async(locations, factors):
+    # -> best_stations. 역을 못 찾으면 MeetupError
+    deadline = Deadline.after()
+    midpoint = await async_pipeline.calculate_midpoint_async(locations)
+    if midpoint == (0, 0):
+        raise MeetupError('Midpoint is not within 20km of Seoul and cannot be adjusted to a Seoul location.', 400)
+
+    nearest_stations = await async_pipeline.find_nearest_stations_async(midpoint)
+    if not nearest_stations:
+        raise MeetupError('No nearby stations found.', 404)
+
+    best_stations = await async_pipeline.find_best_station_async(nearest_stations, locations, factors, deadline)
+    if not best_stations:
+        raise MeetupError("No optimal station found", 404)
+    return best_stations
+
+
+async def find_meetup_results_async(locations, factors, cache_key):
+    best_stations = await route_meetup_async(locations, factors)
+    results = await process_station_requests_async(best_stations, factors)
+    etag = None
+    if is_cacheable(results):
+        etag = await sync_to_async(result_cache.set, thread_sensitive=False)(cache_key, results)
+    return results, etag
+
+
+# ASGI(asgi.py)로 띄웠을 때 쓰는 비동기 버전. 스레드 풀 없이 이벤트 루프 하나에서 외부 API를 동시에 호출한다.
+@csrf_exempt
+@require_http_methods(['POST', 'GET'])
+async def find_optimal_station_async(request):
+    parsed = parse_meetup_request(request)
+    if isinstance(parsed, JsonResponse):
+        return parsed
+    locations, factors = parsed
+
+    # 역 테이블을 처음 만들 때만 DB를 읽는다
+    cache_key = await sync_to_async(result_cache_key)(locations, factors)
+    cached = await sync_to_async(result_cache.get, thread_sensitive=False)(cache_key)
+    if cached is None:
+        try:
+            cached = await async_request_flight.do(cache_key, find_meetup_results_async, locations, factors, cache_key)
+        except MeetupError as e:
+            return e.response()
+    results, etag = cached
+    return cacheable_response(request, JsonResponse({"best_stations": results}, json_dumps_params={'ensure_ascii': False}), etag)
+
+
+# 여러 그룹을 한 번에: {"groups": [{"locations": [...], "factors": [...]}, ...]}
+# 그룹 전체에서 겹치지 않는 출발지/중간 지점/(출발지, 역) 구간만 한 번씩 조회한다.
+# 결과는 요청한 그룹 순서대로 {"best_stations": [...]} 또는 {"error": ..., "status": ...}
+@csrf_exempt
+@require_http_methods(['POST'])
+async def find_optimal_stations_batch(request):
+    try:
+        groups = json.loads(request.body or b'{}').get('groups')
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not isinstance(groups, list) or not groups:
+        return JsonResponse({'error': 'groups must be a non-empty list.'}, status=400)
+    if len(groups) > batch.BATCH_MAX_GROUPS:
+        return JsonResponse({'error': f'Up to {batch.BATCH_MAX_GROUPS} groups can be provided.'}, status=400)
+
+    batch_groups = []
+    for data in groups:
+        try:
+            locations, factors = parse_meetup_params('POST', data)
+        except Exception as e:
+            locations, factors, error = [], [], str(e)
+        else:
+            error = meetup_params_error(locations, factors)
+        group = batch.BatchGroup(locations, factors)
+        if error is not None:
+            group.fail(error, 400)
+        batch_groups.append(group)
+
+    valid = [group for group in batch_groups if group.error is None]
+    stats = await batch.find_best_stations_batch(valid)
+    explanations = await batch.explain_batch(valid)
+
+    results = []
+    for group in batch_groups:
+        if group.error is not None:
+            results.append({'error': group.error, 'status': group.status})
+        else:
+            group_explanations = explanations[normalize_factors(group.factors)]
+            results.append({'best_stations': station_results(group.best_stations, group.factors, group_explanations)})
+    return JsonResponse({'results': results, 'stats': stats}, json_dumps_params={'ensure_ascii': False})
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_station_results(best_stations, factors):
+    # 1) 순위가 정해진 역 목록을 바로 보내고 2) 역마다 설명이 만들어지는 대로 보낸다
+    yield sse_event('stations', {"best_stations": [
+        {
+            "station_name": best_station['station_name'],
+            "coordinates": {"lon": best_station['x'], "lat": best_station['y']},
+            "factors": factors,
+            "estimated_locations": best_station.get('estimated_locations', []),
+        }
+        for best_station in best_stations
+    ]})
+
+    # 역 하나의 pc/mobile 설명은 한 번의 호출로 같이 만든다 (캐시에 있으면 바로 끝난다)
+    explain_many = sync_to_async(explanation_service.explain_many, thread_sensitive=False)
+    tasks = [asyncio.ensure_future(explain_many([best_station['station_name']], factors))
+             for best_station in best_stations]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            explanations = await next_done
+            for (station_name, view_type), response in explanations.items():
+                yield sse_event('explanation', {
+                    "station_name": station_name,
+                    "view_type": view_type,
+                    f"chatgpt_response_{view_type}": response,
+                })
+    finally:
+        for task in tasks:
+            task.cancel()
+    yield sse_event('done', {})
+
+
+# find_optimal_station_async의 Server-Sent Events 버전.
+# 역 순위를 먼저 보내고(stations) 설명은 만들어지는 대로(explanation) 보낸 뒤 done으로 끝낸다.
+# ASGI 서버에서만 이벤트가 나눠서 나간다. WSGI에서는 Django가 스트림을 끝까지 모아서 한 번에 보낸다 (gunicorn.conf.py 참고)
+@csrf_exempt
+@require_http_methods(['POST', 'GET'])
+async def find_optimal_station_stream(request):
+    parsed = parse_meetup_request(request)
+    if isinstance(parsed, JsonResponse):
+        return parsed
+    locations, factors = parsed
+
+    try:
+        best_stations = await route_meetup_async(locations, factors)
+    except MeetupError as e:
+        return e.response()
+
+    response = StreamingHttpResponse(stream_station_results(best_stations, factors),
+                                     content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # nginx가 응답을 모아서 보내지 않도록
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def apply_session_changes(session, data):
+    # 빼는 출발지의 번호는 지금 locations 순서이므로 빼기를 먼저 한다
+    if 'remove_locations' in data:
+        session.remove_locations([int(index) for index in data['remove_locations']])
+    if 'add_locations' in data:
+        locations, _ = parse_meetup_params('POST', {'locations': data['add_locations']})
+        session.add_locations(locations)
+    if 'factors' in data:
+        session.factors = [int(factor) for factor in data['factors']]
+
+
+def find_session_results(session, deadline):
+    # 출발지가 바뀌었을 때만 중간 지점과 후보역을 다시 찾는다. 팩터만 바뀌면 외부 호출 없이 순위만 다시 매긴다
+    if session.stations is None:
+        midpoint = calculate_midpoint(session.locations)
+        if midpoint == (0, 0):
+            raise MeetupError('Midpoint is not within 20km of Seoul and cannot be adjusted to a Seoul location.', 400)
+        nearest_stations = find_nearest_stations(midpoint)
+        if not nearest_stations:
+            raise MeetupError('No nearby stations found.', 404)
+        session.set_stations(session_candidates(nearest_stations, session.locations))
+
+    best_stations = rank_session(session, deadline)
+    if not best_stations:
+        raise MeetupError("No optimal station found", 404)
+    return process_station_requests(best_stations, session.factors)
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_description="재검색 세션. session_id 없이 locations/factors를 보내면 세션을 만들고, "
+                          "session_id와 바뀐 내용(add_locations, remove_locations, factors)만 보내면 "
+                          "남겨둔 소요시간을 다시 써서 순위를 매긴다",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'session_id': openapi.Schema(type=openapi.TYPE_STRING, description='Session to update'),
+            'locations': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                                        description='Initial coordinates (new session)'),
+            'add_locations': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT),
+                                            description='Coordinates to add'),
+            'remove_locations': openapi.Schema(type=openapi.TYPE_ARRAY,
+                                               items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                                               description='Indexes of locations to remove'),
+            'factors': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                                      description='Factors to consider for scoring (replaces the current ones)'),
+        },
+    ),
+    responses={
+        200: openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'session_id': openapi.Schema(type=openapi.TYPE_STRING),
+                'locations': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+                'factors': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                'best_stations': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_OBJECT)),
+            }
+        ),
+        400: 'Invalid coordinates or unable to process',
+        404: 'Session expired or no optimal station found',
+    }
+)
+
+@api_view(['POST'])
+def meetup_session(request):
+    data = request.data
+    try:
+        if data.get('session_id'):
+            session = session_store.get(str(data['session_id']))
+            if session is None:
+                return JsonResponse({'error': 'Session not found or expired.'}, status=404)
+            apply_session_changes(session, data)
+        else:
+            locations, factors = parse_meetup_params('POST', data)
+            session = session_store.create(locations, factors)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    error_response = validate_meetup_params(session.locations, session.factors)
+    if error_response is not None:
+        return error_response
+
+    try:
+        results = find_session_results(session, Deadline.after())
+    except MeetupError as e:
+        return e.response()
+    # 실패한 변경은 세션에 남기지 않는다
+    session_store.save(session)
+    return Response({"session_id": session.id, "locations": session.locations, "factors": session.factors,
+                     "best_stations": results})
@@ -56,6 +56,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 가장 바깥에서 요청 전체 시간을 잰다 (Server-Timing 헤더, /metrics)
+    'FindBestStation.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -105,6 +107,81 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'WhereShallWeMeet.wsgi.application'
 
+# Cache
+# transit: ODsay 소요시간 캐시 (DB 테이블이라 재시작 후에도 유지되고 워커끼리 공유된다.
+#          파일 기반 캐시는 set()마다 디렉터리 전체를 훑어 항목 수를 세므로 항목이 많은 이 캐시에는 쓰지 않는다.
+#          처음 한 번 python manage.py createcachetable)
+# explanations: 역 GPT 설명 캐시 (pregenerate_explanations로 미리 채운다)
+# results: find_optimal_station 응답 캐시 (키에 역 데이터 버전이 들어간다)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'transit': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': env('TRANSIT_CACHE_TABLE', default='transit_cache'),
+        'TIMEOUT': env.int('TRANSIT_CACHE_TTL', default=7 * 24 * 3600),
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('TRANSIT_CACHE_MAX_ENTRIES', default=100000),
+        },
+    },
+    'explanations': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('EXPLANATION_CACHE_LOCATION', default=str(BASE_DIR / '.cache' / 'explanations')),
+        'TIMEOUT': env.int('EXPLANATION_CACHE_TTL', default=30 * 24 * 3600),
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('EXPLANATION_CACHE_MAX_ENTRIES', default=100000),
+        },
+    },
+    'results': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('RESULT_CACHE_LOCATION', default=str(BASE_DIR / '.cache' / 'results')),
+        'TIMEOUT': env.int('RESULT_CACHE_TTL', default=3600),
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('RESULT_CACHE_MAX_ENTRIES', default=10000),
+        },
+    },
+    'meetup_sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('MEETUP_SESSION_CACHE_LOCATION', default=str(BASE_DIR / '.cache' / 'meetup_sessions')),
+        'TIMEOUT': env.int('MEETUP_SESSION_TTL', default=30 * 60),
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('MEETUP_SESSION_CACHE_MAX_ENTRIES', default=10000),
+        },
+    },
+}
+
+# Logging
+# LOG_LEVEL=DEBUG로 단계별 소요시간, 걸러진 후보역 같은 상세 로그를 본다
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '{asctime} {levelname} {name}: {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'FindBestStation': {
+            'handlers': ['console'],
+            'level': env('LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+        'CGPT': {
+            'handlers': ['console'],
+            'level': env('LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 # Password validation
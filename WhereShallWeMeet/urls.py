@@ -21,6 +21,7 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from CGPT.views import QueryView
+from FindBestStation.metrics import metrics_view
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -41,4 +42,5 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('api/FindBestStation/', include('FindBestStation.urls')),
+    path('metrics', metrics_view, name='metrics'),  # Prometheus 수집용 (워커별 값)
 ]
@@ -0,0 +1,409 @@
+"""find_optimal_station 벤치마크.
+
+외부 API(Kakao, ODsay, OpenAI) 대신 로컬 스텁 서버(benchmarks/stubs.py)를 별도 프로세스로 띄우고,
+사용자 수 x 후보역 수 x 동시 요청 수 조합마다 요청을 보내서
+p50/p95/p99 지연, 처리량, 스레드 수, 최대 RSS, 요청당 외부 API 호출 수를 JSON으로 남긴다.
+
+    python -m benchmarks.run --requests 50 --output benchmarks/results/latest.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATION_JSON_FILE = os.path.join(BASE_DIR, 'factor.json')
+ENDPOINTS = {'sync': 'find_optimal_station', 'async': 'find_optimal_station_async'}
+UPSTREAMS = ('kakao', 'odsay', 'openai')
+
+logger = logging.getLogger(__name__)
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', default='sync', help="쉼표로 구분: sync, async")
+    parser.add_argument('--groups', type=parse_int_list, default=[2, 3, 5], help='사용자 수 (2~5)')
+    parser.add_argument('--candidates', type=parse_int_list, default=[5, 15],
+                        help='소요시간을 조회할 후보역 수 (CANDIDATE_PRUNE_K)')
+    parser.add_argument('--search-k', type=int, default=15, help='중간 지점 주변에서 찾는 역 수 (STATION_SEARCH_K)')
+    parser.add_argument('--concurrency', type=parse_int_list, default=[1, 8], help='동시 요청 수')
+    parser.add_argument('--requests', type=int, default=30, help='시나리오마다 보낼 요청 수')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep-caches', action='store_true', help='시나리오 사이에 소요시간/설명/결과 캐시를 비우지 않는다')
+    parser.add_argument('--kakao-latency', default='lognormal:40,0.3')
+    parser.add_argument('--odsay-latency', default='lognormal:150,0.4')
+    parser.add_argument('--openai-latency', default='lognormal:1200,0.3')
+    parser.add_argument('--kakao-error-rate', type=float, default=0.0)
+    parser.add_argument('--odsay-error-rate', type=float, default=0.01)
+    parser.add_argument('--odsay-quota-rate', type=float, default=0.0)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--odsay-keys', type=int, default=8, help='가짜 ODSAY_API_KEYn 개수')
+    parser.add_argument('--output', help='결과 JSON 파일')
+    parser.add_argument('--compare', help='비교할 기준(baseline) JSON 파일')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='p95 지연 또는 요청당 외부 호출 수가 기준보다 이 비율 넘게 나빠지면 종료 코드 1 (예: 0.2)')
+    return parser
+
+
+# --- 스텁 서버 (별도 프로세스: 스레드 수/RSS 측정에 섞이지 않도록) ---
+
+def load_stations(path=STATION_JSON_FILE):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [entry['fields'] for entry in json.load(f)]
+
+
+def serve_stubs(config_specs, seed, ready):
+    from benchmarks.stubs import EndpointConfig, StubServer
+
+    configs = {name: EndpointConfig(**spec) for name, spec in config_specs.items()}
+    with StubServer(load_stations(), configs, seed=seed) as server:
+        ready.put(server.base_url)
+        server.thread.join()
+
+
+def fetch_stub_stats(base_url):
+    with urllib.request.urlopen(f'{base_url}/__stats') as response:
+        return json.loads(response.read())
+
+
+def start_stubs(args):
+    config_specs = {
+        'kakao': {'latency': args.kakao_latency, 'error_rate': args.kakao_error_rate},
+        'odsay': {'latency': args.odsay_latency, 'error_rate': args.odsay_error_rate,
+                  'quota_rate': args.odsay_quota_rate},
+        'openai': {'latency': args.openai_latency, 'error_rate': args.openai_error_rate},
+    }
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stubs, args=(config_specs, args.seed, ready), daemon=True)
+    process.start()
+    return process, ready.get(timeout=30), config_specs
+
+
+# --- Django 준비 ---
+
+def configure_environment(stub_url, args):
+    # 설정 값은 모듈을 import할 때 읽으므로 django.setup() 전에 정한다
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'WhereShallWeMeet.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['KAKAO_API_BASE'] = stub_url
+    os.environ['ODSAY_API_BASE'] = stub_url
+    os.environ['OPENAI_API_BASE'] = f'{stub_url}/v1'
+    os.environ['OPENAI_API_KEY'] = 'benchmark'
+    os.environ['KAKAO_API_KEY'] = 'benchmark'
+    for idx in range(1, args.odsay_keys + 1):
+        os.environ[f'ODSAY_API_KEY{idx}'] = f'benchmark-{idx}'
+    # 실제 서비스의 파일 캐시를 건드리지 않는다
+    os.environ['TRANSIT_CACHE_ALIAS'] = 'benchmark-none'
+    os.environ['EXPLANATION_CACHE_ALIAS'] = 'benchmark-none'
+    os.environ['RESULT_CACHE_ALIAS'] = 'benchmark-none'
+    sys.path.insert(0, BASE_DIR)
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from FindBestStation.loaders import load_stations_from_json
+
+    setup_test_environment()
+    test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+    load_stations_from_json(STATION_JSON_FILE)
+    return test_db
+
+
+def reset_state(keep_caches):
+    from CGPT.explanations import explanation_service
+    from FindBestStation import odsay_keys
+    from FindBestStation.cache import result_cache, transit_cache
+    from FindBestStation.deadlines import odsay_latency
+
+    # 호출 한도 초과로 꺼진 키와 헤징 지연을 정한 응답 시간을 다음 시나리오로 넘기지 않는다
+    odsay_keys._scheduler = None
+    odsay_latency.clear()
+    if not keep_caches:
+        transit_cache.local.clear()
+        transit_cache.failures.clear()
+        explanation_service.local.clear()
+        result_cache.clear()
+
+
+# --- 측정 ---
+
+class Sampler:
+    """실행 중 스레드 수와 RSS의 최댓값을 주기적으로 잰다."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak_threads = 0
+        self.peak_rss_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss_kb():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+        except (OSError, ValueError):
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _run(self):
+        while not self._stop.is_set():
+            # 샘플러 스레드 자신은 빼고 센다
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+            self.peak_rss_kb = max(self.peak_rss_kb, self.current_rss_kb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def random_payload(rng, group_size):
+    # 서울 도심 주변 임의의 출발지
+    return {
+        'locations': [{'lon': round(rng.uniform(126.85, 127.12), 6), 'lat': round(rng.uniform(37.47, 37.62), 6)}
+                      for _ in range(group_size)],
+        'factors': rng.sample([2, 3, 4, 5, 6, 7], rng.randint(0, 2)),
+    }
+
+
+def run_sync(url, payloads, concurrency):
+    from django.test import Client
+
+    local = threading.local()
+
+    def send(payload):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        started = time.perf_counter()
+        try:
+            status = client.post(url, data=payload, content_type='application/json').status_code
+        except Exception:
+            # 테스트 클라이언트는 뷰에서 난 예외를 그대로 올린다. 상태 코드 대신 crash로 따로 센다
+            logger.exception("Request to %s crashed", url)
+            status = None
+        return time.perf_counter() - started, status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(send, payloads))
+
+
+def run_async(url, payloads, concurrency):
+    from django.test import AsyncClient
+
+    async def main():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(payload):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    status = (await client.post(url, data=payload, content_type='application/json')).status_code
+                except Exception:
+                    logger.exception("Request to %s crashed", url)
+                    status = None
+                return time.perf_counter() - started, status
+
+        return await asyncio.gather(*(send(payload) for payload in payloads))
+
+    return asyncio.run(main())
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    idx = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[idx]
+
+
+def run_scenario(stub_url, endpoint, group_size, candidates, concurrency, args, rng):
+    from django.urls import reverse
+    from FindBestStation import utils
+
+    reset_state(args.keep_caches)
+    utils.STATION_SEARCH_K = args.search_k
+    utils.CANDIDATE_PRUNE_K = candidates
+    payloads = [random_payload(rng, group_size) for _ in range(args.requests)]
+    url = reverse(ENDPOINTS[endpoint])
+    runner = run_async if endpoint == 'async' else run_sync
+
+    before = fetch_stub_stats(stub_url)
+    with Sampler() as sampler:
+        started = time.perf_counter()
+        results = runner(url, payloads, concurrency)
+        wall = time.perf_counter() - started
+    after = fetch_stub_stats(stub_url)
+
+    latencies_ms = [seconds * 1000 for seconds, _ in results]
+    statuses = {}
+    for _, status in results:
+        if status is not None:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    n = len(results)
+    return {
+        'endpoint': endpoint,
+        'group_size': group_size,
+        'candidates': candidates,
+        'concurrency': concurrency,
+        'requests': n,
+        'statuses': statuses,
+        # 뷰에서 예외가 난 요청 수 (응답 없음)
+        'crashes': sum(1 for _, status in results if status is None),
+        'latency_ms': {
+            'p50': percentile(latencies_ms, 50),
+            'p95': percentile(latencies_ms, 95),
+            'p99': percentile(latencies_ms, 99),
+            'mean': statistics.fmean(latencies_ms) if latencies_ms else None,
+            'max': max(latencies_ms) if latencies_ms else None,
+        },
+        'throughput_rps': n / wall if wall else None,
+        'peak_threads': sampler.peak_threads,
+        'peak_rss_mb': round(sampler.peak_rss_kb / 1024, 1),
+        'upstream_calls_per_request': {
+            name: (after['calls'][name] - before['calls'][name]) / n for name in UPSTREAMS
+        },
+        'upstream_errors': {name: after['errors'][name] - before['errors'][name] for name in UPSTREAMS},
+    }
+
+
+# --- 결과 비교 ---
+
+def scenario_key(scenario):
+    return (scenario['endpoint'], scenario['group_size'], scenario['candidates'], scenario['concurrency'])
+
+
+def change(new, old):
+    if new is None or not old:
+        return None
+    return (new - old) / old
+
+
+def compare(results, baseline, max_regression=None):
+    """기준 결과와 비교해서 표를 출력하고, 허용치를 넘게 나빠진 시나리오 목록을 돌려준다."""
+    baseline_by_key = {scenario_key(s): s for s in baseline['scenarios']}
+    regressions = []
+    print(f"{'scenario':<28}{'p50 ms':>18}{'p95 ms':>18}{'rps':>16}{'calls/req':>18}")
+    for scenario in results['scenarios']:
+        old = baseline_by_key.get(scenario_key(scenario))
+        label = '{}/g{}/c{}/x{}'.format(*scenario_key(scenario))
+        if old is None:
+            print(f"{label:<28}  (기준 없음)")
+            continue
+        calls = sum(scenario['upstream_calls_per_request'].values())
+        old_calls = sum(old['upstream_calls_per_request'].values())
+        deltas = {
+            'p50': change(scenario['latency_ms']['p50'], old['latency_ms']['p50']),
+            'p95': change(scenario['latency_ms']['p95'], old['latency_ms']['p95']),
+            'rps': change(scenario['throughput_rps'], old['throughput_rps']),
+            'calls': change(calls, old_calls),
+        }
+
+        def cell(value, delta):
+            return f"{value:.1f} ({delta:+.0%})" if delta is not None else f"{value:.1f}"
+
+        print(f"{label:<28}{cell(scenario['latency_ms']['p50'], deltas['p50']):>18}"
+              f"{cell(scenario['latency_ms']['p95'], deltas['p95']):>18}"
+              f"{cell(scenario['throughput_rps'], deltas['rps']):>16}{cell(calls, deltas['calls']):>18}")
+        if max_regression is not None and any(
+                delta is not None and delta > max_regression for delta in (deltas['p95'], deltas['calls'])):
+            regressions.append(label)
+    return regressions
+
+
+def print_summary(results):
+    print(f"{'scenario':<28}{'p50':>10}{'p95':>10}{'p99':>10}{'rps':>8}{'threads':>9}{'rss MB':>8}  calls/req")
+    for s in results['scenarios']:
+        label = '{}/g{}/c{}/x{}'.format(*scenario_key(s))
+        calls = ' '.join(f"{name}={value:.1f}" for name, value in s['upstream_calls_per_request'].items())
+        print(f"{label:<28}{s['latency_ms']['p50']:>10.1f}{s['latency_ms']['p95']:>10.1f}"
+              f"{s['latency_ms']['p99']:>10.1f}{s['throughput_rps']:>8.2f}{s['peak_threads']:>9}"
+              f"{s['peak_rss_mb']:>8}  {calls}")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    endpoints = [endpoint for endpoint in args.endpoints.split(',') if endpoint]
+    for endpoint in endpoints:
+        if endpoint not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint: {endpoint}")
+
+    process, stub_url, config_specs = start_stubs(args)
+    try:
+        configure_environment(stub_url, args)
+        rng = random.Random(args.seed)
+        scenarios = []
+        for endpoint in endpoints:
+            for group_size in args.groups:
+                for candidates in args.candidates:
+                    for concurrency in args.concurrency:
+                        scenario = run_scenario(stub_url, endpoint, group_size, candidates, concurrency, args, rng)
+                        print('{}/g{}/c{}/x{}: p50 {:.0f}ms p95 {:.0f}ms, {} crashes'.format(
+                            *scenario_key(scenario), scenario['latency_ms']['p50'], scenario['latency_ms']['p95'],
+                            scenario['crashes']))
+                        scenarios.append(scenario)
+    finally:
+        process.terminate()
+
+    results = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'requests_per_scenario': args.requests,
+            'seed': args.seed,
+            'stubs': config_specs,
+        },
+        'scenarios': scenarios,
+    }
+    print_summary(results)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Saved results to {args.output}")
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Regressed beyond {args.max_regression:.0%}: {', '.join(regressions)}")
+            exit_code = 1
+    # 지연 수치와 상관없이 뷰 예외는 버그이므로 실패로 끝낸다
+    crashed = ['{}/g{}/c{}/x{}'.format(*scenario_key(s)) for s in scenarios if s['crashes']]
+    if crashed:
+        print(f"Requests crashed in: {', '.join(crashed)}")
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Kakao 로컬 API, ODsay searchPubTransPathT, OpenAI chat completions를 흉내 내는 로컬 스텁 서버.
+
+벤치마크에서 외부 API 대신 띄워 쓴다. 엔드포인트마다 응답 지연 분포, 에러 비율(HTTP 500),
+ODsay 호출 한도 초과 비율을 정할 수 있고 호출 수를 센다.
+"""
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+KAKAO = 'kakao'
+ODSAY = 'odsay'
+OPENAI = 'openai'
+
+
+class Latency:
+    """'fixed:MS', 'uniform:MIN_MS,MAX_MS', 'lognormal:MEDIAN_MS,SIGMA' 형식의 지연 분포."""
+
+    def __init__(self, spec='fixed:0'):
+        self.spec = spec
+        kind, _, args = spec.partition(':')
+        values = [float(v) for v in args.split(',') if v]
+        if kind == 'fixed':
+            self._sample = lambda rng: values[0] if values else 0.0
+        elif kind == 'uniform':
+            self._sample = lambda rng: rng.uniform(values[0], values[1])
+        elif kind == 'lognormal':
+            self._sample = lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+        else:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self, rng):
+        # 초 단위
+        return max(self._sample(rng), 0.0) / 1000
+
+    def __str__(self):
+        return self.spec
+
+
+class EndpointConfig:
+    def __init__(self, latency='fixed:0', error_rate=0.0, quota_rate=0.0):
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency)
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+
+    def as_dict(self):
+        return {'latency': str(self.latency), 'error_rate': self.error_rate, 'quota_rate': self.quota_rate}
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def stub_transit_minutes(sx, sy, ex, ey):
+    # 직선거리 기반 가짜 소요시간 (같은 구간이면 항상 같은 값)
+    distance = haversine_m(sx, sy, ex, ey)
+    jitter = (hash((round(sx, 4), round(sy, 4), round(ex, 4), round(ey, 4))) % 7) - 3
+    return max(int(8 + distance / 1000 * 2.8 + jitter), 1)
+
+
+class StubState:
+    def __init__(self, stations, configs, seed=0):
+        self.stations = stations
+        self.configs = configs
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {KAKAO: 0, ODSAY: 0, OPENAI: 0}
+        self.errors = {KAKAO: 0, ODSAY: 0, OPENAI: 0}
+
+    def draw(self, endpoint):
+        # -> (지연(초), 'error' | 'quota' | None)
+        config = self.configs[endpoint]
+        with self.lock:
+            self.calls[endpoint] += 1
+            delay = config.latency.sample(self.rng)
+            roll = self.rng.random()
+        if roll < config.error_rate:
+            outcome = 'error'
+        elif roll < config.error_rate + config.quota_rate:
+            outcome = 'quota'
+        else:
+            outcome = None
+        if outcome is not None:
+            with self.lock:
+                self.errors[endpoint] += 1
+        return delay, outcome
+
+    def snapshot(self):
+        with self.lock:
+            return {'calls': dict(self.calls), 'errors': dict(self.errors)}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond(self, endpoint, build):
+        delay, outcome = self.state.draw(endpoint)
+        time.sleep(delay)
+        if outcome == 'error':
+            self._send_json({'error': 'stub failure'}, status=500)
+        else:
+            self._send_json(build(outcome == 'quota'))
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if parts.path == '/__stats':
+            self._send_json(self.state.snapshot())
+        elif parts.path == '/v2/local/geo/coord2regioncode.json':
+            self._respond(KAKAO, lambda quota: self.region(query))
+        elif parts.path == '/v2/local/search/keyword.json':
+            self._respond(KAKAO, lambda quota: self.keyword(query))
+        elif parts.path == '/v1/api/searchPubTransPathT':
+            self._respond(ODSAY, lambda quota: self.transit(query, quota))
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if urlsplit(self.path).path == '/v1/chat/completions':
+            self._respond(OPENAI, lambda quota: self.completion(payload))
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def region(self, query):
+        return {'documents': [{'region_type': 'H', 'region_1depth_name': '서울특별시', 'region_2depth_name': '중구'}]}
+
+    def keyword(self, query):
+        x, y = float(query.get('x', 126.978)), float(query.get('y', 37.5665))
+        radius = float(query.get('radius', 20000))
+        nearby = sorted(
+            (haversine_m(x, y, station['x'], station['y']), station) for station in self.state.stations)
+        documents = [
+            {'id': station['station_code'], 'place_name': f"{station['station_name']} 지하철",
+             'x': str(station['x']), 'y': str(station['y'])}
+            for distance, station in nearby[:15] if distance <= radius
+        ]
+        return {'documents': documents, 'meta': {'total_count': len(documents)}}
+
+    def transit(self, query, quota):
+        if quota:
+            return {'error': [{'code': '429', 'message': '일일 호출 한도 초과'}]}
+        minutes = stub_transit_minutes(*(float(query[key]) for key in ('SX', 'SY', 'EX', 'EY')))
+        return {'result': {'path': [{'info': {'totalTime': minutes}}, {'info': {'totalTime': minutes + 6}}]}}
+
+    def completion(self, payload):
+        prompt = payload['messages'][-1]['content']
+        if payload.get('response_format', {}).get('type') == 'json_object' and '{' in prompt:
+            # 배치 프롬프트 끝의 JSON 예시를 채워서 돌려준다
+            example = json.loads(prompt[prompt.index('{'):])
+            content = json.dumps({
+                station_name: {view_type: f'{station_name}은 만나기 좋은 곳이에요. ({view_type})' for view_type in views}
+                for station_name, views in example.items()
+            }, ensure_ascii=False)
+        else:
+            content = '만나기 좋은 곳이에요.'
+        return {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'model': payload.get('model', 'gpt-3.5-turbo'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(prompt), 'completion_tokens': len(content), 'total_tokens': len(prompt) + len(content)},
+        }
+
+
+class StubServer:
+    """스텁 서버를 백그라운드 스레드에서 띄운다. base_url 하나로 세 API를 모두 받는다."""
+
+    def __init__(self, stations, configs, host='127.0.0.1', port=0, seed=0):
+        self.state = StubState(stations, configs, seed=seed)
+        handler = type('BoundStubHandler', (StubHandler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def snapshot(self):
+        return self.state.snapshot()
@@ -0,0 +1,33 @@
+# gunicorn -c gunicorn.conf.py
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+# 기본은 WSGI sync 워커. find_optimal_station_stream(SSE)은 ASGI에서만 이벤트를 만들어지는 대로 보내고
+# WSGI에서는 끝까지 모은 뒤 한 번에 보내므로, SSE를 쓰려면 GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker
+# (pip install uvicorn)로 띄운다. 워커 종류에 맞춰 WSGI/ASGI 앱을 고른다
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+wsgi_app = ('WhereShallWeMeet.asgi:application' if worker_class.startswith('uvicorn.')
+            else 'WhereShallWeMeet.wsgi:application')
+
+# 앱을 마스터에서 한 번 불러온 뒤 워커를 fork한다. 워커는 역 테이블/공간 인덱스를 copy-on-write로 같이 쓴다
+preload_app = True
+
+
+def when_ready(server):
+    from django.db import connections
+
+    from FindBestStation.spatial import get_station_index
+
+    # 역 카탈로그(build_station_catalog)가 있으면 mmap으로 열고, 없으면 DB에서 한 번 읽는다
+    index = get_station_index()
+    server.log.info("Preloaded %d stations (%s)", len(index),
+                    index.table.catalog.path if index.table.catalog is not None else 'database')
+    # DB 연결을 워커들이 나눠 갖지 않도록 fork 전에 닫는다
+    connections.close_all()
+    # 지금까지 만든 객체를 GC 대상에서 빼서, 워커의 GC가 참조 카운트 헤더를 건드려 페이지를 복사하지 않게 한다
+    gc.freeze()